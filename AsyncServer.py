@@ -0,0 +1,142 @@
+import asyncio, socket
+from time import monotonic
+
+from ServerWorker import ServerWorker
+from PacingScheduler import PacingScheduler
+from Rtcp import RtcpServer
+from UdpSender import sendPackets
+from SessionManager import sessionManager, REAP_INTERVAL
+
+RTSP_BACKLOG = 1024
+RTP_SEND_BUFFER = 4 * 1024 * 1024
+
+
+class AsyncServerWorker(ServerWorker):
+    """ServerWorker driven by an asyncio event loop instead of threads.
+
+    RTSP handling is inherited unchanged; only the transport hooks differ.
+    """
+
+    def __init__(self, clientInfo, transport, server):
+        ServerWorker.__init__(self, clientInfo)
+        self.transport = transport
+        self.rtpSocket = server.rtpSocket
+        self.scheduler = server.scheduler
+        self.rtcp = server.rtcp
+        self.sessionManager = server.sessionManager
+        self.server = server
+
+    def startStreaming(self):
+        """Start sending RTP packets at the frame rate of the media."""
+        self.schedule()
+        self.server.wakeup.set()
+
+    def sendPackets(self, packets, address, frame=None):
+        """Send a batch of RTP packets through the shared non-blocking UDP socket. Return the number sent."""
+        return sendPackets(self.rtpSocket, packets, address, frame)
+
+    def sendReply(self, reply):
+        """Write an encoded RTSP reply to the control connection."""
+        self.transport.write(reply)
+
+    def expire(self):
+        """Close the control connection of an idle session; connection_lost then releases it."""
+        self.transport.close()
+
+
+class RtspProtocol(asyncio.Protocol):
+    """One RTSP control connection."""
+
+    def __init__(self, server):
+        self.server = server
+        self.worker = None
+
+    def connection_made(self, transport):
+        clientInfo = {}
+        clientInfo['rtspSocket'] = (transport.get_extra_info('socket'), transport.get_extra_info('peername'))
+        self.worker = AsyncServerWorker(clientInfo, transport, self.server)
+        self.server.sessions.add(self.worker)
+        self.server.sessionManager.track(self.worker)
+
+    def data_received(self, data):
+        if not self.worker.receiveRtsp(data):
+            self.worker.transport.close()
+
+    def connection_lost(self, exc):
+        self.worker.closeSession()
+        self.server.sessionManager.untrack(self.worker)
+        self.server.sessions.discard(self.worker)
+
+
+class RtcpProtocol(asyncio.DatagramProtocol):
+    """The RTCP port, shared by every session."""
+
+    def __init__(self, rtcp):
+        self.rtcp = rtcp
+
+    def datagram_received(self, data, address):
+        self.rtcp.dispatch(data, address)
+
+
+class AsyncServer:
+    """RTSP/RTP server handling every session on a single event loop."""
+
+    def __init__(self, port, reusePort=False):
+        self.port = port
+        self.reusePort = reusePort  # Share the port with other server processes
+        self.sessions = set()
+        self.rtpSocket = None
+        self.scheduler = PacingScheduler()
+        self.rtcp = RtcpServer()
+        self.sessionManager = sessionManager
+        self.wakeup = None
+        self.pacer = None
+        self.reaper = None
+
+    async def pace(self):
+        """Send the frames that are due, then sleep until the next deadline."""
+        while True:
+            self.scheduler.runDue(monotonic())
+            self.wakeup.clear()
+            deadline = self.scheduler.nextDeadline()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), None if deadline is None else max(0, deadline - monotonic()))
+            except asyncio.TimeoutError:
+                pass
+
+    async def reap(self):
+        """Expire idle sessions, on the event loop that owns their connections."""
+        while True:
+            await asyncio.sleep(REAP_INTERVAL)
+            self.sessionManager.reap()
+
+    async def serve(self):
+        """Open the shared RTP socket and the RTSP listener, then serve forever."""
+        loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.pacer = loop.create_task(self.pace())
+        self.reaper = loop.create_task(self.reap())
+        # Datagrams that do not fit the send buffer are dropped, like on the wire
+        self.rtpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.rtpSocket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, RTP_SEND_BUFFER)
+        self.rtpSocket.setblocking(False)
+        # Receiver reports arrive on the port after the RTSP port
+        await loop.create_datagram_endpoint(lambda: RtcpProtocol(self.rtcp), local_addr=('0.0.0.0', self.port + 1), reuse_port=self.reusePort or None)
+        server = await loop.create_server(lambda: RtspProtocol(self), '', self.port, backlog=RTSP_BACKLOG, reuse_address=True, reuse_port=self.reusePort or None)
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        raiseFileLimit()
+        asyncio.run(self.serve())
+
+
+def raiseFileLimit():
+    """Raise the open file limit to its hard maximum, one RTSP socket is held per session."""
+    try:
+        import resource
+    except ImportError:  # Not available on Windows
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
@@ -0,0 +1,225 @@
+import socket, struct, threading, logging, time
+from random import randint
+
+from FrameCache import CachedStream
+from PrefetchStream import openPrefetched
+from MediaCatalog import probeMedia
+from RtpPacket import RtpPacket, CLOCK_RATE
+from RtpJpeg import fragmentFrame, DEFAULT_MTU
+from UdpSender import sendPackets
+from Retransmit import RetransmitBuffer
+from FrameAnalysis import openRepeatFilter
+import Metrics
+
+logger = logging.getLogger(__name__)
+
+MULTICAST_TTL = 1  # Keep multicast on the local network unless told otherwise
+
+
+class Channel:
+    """A live-style program shared by every viewer that sets it up.
+
+    One reader and packetizer produce each RTP packet once per frame; the
+    packets then go either to an IP multicast group, or to every playing
+    subscriber by unicast. The media loops, and viewers join wherever the
+    channel currently is, so server work grows with channels, not viewers.
+    Near-duplicate frames are not sent; a viewer joining during a static
+    scene gets its first picture at the next refresh.
+    """
+
+    def __init__(self, name, filename, group=None, mtu=DEFAULT_MTU, ttl=MULTICAST_TTL, staticThreshold=0):
+        self.name = name
+        self.filename = filename
+        self.info = probeMedia(filename, writeIndex=True)  # For DESCRIBE
+        self.stream = openPrefetched(CachedStream(filename))
+        self.repeats = openRepeatFilter(filename, staticThreshold)
+        self.frameRate = self.stream.frameRate
+        self.group = group  # (address, port) for multicast, None for unicast fan-out
+        self.mtu = mtu
+        self.ssrc = randint(0, 0xFFFFFFFF)
+        self.rtpSeq = randint(0, 0xFFFF)
+        self.rtpTimestampBase = randint(0, 0xFFFFFFFF)
+        self.framesSent = 0
+        self.retransmit = RetransmitBuffer()  # Shared by every viewer
+        self.rtcp = None
+
+        self.lock = threading.Lock()
+        self.subscribers = ()  # Playing sessions, replaced (never mutated) on change
+        self.scheduler = None
+        self.pacing = None
+
+        self.rtpSocket = None
+        if group:
+            self.rtpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.rtpSocket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+
+    def transport(self):
+        """Return the Transport header value a SETUP reply should carry, or None for unicast."""
+        if not self.group:
+            return None
+        return 'RTP/UDP;multicast;destination={};port={};ttl={}'.format(self.group[0], self.group[1], MULTICAST_TTL)
+
+    def bitrate(self):
+        """Return the bitrate one more viewer costs: nothing for multicast."""
+        return 0 if self.group else self.stream.bitrate()
+
+    def subscribe(self, session, scheduler):
+        """Start sending to a session, starting the channel if it was idle."""
+        with self.lock:
+            if session in self.subscribers:
+                return
+            self.subscribers += (session,)
+            if self.rtcp is None:  # NACKs about the channel come to the server's RTCP port
+                self.rtcp = session.rtcp
+                self.rtcp.register(self.ssrc, self)
+            if self.pacing is None:
+                self.scheduler = scheduler
+                self.pacing = scheduler.add(self, self.frameRate)
+                logger.info("Channel %s started", self.name)
+
+    def unsubscribe(self, session):
+        """Stop sending to a session, stopping the channel when nobody is left."""
+        with self.lock:
+            if session not in self.subscribers:
+                return
+            self.subscribers = tuple(s for s in self.subscribers if s is not session)
+            if not self.subscribers and self.pacing is not None:
+                self.scheduler.remove(self.pacing)
+                self.pacing = None
+                logger.info("Channel %s stopped", self.name)
+
+    def sendFrame(self):
+        """Packetize the next frame once and send it to the group or to every subscriber."""
+        data = self.stream.nextFrame()
+        if data is None:  # Loop the program
+            self.stream.seek(0)
+            data = self.stream.nextFrame()
+            if data is None:
+                return
+
+        # Media clock keeps running across loops
+        timestamp = self.rtpTimestampBase + int(self.framesSent * CLOCK_RATE / self.frameRate)
+        self.framesSent += 1
+        if self.repeats and self.repeats.isRepeat(self.stream.frameNbr(), data, time.monotonic()):
+            Metrics.framesRepeated.inc()
+            return
+        packets = self.makeRtpFragments(data, timestamp)
+        self.retransmit.store(packets)
+        size = len(data) + len(packets) * len(packets[0][0])
+
+        if self.group:
+            try:
+                sent = sendPackets(self.rtpSocket, packets, self.group, data)
+            except OSError:
+                Metrics.sendErrors.inc()
+                logger.warning("Channel %s: multicast send failed", self.name, exc_info=True)
+                return
+            Metrics.framesSent.inc()
+            Metrics.packetsSent.inc(sent)
+            Metrics.bytesSent.inc(size)
+            return
+
+        frameNumber = self.stream.frameNbr()
+        for session in self.subscribers:
+            try:
+                session.sendChannelPackets(self, packets, data, frameNumber, size)
+            except Exception:  # One failing viewer must not cost the others the frame
+                Metrics.sendErrors.inc()
+                logger.warning("Channel %s: send to a subscriber failed", self.name, exc_info=True)
+
+    def subscribersOn(self, address):
+        """Return the subscribers receiving on the host of address, or all of them if address is None."""
+        found = []
+        for session in self.subscribers:
+            try:
+                host = session.rtpAddress()[0]
+            except KeyError:  # Torn down since the list was taken
+                continue
+            if address is None or host == address[0]:
+                found.append(session)
+        return found
+
+    def handleReceiverReport(self, report, address=None):
+        """Channels send at one rate to everyone; reports only keep the reporting viewers alive."""
+        for session in self.subscribersOn(address):
+            session.sessionManager.touch(session)
+
+    def handleNack(self, seqs, address):
+        """Retransmit lost packets to the group, or to the subscribers on the reporting host."""
+        packets = self.retransmit.lookup(seqs)
+        Metrics.nackedPackets.inc(len(seqs))
+        if not packets:
+            return
+        if self.group:
+            Metrics.retransmits.inc(sendPackets(self.rtpSocket, packets, self.group))
+            return
+        for session in self.subscribersOn(address):
+            try:
+                sent = session.sendChannelPackets(self, packets)
+            except Exception:
+                logger.warning("Channel %s: retransmission to a subscriber failed", self.name, exc_info=True)
+                continue
+            if sent:
+                Metrics.retransmits.inc(sent)
+
+    def makeRtpFragments(self, frame, timestamp):
+        """RTP-packetize a video frame into MTU-sized (header, payload) packets."""
+        packets = []
+        for jpegHeader, chunk, last in fragmentFrame(frame, self.mtu):
+            self.rtpSeq = (self.rtpSeq + 1) & 0xFFFF
+            rtpPacket = RtpPacket()
+            rtpPacket.encode(2, 0, 0, 0, self.rtpSeq, 1 if last else 0, 26, self.ssrc, chunk, timestamp=timestamp)
+            header, payload = rtpPacket.getBuffers()
+            packets.append((header + jpegHeader, payload))
+        return packets
+
+    def close(self):
+        """Stop the channel and release its media file and socket."""
+        with self.lock:
+            if self.pacing is not None:
+                self.scheduler.remove(self.pacing)
+                self.pacing = None
+            self.subscribers = ()
+        if self.rtcp is not None:
+            self.rtcp.unregister(self.ssrc)
+            self.rtcp = None
+        self.stream.close()
+        if self.rtpSocket:
+            self.rtpSocket.close()
+
+
+channels = {}  # name -> Channel, looked up by SETUP
+
+
+def addChannel(spec, mtu=DEFAULT_MTU, staticThreshold=0):
+    """Create a channel from a "NAME=FILE" or "NAME=FILE,GROUP:PORT" spec and register it."""
+    name, _, rest = spec.partition('=')
+    filename, _, group = rest.partition(',')
+    if not name or not filename:
+        raise ValueError("bad channel spec: " + spec)
+    if group:
+        address, _, port = group.rpartition(':')
+        group = (address, int(port))
+    channels[name] = channel = Channel(name, filename, group or None, mtu, staticThreshold=staticThreshold)
+    return channel
+
+
+def parseTransport(value):
+    """Parse an RTSP Transport header value into a dict of its parameters."""
+    params = {}
+    for part in value.split(';'):
+        key, _, val = part.strip().partition('=')
+        params[key.strip().lower()] = val.strip()
+    return params
+
+
+def joinGroup(group, port):
+    """Return a UDP socket bound to port and joined to the multicast group."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, 'SO_REUSEPORT'):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(('', port))
+    membership = struct.pack('4s4s', socket.inet_aton(group), socket.inet_aton('0.0.0.0'))
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+    return sock
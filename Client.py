@@ -1,12 +1,26 @@
 from tkinter import Button, Label, W, E, N, S, messagebox
-from PIL import Image, ImageTk
-import socket, threading, sys, traceback, os
+from PIL import ImageTk
+import socket, threading, sys, traceback, logging
 import time
+from random import randint
 
 from RtpPacket import RtpPacket
+from RtpJpeg import FrameReassembler
+from FramePipeline import FramePipeline
+from JitterBuffer import JitterBuffer
+from Channel import parseTransport, joinGroup
+from Rtcp import RTCP_INTERVAL, encodeNack
+from ReceiverStats import ReceiverStats
+from Retransmit import NackTracker
+from Fec import FecDecoder, FEC_PT
+from RtspParser import RtspParser, RtspParseError, formatMessage
+from Recorder import Recorder
 
-CACHE_FILE_NAME = "cache-"
-CACHE_FILE_EXT = ".jpg"
+logger = logging.getLogger(__name__)
+
+RECV_BUFFER_SIZE = 65536
+PLAYOUT_POLL = 0.1  # seconds
+DEFAULT_SESSION_TIMEOUT = 60  # seconds, if the server does not say
 
 
 class Client:
@@ -20,24 +34,14 @@ class Client:
     PAUSE = 2
     TEARDOWN = 3
     DESCRIBE = 4
+    OPTIONS = 5
 
     state = INIT  # Initial state
 
-    def __init__(self, master, serveraddr, serverport, rtpport, filename):
+    def __init__(self, master, serveraddr, serverport, rtpport, filename, fec=0, record=None):
         self.master = master
         self.master.protocol("WM_DELETE_WINDOW", self.handler)
 
-        # Statistic variables
-        self.statStartTime = 0
-        self.statTotalPlayTime = 0
-        self.statTotalByte = 0
-        self.statLostPack = 0
-        self.statHighestSq = 0
-        self.statLostRate = 0
-        self.statDataRate = 0
-        self.framelength = 0
-        # --------------------
-
         self.createWidgets()
         self.serverAddr = serveraddr
         self.serverPort = int(serverport)
@@ -46,21 +50,36 @@ class Client:
         self.rtspSeq = 0
         self.sessionId = 0
         self.requestSent = -1
+        self.replySeq = 0  # CSeq of the last reply received
+        self.sessionTimeout = DEFAULT_SESSION_TIMEOUT
+        self.parser = RtspParser()
         self.teardownAcked = 0
         self.connectToServer()
-        self.frameNbr = 0
+        self.reassembler = FrameReassembler()
+        self.jitterBuffer = JitterBuffer()
+        self.reception = ReceiverStats()  # Loss, jitter and bitrate of the RTP stream
+        self.nack = NackTracker()
+        self.fecGroup = fec  # K to ask the server for, 0 for no FEC
+        self.fec = None  # FecDecoder, once the server agreed
+        self.ssrc = randint(0, 0xFFFFFFFF)
+        self.rtcpSocket = None
+        self.pipeline = FramePipeline(self.master, self.updateMovie)
+        self.pipeline.start()
+        self.recorder = Recorder(record) if record else None  # Received frames are also saved here
 
         self.SETUP_STR = 'SETUP'
         self.PLAY_STR = 'PLAY'
         self.PAUSE_STR = 'PAUSE'
         self.TEARDOWN_STR = 'TEARDOWN'
         self.DESCRIBE_STR = 'DESCRIBE'
+        self.OPTIONS_STR = 'OPTIONS'
 
         self.RTSP_VER = "RTSP/1.0"
         self.TRANSPORT = "RTP/UDP"
 
         # Remove SETUP button
         self.setupMovie()
+        self.master.after(int(self.sessionTimeout * 1000 / 2), self.keepAlive)
     def createWidgets(self):
         """Build GUI."""
         # Create Setup button
@@ -112,6 +131,16 @@ class Client:
         self.labelData = Label(self.master)
         self.labelData.grid(row=4, column=2, padx=2, pady=2, sticky=E)
 
+        self.label4 = Label(self.master, text="Retransmitted: ")
+        self.label4.grid(row=5, column=1, padx=2, pady=2, sticky=E)
+        self.labelRetransmit = Label(self.master)
+        self.labelRetransmit.grid(row=5, column=2, padx=2, pady=2, sticky=E)
+
+        self.label5 = Label(self.master, text="Recorded: ")
+        self.label5.grid(row=6, column=1, padx=2, pady=2, sticky=E)
+        self.labelRecorded = Label(self.master)
+        self.labelRecorded.grid(row=6, column=2, padx=2, pady=2, sticky=E)
+
     def setupMovie(self):
         """Setup button handler."""
         if self.state == self.INIT:
@@ -125,8 +154,10 @@ class Client:
     def exitClient(self):
         """Teardown button handler."""
         self.sendRtspRequest(self.TEARDOWN)
+        self.pipeline.stop()
+        if self.recorder:
+            self.recorder.close()
         self.master.destroy()  # Close the gui window
-        os.remove(CACHE_FILE_NAME + str(self.sessionId) + CACHE_FILE_EXT)  # Delete the cache image from video
 
     def pauseMovie(self):
         """Pause button handler."""
@@ -136,52 +167,41 @@ class Client:
     def playMovie(self):
         """Play button handler."""
         if self.state == self.READY:
-            # Create a new thread to listen for RTP packets
-            threading.Thread(target=self.listenRtp).start()
+            # Create new threads to listen for RTP packets and to play them out
             self.playEvent = threading.Event()
             self.playEvent.clear()
+            self.jitterBuffer.reset()
+            self.nack.reset()
+            self.reception.rebase()
+            threading.Thread(target=self.listenRtp).start()
+            threading.Thread(target=self.playout).start()
+            threading.Thread(target=self.sendReports).start()
             self.sendRtspRequest(self.PLAY)
-            self.statStartTime = time.time()
 
     def listenRtp(self):
         """Listen for RTP packets."""
         while True:
             try:
-                data = self.rtpSocket.recv(20480)
-
-                # Time
-                curTime = time.time()
-                self.statTotalPlayTime += curTime - self.statStartTime
-                self.statStartTime = curTime
-                # -----------------------------
-
+                data = self.rtpSocket.recv(RECV_BUFFER_SIZE)
                 if data:
                     rtpPacket = RtpPacket()
                     rtpPacket.decode(data)
 
-                    currFrameNbr = rtpPacket.seqNum()
-                    print("Received frame", currFrameNbr)
-
-                    # Calculate statistics
-
-                    # Data rate
-                    self.statDataRate = 0 if self.statTotalPlayTime == 0 else (self.statTotalByte / self.statTotalPlayTime)
-
-                    # Lost rate
-                    if currFrameNbr != self.frameNbr + 1:
-                        self.statLostPack += 1
-                    if currFrameNbr > self.statHighestSq:
-                        self.statHighestSq = currFrameNbr
-                    if self.statHighestSq != 0:
-                        self.statLostRate = self.statLostPack / self.statHighestSq
-
-                    # Total data
-                    self.statTotalByte += len(data)
-                    # ----------------------------------------------------
-
-                    if currFrameNbr > self.frameNbr:  # Discard the old packet
-                        self.frameNbr = currFrameNbr
-                        self.updateMovie(self.writeFrame(rtpPacket.getPayload()))
+                    # Parity packets only serve to rebuild a lost media packet
+                    if rtpPacket.payloadType() == FEC_PT:
+                        rtpPacket = self.fec.parity(rtpPacket) if self.fec else None
+                        if rtpPacket is None:
+                            continue
+                    elif self.fec:
+                        self.fec.media(rtpPacket)
+
+                    logger.debug("Received packet %d", rtpPacket.seqNum())
+
+                    # Reordering and playout timing are up to the jitter buffer
+                    arrival = time.monotonic()
+                    self.reception.update(rtpPacket, arrival, len(data))
+                    self.requestLost(rtpPacket, arrival)
+                    self.jitterBuffer.push(rtpPacket, arrival)
             except:
                 # Stop listening upon requesting PAUSE or TEARDOWN
                 if self.playEvent.isSet():
@@ -197,23 +217,49 @@ class Client:
                         pass
                     break
 
-    def writeFrame(self, data):
-        """Write the received frame to a temp image file. Return the image file."""
-        cachename = CACHE_FILE_NAME + str(self.sessionId) + CACHE_FILE_EXT
-        file = open(cachename, "wb")
-        file.write(data)
-        file.close()
-        return cachename
-
-    def updateMovie(self, imageFile):
-        """Update the image file as video frame in the GUI."""
-        photo = ImageTk.PhotoImage(Image.open(imageFile))
+    def playout(self):
+        """Release RTP packets from the jitter buffer at their playout time and rebuild frames."""
+        while not self.playEvent.isSet() and self.teardownAcked == 0:
+            for rtpPacket in self.jitterBuffer.pop(time.monotonic()):
+                frame = self.reassembler.push(rtpPacket.timestamp(), rtpPacket.marker(), rtpPacket.getPayload())
+                if frame is not None and self.recorder:
+                    self.recorder.write(frame, rtpPacket.timestamp())
+                if frame:
+                    self.pipeline.submit(frame)
+            self.jitterBuffer.wait(time.monotonic(), PLAYOUT_POLL)
+
+    def requestLost(self, rtpPacket, arrival):
+        """NACK the packets missing before this one that can still make their playout time."""
+        self.nack.update(rtpPacket.seqNum(), arrival)
+        lost = self.nack.due(arrival, self.jitterBuffer.delay)
+        if lost and self.rtcpSocket:
+            try:
+                self.rtcpSocket.sendto(encodeNack(self.ssrc, rtpPacket.ssrc(), lost), (self.serverAddr, self.serverPort + 1))
+            except OSError:
+                pass
+
+    def sendReports(self):
+        """Send RTCP receiver reports to the server while playing."""
+        while not self.playEvent.wait(RTCP_INTERVAL) and self.teardownAcked == 0:
+            report = self.reception.report(self.ssrc)
+            if report and self.rtcpSocket:
+                try:
+                    self.rtcpSocket.sendto(report.encode(), (self.serverAddr, self.serverPort + 1))
+                except OSError:
+                    pass
+
+    def updateMovie(self, image):
+        """Update the decoded image as video frame in the GUI. Runs on the Tk main thread."""
+        photo = ImageTk.PhotoImage(image)
         self.label.configure(image=photo, height=288)
         self.label.image = photo
 
-        self.labelTotalByte['text'] = str(self.statTotalByte) + " bytes"
-        self.labelLostRate['text'] = "{:.2f}".format(self.statLostRate)
-        self.labelData['text'] = "{:.2f} bytes/s".format(self.statDataRate)
+        self.labelTotalByte['text'] = str(self.reception.bytes) + " bytes"
+        self.labelLostRate['text'] = "{:.2f}".format(self.reception.lossRate())
+        self.labelData['text'] = "{:.2f} bytes/s".format(self.reception.bitrate(time.monotonic()) / 8)
+        self.labelRetransmit['text'] = "{} of {} lost".format(self.nack.recovered, self.nack.nacked)
+        if self.recorder:
+            self.labelRecorded['text'] = "{} frames, {} dropped".format(self.recorder.framesWritten, self.recorder.framesDropped)
 
     def connectToServer(self):
         """Connect to the Server. Start a new RTSP/TCP session."""
@@ -228,43 +274,63 @@ class Client:
         # Setup request
         if requestCode == self.SETUP and self.state == self.INIT:
             threading.Thread(target=self.recvRtspReply).start()
-            self.rtspSeq = self.rtspSeq + 1
-            request = "{} {} {}\nCSeq: {}\nTransport: {}; client_port: {}".format(self.SETUP_STR, self.fileName, self.RTSP_VER, self.rtspSeq, self.TRANSPORT, self.rtpPort)
+            transport = "{}; client_port: {}".format(self.TRANSPORT, self.rtpPort)
+            if self.fecGroup:
+                transport += "; fec={}".format(self.fecGroup)
+            transport += "; x-repeat"  # Empty frames repeat the previous one
+            method, headers = self.SETUP_STR, {'Transport': transport}
             self.requestSent = self.SETUP
 
         elif requestCode == self.PLAY and self.state == self.READY:
-            self.rtspSeq = self.rtspSeq + 1
-            request = "{} {} {}\nCSeq: {}\nSession: {}".format(self.PLAY_STR, self.fileName, self.RTSP_VER, self.rtspSeq, self.sessionId)
+            method, headers = self.PLAY_STR, {'Session': self.sessionId}
             self.requestSent = self.PLAY
 
         elif requestCode == self.PAUSE and self.state == self.PLAYING:
-            self.rtspSeq = self.rtspSeq + 1
-            request = "{} {} {}\nCSeq: {}\nSession: {}".format(self.PAUSE_STR, self.fileName, self.RTSP_VER, self.rtspSeq, self.sessionId)
+            method, headers = self.PAUSE_STR, {'Session': self.sessionId}
             self.requestSent = self.PAUSE
 
         elif requestCode == self.TEARDOWN:
-            self.rtspSeq = self.rtspSeq + 1
-            request = "{} {} {}\nCSeq: {}\nSession: {}".format(self.TEARDOWN_STR, self.fileName, self.RTSP_VER, self.rtspSeq, self.sessionId)
+            method, headers = self.TEARDOWN_STR, {'Session': self.sessionId}
             self.requestSent = self.TEARDOWN
 
         elif requestCode == self.DESCRIBE:
-            self.rtspSeq = self.rtspSeq + 1
-            request = "{} {} {}\nCSeq: {}\nSession: {}".format(self.DESCRIBE_STR, self.fileName, self.RTSP_VER, self.rtspSeq, self.sessionId)
+            method, headers = self.DESCRIBE_STR, {'Session': self.sessionId}
             self.requestSent = self.DESCRIBE
 
+        elif requestCode == self.OPTIONS:
+            method, headers = self.OPTIONS_STR, {'Session': self.sessionId}
+            self.requestSent = self.OPTIONS
+
         else:
             return
 
-        self.rtspSocket.send(request.encode())
+        self.rtspSeq = self.rtspSeq + 1
+        request = formatMessage("{} {} {}".format(method, self.fileName, self.RTSP_VER), dict(CSeq=self.rtspSeq, **headers))
+        self.rtspSocket.send(request)
 
-        print('\nData sent:\n' + request)
+        logger.debug('Data sent:\n%s', request)
+
+    def keepAlive(self):
+        """Send OPTIONS while paused, so the server does not expire the session. Runs on the Tk main thread."""
+        if self.state == self.INIT and self.teardownAcked:
+            return
+        if self.state == self.READY and self.replySeq == self.rtspSeq:  # No request outstanding
+            self.sendRtspRequest(self.OPTIONS)
+        self.master.after(int(self.sessionTimeout * 1000 / 2), self.keepAlive)
 
     def recvRtspReply(self):
         """Receive RTSP reply from the server."""
         while True:
-            reply = self.rtspSocket.recv(1024)
+            try:
+                data = self.rtspSocket.recv(RECV_BUFFER_SIZE)
+                replies = self.parser.feed(data)
+            except (OSError, RtspParseError):
+                logger.warning("RTSP connection failed", exc_info=True)
+                break
+            if not data:
+                break
 
-            if reply:
+            for reply in replies:
                 self.parseRtspReply(reply)
 
             # Close the RTSP socket upon requesting Teardown
@@ -273,28 +339,39 @@ class Client:
                 self.rtspSocket.close()
                 break
 
-    def parseRtspReply(self, data):
-        """Parse the RTSP reply from the server."""
-        
-        lines = data.split(b'\n')
-        if '404 NOT_FOUND' in data.decode(): 
-            messagebox.showwarning("Warning", "File not found!")
-            self.exitClient()
-            
-        seqNum = int(lines[1].split(b' ')[1])
+    def parseRtspReply(self, reply):
+        """Process a parsed RTSP reply from the server. Runs on the RTSP thread, so Tk calls go through master.after()."""
+        if reply.status == 404:
+            self.master.after(0, self.abort, "File not found!")
+            return
+        if reply.status == 453:
+            self.master.after(0, self.abort, "The server is full, try again later.")
+            return
+
+        seqNum = int(reply.header('CSeq', '0'))
 
         # Process only if the server reply's sequence number is the same as the request's
         if seqNum == self.rtspSeq:
-            session = int(lines[2].split(b' ')[1])
+            self.replySeq = seqNum
+            session = int(reply.session() or 0)  # "Session: id;timeout=N"
             # New RTSP session ID
             if self.sessionId == 0:
                 self.sessionId = session
+                timeout = reply.header('Session', '').partition('timeout=')[2]
+                if timeout.isdigit():
+                    self.sessionTimeout = int(timeout)
 
-            if self.sessionId == session and int(lines[0].split(b' ')[1]) == 200:
+            if self.sessionId == session and reply.status == 200:
 
                 if self.requestSent == self.SETUP:
                     self.state = self.READY
-                    self.openRtpPort()
+                    transport = parseTransport(reply.header('Transport', ''))
+                    if transport.get('fec'):
+                        self.fec = FecDecoder()
+                    if 'multicast' in transport:
+                        self.joinChannel(transport['destination'], int(transport['port']))
+                    else:
+                        self.openRtpPort()
 
                 elif self.requestSent == self.PLAY:
                     self.state = self.PLAYING
@@ -308,9 +385,31 @@ class Client:
                     self.teardownAcked = 1
 
                 elif self.requestSent == self.DESCRIBE:
-                    message = data.split(b'\r\n')
-                    info = "Protocol: {}\nFile type: {}".format(message[-2][2:].decode(), message[-1][2:].decode())
-                    messagebox.showinfo("Information", info)
+                    attributes = {}
+                    for line in reply.body.splitlines():
+                        if line.startswith('a='):
+                            name, _, value = line[2:].partition(':')
+                            attributes[name] = value
+                    info = "Range: {}\nResolution: {}\nFrame rate: {}\nFrames: {}".format(
+                        attributes.get('range', '-'), attributes.get('x-dimensions', '-').replace(',', 'x'),
+                        attributes.get('framerate', '-'), attributes.get('x-frame-count', '-'))
+                    self.master.after(0, messagebox.showinfo, "Information", info)
+
+    def abort(self, message):
+        """Warn the user, then close the client."""
+        messagebox.showwarning("Warning", message)
+        self.exitClient()
+
+    def joinChannel(self, group, port):
+        """Receive RTP of a broadcast channel from its multicast group."""
+        try:
+            self.rtpSocket = joinGroup(group, port)
+        except OSError:
+            self.master.after(0, messagebox.showwarning, 'Unable to Join', 'Unable to join group {} PORT={}'.format(group, port))
+            return
+        self.rtpSocket.settimeout(0.5)
+        self.rtpPort = port
+        self.openRtcpPort()
 
     def openRtpPort(self):
         """Open RTP socket binded to a specified port."""
@@ -322,7 +421,16 @@ class Client:
             self.state = self.READY
             self.rtpSocket.bind(('', self.rtpPort))
         except:
-            messagebox.showwarning('Unable to Bind', 'Unable to bind PORT={}'.format(self.rtpPort))
+            self.master.after(0, messagebox.showwarning, 'Unable to Bind', 'Unable to bind PORT={}'.format(self.rtpPort))
+        self.openRtcpPort()
+
+    def openRtcpPort(self):
+        """Open the socket receiver reports are sent from, on the RTP port plus one when free."""
+        self.rtcpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self.rtcpSocket.bind(('', self.rtpPort + 1))
+        except OSError:
+            self.rtcpSocket.bind(('', 0))
 
     def handler(self):
         """Handler on explicitly closing the GUI window."""
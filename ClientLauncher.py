@@ -10,12 +10,14 @@ if __name__ == "__main__":
         serverPort = sys.argv[2]
         rtpPort = sys.argv[3]
         fileName = sys.argv[4]
+        fec = int(sys.argv[5]) if len(sys.argv) > 5 else 0
+        record = sys.argv[6] if len(sys.argv) > 6 else None
     except:
-        print("[Usage: ClientLauncher.py Server_name Server_port RTP_port Video_file]\n")
+        print("[Usage: ClientLauncher.py Server_name Server_port RTP_port Video_file [FEC_group_size [Record_file]]]\n")
 
     root = Tk()
 
     # Create a new client
-    app = Client(root, serverAddr, serverPort, rtpPort, fileName)
+    app = Client(root, serverAddr, serverPort, rtpPort, fileName, fec, record)
     app.master.title("RTPClient")
     root.mainloop()
@@ -0,0 +1,129 @@
+import struct
+from collections import deque
+
+from RtpPacket import RtpPacket, HEADER_SIZE
+
+FEC_PT = 127  # Dynamic payload type of the parity packets
+MAX_GROUP = 16  # Largest K a server accepts
+DECODE_WINDOW = 512  # Media packets a receiver keeps to rebuild from
+
+# Parity header, in front of the XOR of the protected payloads: first protected
+# sequence number, packet count K, XOR of the marker bits, XOR of the payload
+# lengths, XOR of the timestamps
+FEC_HEADER = struct.Struct('!HBBHI')
+
+
+class FecEncoder:
+    """XOR parity over every group of K consecutive media packets of a stream.
+
+    Parity packets carry the SSRC of the media stream with payload type
+    FEC_PT and a sequence number counter of their own, so receivers that
+    do not know FEC can drop them by payload type.
+    """
+
+    def __init__(self, k, ssrc=0):
+        self.k = k
+        self.ssrc = ssrc
+        self.seq = 0
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.baseSeq = 0
+        self.markers = 0
+        self.lengths = 0
+        self.timestamps = 0
+        self.parity = 0  # XOR of the payloads, as little-endian integers
+
+    def protect(self, packets):
+        """Account for a batch of sent (header, payload) media packets. Return the parity packets due."""
+        parity = []
+        for header, payload in packets:
+            data = bytes(header[HEADER_SIZE:]) + bytes(payload)
+            second, seq, timestamp = struct.unpack_from('!xBHI', header)
+            if self.count == 0:
+                self.baseSeq = seq
+            self.count += 1
+            self.markers ^= second >> 7
+            self.lengths ^= len(data)
+            self.timestamps ^= timestamp
+            self.parity ^= int.from_bytes(data, 'little')
+            if self.count == self.k:
+                parity.append(self.makeParity(timestamp))
+                self.reset()
+        return parity
+
+    def makeParity(self, timestamp):
+        """Return the parity packet of the current group as a (header, payload) pair."""
+        size = (self.parity.bit_length() + 7) // 8
+        payload = FEC_HEADER.pack(self.baseSeq, self.count, self.markers, self.lengths, self.timestamps) + self.parity.to_bytes(size, 'little')
+        self.seq = (self.seq + 1) & 0xFFFF
+        rtpPacket = RtpPacket()
+        rtpPacket.encode(2, 0, 0, 0, self.seq, 0, FEC_PT, self.ssrc, payload, timestamp=timestamp)
+        return rtpPacket.getBuffers()
+
+
+class FecDecoder:
+    """Rebuild a single media packet missing from a parity group."""
+
+    def __init__(self):
+        self.packets = {}  # seq -> (marker, timestamp, payload)
+        self.arrivals = deque()  # Sequence numbers of self.packets, in arrival order
+        self.highest = None  # Highest sequence number seen
+
+        # Statistic variables
+        self.parityPackets = 0
+        self.recovered = 0
+        self.unrecoverable = 0  # Groups that lost more than one packet
+
+    def media(self, rtpPacket):
+        """Remember a received media packet, forgetting every one more than DECODE_WINDOW behind."""
+        seq = rtpPacket.seqNum()
+        # Only a packet less than the window behind leaves the highest where it is;
+        # anything else is newer, or a jump (e.g. a sender restart) to start over from
+        if self.highest is None or not 0 < (self.highest - seq) & 0xFFFF < DECODE_WINDOW:
+            self.highest = seq
+        self.packets[seq] = (rtpPacket.marker(), rtpPacket.timestamp(), rtpPacket.getPayload())
+        self.arrivals.append(seq)
+
+        # Evict by distance, not just the one sequence number that falls out
+        # of the window: its packet may have been lost, and an entry left
+        # behind would be XORed into a group of the same numbers after the wrap
+        while (self.highest - self.arrivals[0]) & 0xFFFF >= DECODE_WINDOW:
+            self.packets.pop(self.arrivals.popleft(), None)
+
+    def parity(self, rtpPacket):
+        """Process a parity packet. Return the media RtpPacket it rebuilds, or None."""
+        self.parityPackets += 1
+        payload = rtpPacket.getPayload()
+        if len(payload) < FEC_HEADER.size:
+            return None
+        baseSeq, count, marker, length, timestamp = FEC_HEADER.unpack_from(payload)
+        parity = int.from_bytes(payload[FEC_HEADER.size:], 'little')
+
+        missing = None
+        for i in range(count):
+            seq = (baseSeq + i) & 0xFFFF
+            packet = self.packets.get(seq)
+            if packet is None:
+                if missing is not None:
+                    self.unrecoverable += 1
+                    return None
+                missing = seq
+                continue
+            marker ^= packet[0]
+            timestamp ^= packet[1]
+            length ^= len(packet[2])
+            parity ^= int.from_bytes(packet[2], 'little')
+        if missing is None:
+            return None
+        if parity.bit_length() > length * 8:  # Corrupt or inconsistent parity
+            self.unrecoverable += 1
+            return None
+
+        data = parity.to_bytes(length, 'little') if length else b''
+        recovered = RtpPacket()
+        recovered.encode(2, 0, 0, 0, missing, marker, 26, rtpPacket.ssrc(), data, timestamp=timestamp)
+        self.media(recovered)
+        self.recovered += 1
+        return recovered
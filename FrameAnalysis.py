@@ -0,0 +1,188 @@
+import io, os, sys, struct
+from array import array
+
+try:
+    import numpy
+    from PIL import Image
+except ImportError:  # Analysis is optional, the server runs without it
+    numpy = None
+
+from VideoStream import VideoStream
+
+DIFF_THRESHOLD = 2.0  # Mean absolute luma difference (0-255) below which a frame repeats
+REFRESH_INTERVAL = 2.0  # seconds; a full frame is sent at least this often
+THUMBNAIL_SIZE = 64  # Pixels on the longer side the decoder scales down towards
+CHUNK_FRAMES = 256  # Frames compared against a reference per vectorized step
+
+REPEATS_EXT = '.repeats'
+REPEATS_MAGIC = b'MJRP'
+REPEATS_HEADER = struct.Struct('<4sQI')  # magic, media file size, frame count
+
+
+def available():
+    """Return True if NumPy and Pillow are installed."""
+    return numpy is not None
+
+
+def thumbnail(frame, size=None):
+    """Decode a JPEG frame at reduced scale, resized to size if given. Return its luma as a 2-D uint8 array.
+
+    Image.draft() has the decoder scale the DCT blocks down, so most of
+    the decoding work is skipped.
+    """
+    image = Image.open(io.BytesIO(frame))
+    image.draft('L', (THUMBNAIL_SIZE, THUMBNAIL_SIZE))  # DCT scaling, 1/2 to 1/8
+    image = image.convert('L')
+    if size and image.size != size:
+        image = image.resize(size)
+    return numpy.asarray(image)
+
+
+def findRepeats(frames, threshold=DIFF_THRESHOLD):
+    """Return, for every frame, the (1-based) number of the frame it repeats, itself if none.
+
+    A frame repeats the last frame that did not, as long as their
+    thumbnails differ by less than the threshold (mean absolute luma
+    difference), so slow drift still gets sent. Each reference is compared
+    with up to CHUNK_FRAMES following frames in one vectorized step.
+    """
+    thumbnails = []
+    size = None
+    for frame in frames:
+        thumb = thumbnail(bytes(frame), size)
+        size = size or (thumb.shape[1], thumb.shape[0])
+        thumbnails.append(thumb)
+    refs = array('I')
+    if not thumbnails:
+        return refs
+    stack = numpy.stack(thumbnails).astype(numpy.int16)
+
+    count = len(stack)
+    ref = 0
+    refs.append(1)
+    i = 1
+    while i < count:
+        chunk = stack[i:i + CHUNK_FRAMES]
+        scores = numpy.abs(chunk - stack[ref]).mean(axis=(1, 2))
+        changed = numpy.flatnonzero(scores >= threshold)
+        run = changed[0] if len(changed) else len(chunk)
+        refs.extend([ref + 1] * run)
+        i += run
+        if len(changed):  # New reference
+            ref = i
+            refs.append(ref + 1)
+            i += 1
+    return refs
+
+
+def analyzeFile(path, threshold=DIFF_THRESHOLD):
+    """Find the repeated frames of a media file and store them next to it. Return the references."""
+    stream = VideoStream(path)
+    try:
+        refs = findRepeats((stream.getFrame(n) for n in range(1, stream.frameCount() + 1)), threshold)
+        saveRepeats(path, stream.filesize, refs)
+    finally:
+        stream.close()
+    return refs
+
+
+def saveRepeats(filename, filesize, refs):
+    """Write the repeat references of a media file next to it."""
+    if sys.byteorder != 'little':
+        refs = array('I', refs)
+        refs.byteswap()
+    with open(filename + REPEATS_EXT, 'wb') as f:
+        f.write(REPEATS_HEADER.pack(REPEATS_MAGIC, filesize, len(refs)))
+        refs.tofile(f)
+
+
+def loadRepeats(filename, filesize):
+    """Load the repeat references stored next to a media file. Return None if missing or stale."""
+    try:
+        with open(filename + REPEATS_EXT, 'rb') as f:
+            magic, size, count = REPEATS_HEADER.unpack(f.read(REPEATS_HEADER.size))
+            if magic != REPEATS_MAGIC or size != filesize:
+                return None
+            refs = array('I')
+            refs.fromfile(f, count)
+    except (OSError, EOFError, struct.error):
+        return None
+    if sys.byteorder != 'little':
+        refs.byteswap()
+    return refs
+
+
+class StaticDetector:
+    """Online counterpart of findRepeats: tell, frame by frame, whether one repeats the last sent."""
+
+    def __init__(self, threshold=DIFF_THRESHOLD):
+        self.threshold = threshold
+        self.reference = None
+
+    def isRepeat(self, frame):
+        """Return True if the frame repeats the reference; otherwise it becomes the reference."""
+        try:
+            thumb = thumbnail(bytes(frame), self.reference.shape[::-1] if self.reference is not None else None)
+        except (OSError, ValueError):  # Not decodable, always send it
+            self.reference = None
+            return False
+        if self.reference is not None and numpy.abs(thumb.astype(numpy.int16) - self.reference).mean() < self.threshold:
+            return True
+        self.reference = thumb.astype(numpy.int16)
+        return False
+
+    def reset(self):
+        """Forget the reference, e.g. after a seek; the next frame is sent."""
+        self.reference = None
+
+
+class RepeatFilter:
+    """Decide which frames of a stream a sender can replace with a "repeat previous" signal.
+
+    Uses the repeat references of an offline analysis when the media has
+    them, a StaticDetector otherwise. A full frame still goes out at least
+    every REFRESH_INTERVAL, so receivers that lost or never had the
+    reference catch up.
+    """
+
+    def __init__(self, refs=None, detector=None, refresh=REFRESH_INTERVAL):
+        self.refs = refs
+        self.detector = detector
+        self.refresh = refresh
+        self.reference = None  # Reference of the last full frame sent
+        self.sentAt = None
+        self.repeated = 0
+
+    def isRepeat(self, frameNumber, frame, now):
+        """Return True if the frame need not be sent; otherwise record it as sent."""
+        if self.sentAt is not None and now - self.sentAt < self.refresh:
+            if self.refs is not None:
+                repeat = frameNumber <= len(self.refs) and self.refs[frameNumber - 1] == self.reference
+            else:
+                repeat = self.detector.isRepeat(frame)
+            if repeat:
+                self.repeated += 1
+                return True
+        elif self.detector:
+            self.detector.reset()
+            self.detector.isRepeat(frame)
+        self.reference = self.refs[frameNumber - 1] if self.refs is not None and frameNumber <= len(self.refs) else frameNumber
+        self.sentAt = now
+        return False
+
+    def reset(self):
+        """Send the next frame in full, e.g. after a seek."""
+        self.sentAt = None
+
+
+def openRepeatFilter(path, threshold=0):
+    """Return a RepeatFilter for a media file: from its stored analysis, else online if threshold is set, else None."""
+    try:
+        refs = loadRepeats(path, os.path.getsize(path))
+    except OSError:
+        refs = None
+    if refs is not None:
+        return RepeatFilter(refs=refs)
+    if threshold and available():
+        return RepeatFilter(detector=StaticDetector(threshold))
+    return None
@@ -0,0 +1,199 @@
+import os, threading
+from collections import OrderedDict
+
+from VideoStream import VideoStream
+from Metrics import registry
+
+DEFAULT_BUDGET = 64 * 1024 * 1024  # bytes
+
+
+def fileIdentity(st):
+    """Return what tells one version of a file from another: a replaced or rewritten file differs."""
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class FrameCache:
+    """Process-wide LRU cache of frames keyed by (file version, frame number).
+
+    A file version is its real path with its identity (inode, size and
+    modification time), so a media file replaced or re-encoded in place
+    is opened afresh instead of being served from the frames of the old
+    one; those frames are dropped as soon as the new version is opened.
+    """
+
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+        self.size = 0
+        self.frames = OrderedDict()
+        self.streams = {}  # (path, identity) -> [VideoStream, number of sessions]
+        self.versions = {}  # path -> identity of the version last opened
+        self.lock = threading.Lock()
+
+        # Statistic variables
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def setBudget(self, budget):
+        """Change the memory budget (in bytes), evicting frames if needed."""
+        with self.lock:
+            self.budget = budget
+            self.evict()
+
+    def acquire(self, filename):
+        """Open (or share) the current version of the media file. Return its cache key."""
+        path = os.path.realpath(filename)
+        try:
+            key = (path, fileIdentity(os.stat(path)))
+        except OSError:
+            raise IOError(filename)
+        with self.lock:
+            entry = self.streams.get(key)
+            if entry is None:
+                stream = VideoStream(path)
+                key = (path, fileIdentity(os.fstat(stream.file.fileno())))  # What was opened, if it changed since
+                entry = self.streams.get(key)
+                if entry is None:
+                    entry = self.streams[key] = [stream, 0]
+                    self.forgetOldVersion(path, key[1])
+                else:
+                    stream.close()
+            entry[1] += 1
+        return key
+
+    def forgetOldVersion(self, path, identity):
+        """Drop the cached frames of an earlier version of a file. Lock must be held."""
+        old = self.versions.get(path)
+        self.versions[path] = identity
+        if old is None or old == identity:
+            return
+        stale = [frameKey for frameKey in self.frames if frameKey[0] == (path, old)]
+        for frameKey in stale:
+            self.size -= len(self.frames.pop(frameKey))
+
+    def release(self, key):
+        """Drop one session's reference to the media file, closing it when unused."""
+        with self.lock:
+            entry = self.streams[key]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.streams[key]
+                entry[0].close()
+
+    def stream(self, key):
+        """Return the shared VideoStream of an acquired file."""
+        return self.streams[key][0]
+
+    def getFrame(self, key, frameNbr):
+        """Get frame by its (1-based) number, reading it from the file on a miss."""
+        frameKey = (key, frameNbr)
+        with self.lock:
+            data = self.frames.get(frameKey)
+            if data is not None:
+                self.frames.move_to_end(frameKey)
+                self.hits += 1
+                return data
+            self.misses += 1
+            stream = self.streams[key][0]
+
+        view = stream.getFrame(frameNbr)
+        if len(view) > self.budget:  # Never fits, serve straight from the map
+            return view
+        data = bytes(view)
+        with self.lock:
+            if frameKey not in self.frames:
+                self.frames[frameKey] = data
+                self.size += len(data)
+                self.evict()
+        return data
+
+    def evict(self):
+        """Evict least recently used frames until the cache fits its budget. Lock must be held."""
+        while self.size > self.budget and self.frames:
+            _, data = self.frames.popitem(last=False)
+            self.size -= len(data)
+            self.evictions += 1
+
+    def stats(self):
+        """Return a snapshot of the cache counters."""
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'frames': len(self.frames),
+                'bytes': self.size,
+                'budget': self.budget,
+                'files': len(self.streams),
+            }
+
+
+frameCache = FrameCache()
+
+registry.gaugeFunction('frame_cache_hits_total', "Frames served from the frame cache", lambda: frameCache.hits, 'counter')
+registry.gaugeFunction('frame_cache_misses_total', "Frames read from the media file", lambda: frameCache.misses, 'counter')
+registry.gaugeFunction('frame_cache_bytes', "Bytes held by the frame cache", lambda: frameCache.size)
+registry.gaugeFunction('frame_cache_open_files', "Media files held open by the frame cache", lambda: len(frameCache.streams))
+
+
+class CachedStream:
+    """Per-session cursor over a media file served through the shared frame cache.
+
+    Exposes the same interface as VideoStream, so ServerWorker can use either.
+    """
+
+    def __init__(self, filename, cache=frameCache):
+        self.filename = filename
+        self.cache = cache
+        self.key = cache.acquire(filename)  # (path, identity) of the version opened
+        stream = cache.stream(self.key)
+        self.frameRate = stream.frameRate
+        self.frames = stream.frameCount()
+        self.frameNum = 0
+
+    def nextFrame(self):
+        """Get next frame."""
+        if self.frameNum >= self.frames:
+            return None
+        self.frameNum += 1
+        return self.cache.getFrame(self.key, self.frameNum)
+
+    def getFrame(self, frameNbr):
+        """Get frame by its (1-based) number."""
+        return self.cache.getFrame(self.key, frameNbr)
+
+    def seek(self, frameNbr):
+        """Position the stream so the next frame returned is frameNbr + 1."""
+        if frameNbr < 0 or frameNbr > self.frames:
+            raise IndexError(frameNbr)
+        self.frameNum = frameNbr
+
+    def seekTime(self, seconds):
+        """Position the stream at a time offset (in seconds) from the start."""
+        self.seek(int(seconds * self.frameRate))
+
+    def frameNbr(self):
+        """Get frame number."""
+        return self.frameNum
+
+    def frameCount(self):
+        """Get total number of frames."""
+        return self.frames
+
+    def duration(self):
+        """Get media duration in seconds."""
+        return self.frames / self.frameRate
+
+    def bitrate(self):
+        """Get the mean media bitrate in bits per second."""
+        return self.cache.stream(self.key).bitrate()
+
+    def willNeed(self, frameNbr, count):
+        """Ask the kernel to read count frames from frameNbr on ahead."""
+        self.cache.stream(self.key).willNeed(frameNbr, count)
+
+    def close(self):
+        """Release this session's reference to the media file."""
+        if self.key is not None:
+            self.cache.release(self.key)
+            self.key = None
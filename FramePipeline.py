@@ -0,0 +1,93 @@
+import io, threading
+from collections import deque
+
+from PIL import Image
+
+DECODED_QUEUE_SIZE = 2
+POLL_INTERVAL = 10  # ms
+
+
+def decodeFrame(frame):
+    """Decode a JPEG frame held in memory into a loaded PIL image."""
+    image = Image.open(io.BytesIO(frame))
+    image.load()
+    return image
+
+
+class FramePipeline:
+    """Decode received JPEG frames in memory and display them on the Tk main thread.
+
+    Network thread -> submit() -> decode worker -> bounded frame queue ->
+    display callback, scheduled with master.after() on the main thread.
+    When decoding falls behind, only the newest received frame is decoded.
+    """
+
+    def __init__(self, master, display, queueSize=DECODED_QUEUE_SIZE):
+        self.master = master
+        self.display = display
+        self.received = None  # Newest frame not yet decoded
+        self.decoded = deque(maxlen=queueSize)
+        self.cond = threading.Condition()
+        self.running = False
+        self.pollId = None
+
+        # Statistic variables
+        self.framesDecoded = 0
+        self.framesDropped = 0
+        self.decodeErrors = 0
+
+    def start(self):
+        """Start the decode worker and the display loop. Call from the Tk main thread."""
+        self.running = True
+        threading.Thread(target=self.decodeLoop, daemon=True).start()
+        self.pollId = self.master.after(POLL_INTERVAL, self.poll)
+
+    def stop(self):
+        """Stop the decode worker and the display loop."""
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.pollId is not None:
+            self.master.after_cancel(self.pollId)
+            self.pollId = None
+
+    def submit(self, frame):
+        """Queue a received JPEG frame for decoding, replacing any frame still waiting."""
+        with self.cond:
+            if self.received is not None:
+                self.framesDropped += 1
+            self.received = frame
+            self.cond.notify()
+
+    def decodeLoop(self):
+        """Decode frames from memory on the worker thread."""
+        while True:
+            with self.cond:
+                while self.running and self.received is None:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                frame = self.received
+                self.received = None
+
+            try:
+                image = decodeFrame(frame)
+            except Exception:
+                self.decodeErrors += 1
+                continue
+            if len(self.decoded) == self.decoded.maxlen:
+                self.framesDropped += 1
+            self.decoded.append(image)
+            self.framesDecoded += 1
+
+    def poll(self):
+        """Display the newest decoded frame. Runs on the Tk main thread."""
+        image = None
+        while self.decoded:
+            if image is not None:
+                self.framesDropped += 1
+            image = self.decoded.popleft()
+        if image is not None:
+            self.display(image)
+        if self.running:
+            self.pollId = self.master.after(POLL_INTERVAL, self.poll)
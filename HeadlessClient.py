@@ -0,0 +1,223 @@
+import socket
+from random import randint
+from time import monotonic
+
+from RtpPacket import RtpPacket, CLOCK_RATE
+from RtpJpeg import FrameReassembler
+from Channel import parseTransport, joinGroup
+from Rtcp import RTCP_INTERVAL, encodeNack
+from ReceiverStats import ReceiverStats
+from Retransmit import NackTracker, NACK_WINDOW
+from Fec import FecDecoder, FEC_PT
+from RtspParser import RtspParser, RtspParseError, formatMessage
+
+RECV_BUFFER_SIZE = 65536
+RTSP_TIMEOUT = 10  # seconds
+
+
+class RtspError(Exception):
+    """The server answered an RTSP request with an error status."""
+
+
+class HeadlessClient:
+    """RTSP/RTP client without a GUI, for scripts, tests and load generation.
+
+    Speaks the same protocol as Client. RTP datagrams are handed to
+    handleRtp(), either by receive() or by an external event loop polling
+    rtpSocket.
+    """
+
+    RTSP_VER = "RTSP/1.0"
+    TRANSPORT = "RTP/UDP"
+
+    def __init__(self, serverAddr, serverPort, fileName, rtpPort=0, nack=True, fec=0):
+        self.serverAddr = serverAddr
+        self.serverPort = int(serverPort)
+        self.fileName = fileName
+        self.rtspSeq = 0
+        self.sessionId = 0
+        self.sessionTimeout = None  # seconds, as the server advertised
+        self.parser = RtspParser()
+
+        self.rtpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.rtpSocket.bind(('', rtpPort))
+        self.rtpPort = self.rtpSocket.getsockname()[1]
+        self.rtspSocket = socket.create_connection((self.serverAddr, self.serverPort), RTSP_TIMEOUT)
+
+        # Receiver reports go from the RTP port plus one (when free) to the RTSP port plus one
+        self.ssrc = randint(0, 0xFFFFFFFF)
+        self.rtcpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self.rtcpSocket.bind(('', self.rtpPort + 1))
+        except OSError:
+            self.rtcpSocket.bind(('', 0))
+        self.reception = ReceiverStats()
+        self.nack = NackTracker() if nack else None  # Requests lost packets again
+        self.nackWindow = NACK_WINDOW
+        self.fecGroup = fec  # K to ask the server for, 0 for no FEC
+        self.fec = None  # FecDecoder, once the server agreed
+        self.lastReport = monotonic()
+
+        self.reassembler = FrameReassembler()
+        self.onFrame = None  # Called with (frame, RTP timestamp, arrival time)
+        self.resetStats()
+
+    def resetStats(self):
+        """Start the statistics over, e.g. once a warm-up is done."""
+        self.reception.reset(self.reception.ssrc)
+        self.reassembler.discarded = 0
+        if self.nack:
+            self.nack.nacked = self.nack.recovered = 0
+
+        # Statistic variables
+        self.statPackets = 0
+        self.statBytes = 0
+        self.statFrames = 0
+        self.statRepeats = 0  # Frames the server replaced with a repeat of the previous one
+        self.statFirstArrival = None
+        self.statLastArrival = None
+        self.statBaseTs = None
+        self.statTransits = []  # Per frame: arrival minus media time, seconds
+
+    def request(self, method, headers=None, body=None):
+        """Send an RTSP request and wait for its reply. Return (headers, body)."""
+        self.rtspSeq += 1
+        requestHeaders = {'CSeq': self.rtspSeq}
+        if method == 'SETUP':
+            transport = "{}; client_port= {}".format(self.TRANSPORT, self.rtpPort)
+            if self.fecGroup:
+                transport += "; fec={}".format(self.fecGroup)
+            transport += "; x-repeat"
+            requestHeaders['Transport'] = transport
+        elif self.sessionId:
+            requestHeaders['Session'] = self.sessionId
+        requestHeaders.update(headers or {})
+        self.rtspSocket.sendall(formatMessage("{} {} {}".format(method, self.fileName, self.RTSP_VER), requestHeaders, body))
+
+        reply = self.recvReply()
+        if reply.status != 200:
+            raise RtspError("{} {} {}".format(reply.version, reply.status, reply.reason))
+        return reply.headers, reply.body
+
+    def recvReply(self):
+        """Return the reply to the last request, skipping replies to earlier ones."""
+        while True:
+            data = self.rtspSocket.recv(RECV_BUFFER_SIZE)
+            if not data:
+                raise RtspError("connection closed by the server")
+            for reply in self.parser.feed(data):
+                if reply.status is None:
+                    raise RtspParseError("request received from the server")
+                if reply.header('CSeq') == str(self.rtspSeq):
+                    return reply
+
+    def setup(self):
+        """Send SETUP and remember the session id. Join the group of a multicast channel."""
+        replyHeaders, _ = self.request('SETUP')
+        session, _, params = replyHeaders['session'].partition(';')
+        self.sessionId = int(session)
+        if params.strip().startswith('timeout='):
+            self.sessionTimeout = int(params.strip()[len('timeout='):])
+        transport = parseTransport(replyHeaders.get('transport', ''))
+        if transport.get('fec'):
+            self.fec = FecDecoder()
+        if 'multicast' in transport:
+            self.rtpSocket.close()
+            self.rtpPort = int(transport['port'])
+            self.rtpSocket = joinGroup(transport['destination'], self.rtpPort)
+
+    def play(self, playRange=None):
+        """Send PLAY, optionally from an RTSP Range (e.g. "npt=10-")."""
+        self.reception.rebase()
+        self.request('PLAY', {'Range': playRange} if playRange else None)
+
+    def pause(self):
+        """Send PAUSE."""
+        self.request('PAUSE')
+
+    def teardown(self):
+        """Send TEARDOWN."""
+        self.request('TEARDOWN')
+
+    def describe(self):
+        """Send DESCRIBE. Return the session description."""
+        return self.request('DESCRIBE')[1]
+
+    def keepAlive(self):
+        """Send OPTIONS, which keeps a paused session from timing out."""
+        self.request('OPTIONS')
+
+    def handleRtp(self, data, arrival):
+        """Process one RTP datagram received at the given monotonic time."""
+        rtpPacket = RtpPacket()
+        rtpPacket.decode(data)
+
+        # Parity packets only serve to rebuild a lost media packet
+        if rtpPacket.payloadType() == FEC_PT:
+            rtpPacket = self.fec.parity(rtpPacket) if self.fec else None
+            if rtpPacket is None:
+                return
+            data = rtpPacket.getPacket()
+        elif self.fec:
+            self.fec.media(rtpPacket)
+
+        self.reception.update(rtpPacket, arrival, len(data))
+        self.statPackets += 1
+        self.statBytes += len(data)
+        if self.statFirstArrival is None:
+            self.statFirstArrival = arrival
+        self.statLastArrival = arrival
+
+        seq = rtpPacket.seqNum()
+        if self.nack:
+            self.nack.update(seq, arrival)
+            lost = self.nack.due(arrival, self.nackWindow)
+            if lost:
+                self.rtcpSocket.sendto(encodeNack(self.ssrc, rtpPacket.ssrc(), lost), (self.serverAddr, self.serverPort + 1))
+
+        frame = self.reassembler.push(rtpPacket.timestamp(), rtpPacket.marker(), rtpPacket.getPayload())
+        if frame is not None:
+            self.statFrames += 1
+            if not frame:
+                self.statRepeats += 1
+            if self.statBaseTs is None:
+                self.statBaseTs = rtpPacket.timestamp()
+            mediaTime = ((rtpPacket.timestamp() - self.statBaseTs) & 0xFFFFFFFF) / CLOCK_RATE
+            self.statTransits.append(arrival - mediaTime)
+            if self.onFrame:
+                self.onFrame(frame, rtpPacket.timestamp(), arrival)
+
+    def receive(self, duration):
+        """Receive RTP packets for the given number of seconds."""
+        end = monotonic() + duration
+        while True:
+            remaining = end - monotonic()
+            if remaining <= 0:
+                return
+            self.rtpSocket.settimeout(min(remaining, RTCP_INTERVAL))
+            try:
+                data = self.rtpSocket.recv(RECV_BUFFER_SIZE)
+            except socket.timeout:
+                data = None
+            now = monotonic()
+            if data:
+                self.handleRtp(data, now)
+            if now - self.lastReport >= RTCP_INTERVAL:
+                self.sendReport()
+
+    def sendReport(self):
+        """Send an RTCP receiver report about the RTP stream to the server."""
+        self.lastReport = monotonic()
+        report = self.reception.report(self.ssrc)
+        if report:
+            self.rtcpSocket.sendto(report.encode(), (self.serverAddr, self.serverPort + 1))
+
+    def lostPackets(self):
+        """Return the number of packets expected but not received."""
+        return max(0, self.reception.lost())
+
+    def close(self):
+        """Close every socket."""
+        self.rtspSocket.close()
+        self.rtpSocket.close()
+        self.rtcpSocket.close()
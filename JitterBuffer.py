@@ -0,0 +1,119 @@
+import heapq, threading
+
+from RtpPacket import CLOCK_RATE
+
+MIN_DELAY = 0.05  # seconds
+MAX_DELAY = 1.0
+JITTER_MULTIPLIER = 4  # Target delay in units of measured jitter
+RESYNC_THRESHOLD = 5.0  # A timestamp jump larger than this (seconds) re-bases the media clock
+
+
+class JitterBuffer:
+    """Reorder RTP packets by sequence number and release them at their playout time.
+
+    Playout time is media time (RTP timestamp / clock rate) plus the
+    smallest transit time seen plus a target delay. The target delay
+    follows the RFC 3550 interarrival jitter estimate.
+    """
+
+    def __init__(self, clockRate=CLOCK_RATE, minDelay=MIN_DELAY, maxDelay=MAX_DELAY):
+        self.clockRate = clockRate
+        self.minDelay = minDelay
+        self.maxDelay = maxDelay
+        self.cond = threading.Condition()
+
+        # Statistic variables
+        self.late = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.skipped = 0
+
+        self.reset()
+
+    def reset(self):
+        """Drop buffered packets and forget the timing of the previous stream."""
+        with self.cond:
+            self.heap = []
+            self.buffered = set()
+            self.highestSeq = None
+            self.nextSeq = None
+            self.lastTs = None
+            self.offset = None
+            self.prevTransit = None
+            self.jitter = 0.0
+            self.delay = self.minDelay
+
+    def extendSeq(self, seq):
+        """Return the extended (wraparound-free) value of a 16-bit sequence number."""
+        if self.highestSeq is None:
+            return seq
+        delta = (seq - self.highestSeq) & 0xFFFF
+        if delta >= 0x8000:
+            delta -= 0x10000
+        return self.highestSeq + delta
+
+    def extendTs(self, ts):
+        """Return the extended (wraparound-free) value of a 32-bit timestamp."""
+        if self.lastTs is None:
+            self.lastTs = ts
+            return ts
+        delta = (ts - self.lastTs) & 0xFFFFFFFF
+        if delta >= 0x80000000:
+            delta -= 0x100000000
+        self.lastTs += delta
+        return self.lastTs
+
+    def push(self, rtpPacket, arrival):
+        """Add a received packet; arrival is its time.monotonic() receive time."""
+        with self.cond:
+            seq = self.extendSeq(rtpPacket.seqNum())
+            if self.nextSeq is not None and seq < self.nextSeq:  # Already played out
+                self.late += 1
+                return
+            if seq in self.buffered:
+                self.duplicates += 1
+                return
+            if self.highestSeq is not None and seq < self.highestSeq:
+                self.reordered += 1
+            else:
+                self.highestSeq = seq
+
+            mediaTime = self.extendTs(rtpPacket.timestamp()) / self.clockRate
+            transit = arrival - mediaTime
+            if self.offset is None or transit - self.offset > RESYNC_THRESHOLD:
+                self.offset = transit
+                self.prevTransit = None
+            elif transit < self.offset:
+                self.offset = transit
+
+            # Interarrival jitter, RFC 3550 section 6.4.1
+            if self.prevTransit is not None:
+                self.jitter += (abs(transit - self.prevTransit) - self.jitter) / 16
+            self.prevTransit = transit
+            self.delay = min(max(self.minDelay, JITTER_MULTIPLIER * self.jitter), self.maxDelay)
+
+            heapq.heappush(self.heap, (seq, mediaTime, rtpPacket))
+            self.buffered.add(seq)
+            self.cond.notify()
+
+    def pop(self, now):
+        """Return, in sequence order, the packets whose playout time is not after now."""
+        packets = []
+        with self.cond:
+            while self.heap and self.heap[0][1] + self.offset + self.delay <= now:
+                seq, _, rtpPacket = heapq.heappop(self.heap)
+                self.buffered.discard(seq)
+                if self.nextSeq is not None and seq > self.nextSeq:  # Gave up on the missing ones
+                    self.skipped += seq - self.nextSeq
+                self.nextSeq = seq + 1
+                packets.append(rtpPacket)
+        return packets
+
+    def wait(self, now, timeout):
+        """Block until the next packet is due, a packet arrives, or timeout elapses."""
+        with self.cond:
+            if self.heap:
+                due = self.heap[0][1] + self.offset + self.delay - now
+                timeout = min(timeout, max(0, due))
+            if timeout > 0:
+                self.cond.wait(timeout)
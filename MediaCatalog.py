@@ -0,0 +1,192 @@
+import os, json, logging, threading
+from collections import OrderedDict
+from urllib.parse import urlparse, unquote
+
+from VideoStream import VideoStream, saveIndex
+from RtpJpeg import jpegSize
+from FrameAnalysis import analyzeFile, loadRepeats
+
+logger = logging.getLogger(__name__)
+
+CATALOG_FILE = '.catalog.json'  # Metadata cache, in the library directory
+CATALOG_VERSION = 1
+MEDIA_EXTS = ('.mjpeg',)
+PROBE_CACHE_SIZE = 128  # Files outside any catalog whose metadata is kept in memory
+
+probeCache = OrderedDict()  # real path -> metadata, least recently used first
+probeCacheLock = threading.Lock()
+
+
+def probeMedia(path, writeIndex=False):
+    """Read the metadata of a media file, writing its frame-offset index on the way if asked.
+
+    Return a dict with the file's size and mtime (to tell when it changes),
+    frame count, frame rate, duration, bitrate and the JPEG dimensions of
+    its first frame.
+    """
+    stream = VideoStream(path)
+    try:
+        if writeIndex:
+            try:
+                saveIndex(path, stream.filesize, stream.offsets, stream.lengths)
+            except OSError:  # Read-only library, the index is rebuilt on every open
+                pass
+        first = bytes(stream.getFrame(1)) if stream.frameCount() else b''
+        width, height = jpegSize(first) if first else (0, 0)
+        stat = os.fstat(stream.file.fileno())
+        return {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'frameCount': stream.frameCount(),
+            'frameRate': stream.frameRate,
+            'duration': stream.duration(),
+            'bitrate': int(stream.bitrate()),
+            'width': width,
+            'height': height,
+        }
+    finally:
+        stream.close()
+
+
+def probeCached(path):
+    """Return the metadata of a media file, probed once and kept in memory while it is unchanged.
+
+    For files requested outside a catalog: nothing is written next to them.
+    """
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    with probeCacheLock:
+        info = probeCache.get(path)
+        if info is not None and info['size'] == stat.st_size and info['mtime'] == stat.st_mtime_ns:
+            probeCache.move_to_end(path)
+            return info
+    info = probeMedia(path)
+    with probeCacheLock:
+        probeCache[path] = info
+        probeCache.move_to_end(path)
+        while len(probeCache) > PROBE_CACHE_SIZE:
+            probeCache.popitem(last=False)
+    return info
+
+
+def describeMedia(info, name, sessionId=0, live=False):
+    """Return the SDP session description of a media file from its metadata."""
+    lines = [
+        'v=0',
+        'o=- {} 1 IN IP4 0.0.0.0'.format(sessionId),
+        's={}'.format(name),
+        't=0 0',
+        'a=control:*',
+        'a=range:npt=now-' if live else 'a=range:npt=0-{:.3f}'.format(info['duration']),
+        'm=video 0 RTP/AVP 26',
+        'b=AS:{}'.format((info['bitrate'] + 999) // 1000),
+        'a=framerate:{}'.format(info['frameRate']),
+        'a=x-dimensions:{},{}'.format(info['width'], info['height']),
+        'a=x-frame-count:{}'.format(info['frameCount']),
+    ]
+    return '\r\n'.join(lines) + '\r\n'
+
+
+class MediaCatalog:
+    """The media files of a library directory, with their metadata.
+
+    Metadata is cached on disk and reused for every file whose size and
+    mtime did not change, so a restart only probes new or changed files.
+    With a static threshold, the scan also stores the repeated frames of
+    every file that lacks a current analysis. Requested names resolve
+    inside the library only.
+    """
+
+    def __init__(self, library, cacheFile=None, staticThreshold=0):
+        self.library = os.path.realpath(library)
+        self.cacheFile = cacheFile or os.path.join(self.library, CATALOG_FILE)
+        self.staticThreshold = staticThreshold
+        self.entries = {}  # name relative to the library -> metadata dict
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Read the metadata cache, if there is a usable one."""
+        try:
+            with open(self.cacheFile) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return
+        if cache.get('version') == CATALOG_VERSION:
+            self.entries = cache.get('files', {})
+
+    def save(self):
+        """Write the metadata cache, replacing the old one atomically."""
+        with self.lock:
+            cache = {'version': CATALOG_VERSION, 'files': dict(self.entries)}
+        temp = '{}.{}.tmp'.format(self.cacheFile, os.getpid())
+        try:
+            with open(temp, 'w') as f:
+                json.dump(cache, f, indent=1, sort_keys=True)
+            os.replace(temp, self.cacheFile)
+        except OSError:
+            logger.warning("Could not write the media catalog cache %s", self.cacheFile, exc_info=True)
+
+    def scan(self):
+        """Bring the catalog up to date with the library. Return the number of files probed."""
+        found = {}
+        probed = 0
+        for directory, dirs, files in os.walk(self.library):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for file in files:
+                if not file.lower().endswith(MEDIA_EXTS):
+                    continue
+                path = os.path.join(directory, file)
+                name = os.path.relpath(path, self.library).replace(os.sep, '/')
+                try:
+                    stat = os.stat(path)
+                    info = self.entries.get(name)
+                    if info is None or info['size'] != stat.st_size or info['mtime'] != stat.st_mtime_ns:
+                        info = probeMedia(path, writeIndex=True)
+                        probed += 1
+                    if self.staticThreshold and loadRepeats(path, stat.st_size) is None:
+                        analyzeFile(path, self.staticThreshold)
+                except (OSError, IOError):
+                    logger.warning("Could not read media file %s", path, exc_info=True)
+                    continue
+                found[name] = info
+        with self.lock:
+            changed = probed or found.keys() != self.entries.keys()
+            self.entries = found
+        if changed:
+            self.save()
+        logger.info("Media catalog %s: %d files, %d probed", self.library, len(found), probed)
+        return probed
+
+    def resolve(self, uri):
+        """Return (name, path) of a requested media file. Raise ValueError if it is outside the library."""
+        if '://' in uri:
+            uri = urlparse(uri).path
+        name = os.path.normpath(unquote(uri).lstrip('/'))
+        path = os.path.realpath(os.path.join(self.library, name))
+        if not path.startswith(self.library + os.sep):
+            raise ValueError("outside the media library: " + uri)
+        return os.path.relpath(path, self.library).replace(os.sep, '/'), path
+
+    def lookup(self, uri):
+        """Return the metadata of a requested media file (with its 'name' and 'path'), or None.
+
+        Raise ValueError if the request points outside the library. A file
+        that changed or appeared since the scan is probed now.
+        """
+        name, path = self.resolve(uri)
+        if not name.lower().endswith(MEDIA_EXTS):
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        info = self.entries.get(name)
+        if info is None or info['size'] != stat.st_size or info['mtime'] != stat.st_mtime_ns:
+            try:
+                info = probeMedia(path, writeIndex=True)
+            except (OSError, IOError):
+                return None
+            with self.lock:
+                self.entries[name] = info
+            self.save()
+        return dict(info, name=name, path=path)
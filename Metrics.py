@@ -0,0 +1,228 @@
+import bisect, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Counters and histograms cheap enough for the streaming hot path: an update
+# is an attribute increment (plus a bisect for histograms), without locking.
+# Concurrent updates of the same metric from several threads may
+# occasionally lose an increment, which is acceptable for monitoring.
+
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Counter:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class Gauge:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            yield name + '_bucket', labels + (('le', repr(bound)),), cumulative
+        yield name + '_bucket', labels + (('le', '+Inf'),), self.count
+        yield name + '_sum', labels, self.sum
+        yield name + '_count', labels, self.count
+
+
+class Family:
+    """A metric and its children, one per combination of label values."""
+
+    def __init__(self, name, kind, help, metricClass, labelNames=(), **options):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.metricClass = metricClass
+        self.labelNames = tuple(labelNames)
+        self.options = options
+        self.children = {}
+        self.lock = threading.Lock()
+        if not self.labelNames:
+            self.metric = self.children[()] = metricClass(**options)
+
+    def labels(self, *values):
+        """Return the child metric for the given label values."""
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.metricClass(**self.options))
+        return child
+
+    def samples(self):
+        for values, child in list(self.children.items()):
+            yield from child.samples(self.name, tuple(zip(self.labelNames, values)))
+
+
+class GaugeFunction:
+    """A gauge whose value is read from a callback at collection time."""
+
+    def __init__(self, name, help, function, kind='gauge'):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.function = function
+
+    def samples(self):
+        yield self.name, (), self.function()
+
+
+class Registry:
+    def __init__(self):
+        self.families = {}
+
+    def register(self, family):
+        self.families[family.name] = family
+        return family
+
+    def counter(self, name, help, labelNames=()):
+        """Create a counter. Without labels the Counter itself is returned."""
+        family = self.register(Family(name, 'counter', help, Counter, labelNames))
+        return family if labelNames else family.metric
+
+    def gauge(self, name, help, labelNames=()):
+        """Create a gauge. Without labels the Gauge itself is returned."""
+        family = self.register(Family(name, 'gauge', help, Gauge, labelNames))
+        return family if labelNames else family.metric
+
+    def histogram(self, name, help, labelNames=(), bounds=LATENCY_BUCKETS):
+        """Create a histogram. Without labels the Histogram itself is returned."""
+        family = self.register(Family(name, 'histogram', help, Histogram, labelNames, bounds=bounds))
+        return family if labelNames else family.metric
+
+    def gaugeFunction(self, name, help, function, kind='gauge'):
+        """Expose the value returned by function as a gauge (or counter)."""
+        return self.register(GaugeFunction(name, help, function, kind))
+
+    def samples(self):
+        """Yield (name, labels, value) for every sample."""
+        for family in list(self.families.values()):
+            yield from family.samples()
+
+    def snapshot(self):
+        """Return every sample as a flat {name{labels}: value} dict."""
+        return {formatName(name, labels): value for name, labels, value in self.samples()}
+
+    def collect(self):
+        """Return every metric as a picklable list of (name, kind, help, samples)."""
+        return [(family.name, family.kind, family.help, list(family.samples())) for family in list(self.families.values())]
+
+    def render(self):
+        """Return every metric in Prometheus text exposition format."""
+        return renderCollection(self.collect())
+
+
+def mergeCollections(collections):
+    """Sum the samples of several collect() results (e.g. of worker processes) into one."""
+    families = {}
+    for collection in collections:
+        for name, kind, help, samples in collection:
+            merged = families.setdefault(name, (kind, help, {}))[2]
+            for sample, labels, value in samples:
+                key = (sample, labels)
+                merged[key] = merged.get(key, 0) + value
+    return [(name, kind, help, [(sample, labels, value) for (sample, labels), value in merged.items()])
+            for name, (kind, help, merged) in families.items()]
+
+
+def renderCollection(collection):
+    """Format a collect() result in Prometheus text exposition format."""
+    lines = []
+    for name, kind, help, samples in collection:
+        lines.append('# HELP {} {}'.format(name, help))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for sample, labels, value in samples:
+            lines.append('{} {}'.format(formatName(sample, labels), value))
+    return '\n'.join(lines) + '\n'
+
+
+def formatName(name, labels):
+    """Return a sample name with its labels, e.g. rtsp_requests{method="PLAY"}."""
+    if not labels:
+        return name
+    return '{}{{{}}}'.format(name, ','.join('{}="{}"'.format(k, v) for k, v in labels))
+
+
+registry = Registry()
+
+# Server metrics
+framesSent = registry.counter('rtp_frames_sent_total', "Video frames sent")
+packetsSent = registry.counter('rtp_packets_sent_total', "RTP packets sent")
+bytesSent = registry.counter('rtp_bytes_sent_total', "RTP payload and header bytes sent")
+sendErrors = registry.counter('rtp_send_errors_total', "Frames that could not be sent")
+sendLatency = registry.histogram('rtp_send_call_seconds', "Time spent in the send call of one frame")
+pacingError = registry.histogram('rtp_pacing_error_seconds', "Lateness of frame sends against their deadline")
+activeSessions = registry.gauge('rtsp_active_sessions', "Sessions set up and not torn down")
+sessionsRejected = registry.counter('rtsp_sessions_rejected_total', "SETUPs refused by admission control")
+sessionsExpired = registry.counter('rtsp_sessions_expired_total', "Connections closed after the session timeout")
+receiverReports = registry.counter('rtcp_receiver_reports_total', "RTCP receiver report blocks received about a session")
+nackedPackets = registry.counter('rtp_nacked_packets_total', "Packets requested again by NACKs")
+retransmits = registry.counter('rtp_retransmitted_packets_total', "Packets retransmitted after a NACK")
+prefetchUnderruns = registry.counter('media_prefetch_underruns_total', "Frames read inline because the read-ahead buffer ran dry")
+fecPackets = registry.counter('rtp_fec_packets_sent_total', "XOR parity packets sent")
+framesRepeated = registry.counter('rtp_frames_repeated_total', "Near-duplicate frames replaced by a repeat signal or skipped")
+rtspLatency = registry.histogram('rtsp_request_seconds', "RTSP request handling time", ('method',))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def startHttpServer(port, host='127.0.0.1', registry=registry):
+    """Serve the registry (or anything with a render() method) at http://host:port/metrics on a background thread."""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.registry = registry
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,99 @@
+import heapq, itertools, threading, logging
+from time import monotonic
+
+import Metrics
+
+logger = logging.getLogger(__name__)
+
+# Heap entry fields
+DEADLINE = 0
+ORDER = 1
+SESSION = 2
+INTERVAL = 3
+ACTIVE = 4
+
+MAX_LATE_FRAMES = 5  # Beyond this, a late session resyncs instead of bursting to catch up
+
+
+class PacingScheduler:
+    """Drive every playing session from one heap of absolute frame deadlines.
+
+    A session is anything with a sendFrame() method. Deadlines advance by
+    exactly one frame interval, so pacing does not drift with send time.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.order = itertools.count()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def add(self, session, frameRate):
+        """Start pacing a session at the given frame rate. Return its entry."""
+        entry = [monotonic(), next(self.order), session, 1.0 / frameRate, True]
+        with self.lock:
+            heapq.heappush(self.heap, entry)
+        self.wakeup.set()
+        return entry
+
+    def remove(self, entry):
+        """Stop pacing a session. The entry is dropped when it next comes due."""
+        with self.lock:
+            entry[ACTIVE] = False
+
+    def setFrameRate(self, entry, frameRate):
+        """Change the frame rate of a session from its next frame on."""
+        entry[INTERVAL] = 1.0 / frameRate
+
+    def nextDeadline(self):
+        """Return the earliest deadline, or None when no session is playing."""
+        with self.lock:
+            while self.heap and not self.heap[0][ACTIVE]:
+                heapq.heappop(self.heap)
+            return self.heap[0][DEADLINE] if self.heap else None
+
+    def runDue(self, now):
+        """Send one frame for every session whose deadline has passed."""
+        batch = []
+        with self.lock:
+            while self.heap and self.heap[0][DEADLINE] <= now:
+                entry = heapq.heappop(self.heap)
+                if entry[ACTIVE]:
+                    batch.append(entry)
+
+        for entry in batch:
+            with self.lock:
+                if not entry[ACTIVE]:  # Removed while an earlier session of the batch was sent
+                    continue
+            Metrics.pacingError.observe(monotonic() - entry[DEADLINE])
+            try:
+                entry[SESSION].sendFrame()
+            except Exception:
+                logger.exception("Sending a frame failed")
+
+        with self.lock:
+            for entry in batch:
+                if not entry[ACTIVE]:
+                    continue
+                entry[DEADLINE] += entry[INTERVAL]
+                if entry[DEADLINE] < now - MAX_LATE_FRAMES * entry[INTERVAL]:
+                    entry[DEADLINE] = now + entry[INTERVAL]
+                heapq.heappush(self.heap, entry)
+        return len(batch)
+
+    def start(self):
+        """Run the scheduler on its own thread."""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            self.runDue(monotonic())
+            self.wakeup.clear()
+            deadline = self.nextDeadline()
+            self.wakeup.wait(None if deadline is None else max(0, deadline - monotonic()))
+
+
+pacingScheduler = PacingScheduler()
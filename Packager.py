@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Package a length-prefixed MJPEG file into lower-bitrate renditions.
+
+Every frame is re-encoded with Pillow at each rendition's JPEG quality
+and scale, in parallel worker processes. The renditions are written next
+to the source as NAME.RENDITION.Mjpeg with their frame-offset index, and
+listed, best first, in NAME.renditions for the server to switch between.
+With --static-threshold, the near-duplicate frames of the source are
+found too and stored in NAME.repeats, so the server need not send them.
+"""
+
+import os, io, sys, argparse, multiprocessing
+from array import array
+from PIL import Image
+
+from VideoStream import VideoStream, FRAME_HEADER_SIZE, saveIndex
+from Renditions import saveManifest
+from FrameAnalysis import analyzeFile
+
+DEFAULT_RENDITIONS = ['medium:60:0.75', 'low:35:0.5']
+CHUNK_FRAMES = 8  # Frames handed to a worker process at a time
+
+
+def parseRendition(spec):
+    """Parse a NAME:QUALITY[:SCALE] rendition spec."""
+    parts = spec.split(':')
+    if len(parts) not in (2, 3):
+        raise argparse.ArgumentTypeError("rendition must be NAME:QUALITY[:SCALE], got " + spec)
+    scale = float(parts[2]) if len(parts) == 3 else 1.0
+    return {'name': parts[0], 'quality': int(parts[1]), 'scale': scale}
+
+
+def encodeFrame(args):
+    """Re-encode one JPEG frame for every rendition. Return the encoded frames."""
+    frame, renditions = args
+    source = Image.open(io.BytesIO(frame))
+    source.load()
+    if source.mode not in ('RGB', 'L'):
+        source = source.convert('RGB')
+    encoded = []
+    for rendition in renditions:
+        image = source
+        if rendition['scale'] != 1.0:
+            # The RTP/JPEG header carries dimensions in multiples of 8 pixels
+            width = max(8, int(source.width * rendition['scale']) // 8 * 8)
+            height = max(8, int(source.height * rendition['scale']) // 8 * 8)
+            image = source.resize((width, height), Image.BILINEAR)
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=rendition['quality'])
+        data = buffer.getvalue()
+        if len(data) >= 10 ** FRAME_HEADER_SIZE:
+            raise ValueError("{} frame of {} bytes does not fit the length prefix".format(rendition['name'], len(data)))
+        encoded.append(data)
+    return encoded
+
+
+def renditionPath(source, name):
+    base, ext = os.path.splitext(source)
+    return '{}.{}{}'.format(base, name, ext or '.Mjpeg')
+
+
+def package(source, renditions, processes=None):
+    """Write every rendition of the source file and its manifest. Return the manifest entries."""
+    stream = VideoStream(source)
+    count = stream.frameCount()
+    paths = [renditionPath(source, rendition['name']) for rendition in renditions]
+    outputs = [open(path, 'wb') for path in paths]
+    offsets = [array('Q') for _ in renditions]
+    lengths = [array('I') for _ in renditions]
+    positions = [0] * len(renditions)
+
+    # Frames are copied out of the map, they are pickled to the workers anyway
+    jobs = ((bytes(stream.getFrame(n)), renditions) for n in range(1, count + 1))
+    try:
+        with multiprocessing.Pool(processes) as pool:
+            for encoded in pool.imap(encodeFrame, jobs, CHUNK_FRAMES):
+                for i, data in enumerate(encoded):
+                    outputs[i].write(b'%05d' % len(data))
+                    outputs[i].write(data)
+                    offsets[i].append(positions[i] + FRAME_HEADER_SIZE)
+                    lengths[i].append(len(data))
+                    positions[i] += FRAME_HEADER_SIZE + len(data)
+    finally:
+        for output in outputs:
+            output.close()
+
+    duration = count / stream.frameRate if count else 0
+    entries = [{'name': 'source', 'file': os.path.abspath(source), 'quality': None, 'scale': 1.0,
+                'bitrate': int(os.path.getsize(source) * 8 / duration) if duration else 0}]
+    for i, rendition in enumerate(renditions):
+        saveIndex(paths[i], positions[i], offsets[i], lengths[i])
+        entries.append(dict(rendition, file=os.path.abspath(paths[i]),
+                            bitrate=int(positions[i] * 8 / duration) if duration else 0))
+    stream.close()
+
+    entries.sort(key=lambda entry: -entry['bitrate'])
+    saveManifest(source, entries, count)
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Package an MJPEG file into lower-bitrate renditions")
+    parser.add_argument('source', help="length-prefixed MJPEG file")
+    parser.add_argument('--rendition', action='append', type=parseRendition, metavar='NAME:QUALITY[:SCALE]',
+                        help="rendition to make (repeatable; default: {})".format(', '.join(DEFAULT_RENDITIONS)))
+    parser.add_argument('--processes', type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument('--static-threshold', type=float, default=0,
+                        help="also store which frames repeat the previous one, below this mean luma difference (0-255; 0: off)")
+    args = parser.parse_args()
+
+    renditions = args.rendition or [parseRendition(spec) for spec in DEFAULT_RENDITIONS]
+    for entry in package(args.source, renditions, args.processes):
+        print("{:<10} {:>8.0f} kbit/s  {}".format(entry['name'], entry['bitrate'] / 1000, os.path.basename(entry['file'])))
+    if args.static_threshold:
+        refs = analyzeFile(args.source, args.static_threshold)
+        repeated = sum(1 for n, ref in enumerate(refs, 1) if ref != n)
+        print("{} of {} frames repeat the previous one".format(repeated, len(refs)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+import threading, logging
+from collections import deque
+
+import Metrics
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_FRAMES = 16  # Frames a stream reads ahead of its session
+PREFETCH_BYTES = 4 * 1024 * 1024  # ...unless they take more memory than this
+
+
+class Prefetcher:
+    """Background I/O worker refilling the read-ahead buffers of PrefetchStreams.
+
+    Streams queue themselves when they have room; the worker reads their
+    next frames in order, so disk stalls land on this thread and not on
+    the pacing loop. Streams queued before start() wait for it.
+    """
+
+    def __init__(self, frames=PREFETCH_FRAMES, maxBytes=PREFETCH_BYTES):
+        self.frames = frames
+        self.maxBytes = maxBytes
+        self.queue = deque()
+        self.ready = threading.Condition()
+        self.thread = None
+
+    def configure(self, frames=PREFETCH_FRAMES, maxBytes=PREFETCH_BYTES):
+        """Change the read-ahead window of every stream; 0 frames turns read-ahead off."""
+        self.frames = frames
+        self.maxBytes = maxBytes
+
+    def start(self):
+        """Start the I/O worker thread."""
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def schedule(self, stream):
+        """Queue a stream for refilling."""
+        with self.ready:
+            self.queue.append(stream)
+            self.ready.notify()
+
+    def run(self):
+        while True:
+            with self.ready:
+                while not self.queue:
+                    self.ready.wait()
+                stream = self.queue.popleft()
+            try:
+                stream.fill()
+            except Exception:
+                logger.exception("Reading ahead failed")
+
+
+prefetcher = Prefetcher()
+
+
+class PrefetchStream:
+    """VideoStream wrapper that serves frames from a read-ahead buffer.
+
+    Exposes the VideoStream interface. The buffer holds the frames right
+    after the current position, up to the prefetcher's frame and byte
+    window. nextFrame() only reads the file itself when the buffer ran dry
+    (an underrun, counted to size the window). A seek drops the buffer.
+    """
+
+    def __init__(self, stream, prefetcher=prefetcher):
+        self.stream = stream
+        self.prefetcher = prefetcher
+        self.frameRate = stream.frameRate
+        self.frameNum = stream.frameNbr()
+        self.lock = threading.Lock()
+        self.ioLock = threading.Lock()  # Held while reading from the wrapped stream
+        self.buffer = deque()  # Frames frameNum + 1 .. fetched
+        self.bufferedBytes = 0
+        self.fetched = self.frameNum
+        self.generation = 0  # Bumped when the buffer is dropped, to discard reads in flight
+        self.queued = False
+        self.closed = False
+
+        # Statistic variables
+        self.underruns = 0
+
+        self.refill()
+
+    def refill(self):
+        """Have the prefetcher top up the buffer, if it has room. Lock must be held or not yet shared."""
+        if self.queued or self.closed or self.fetched >= self.stream.frameCount():
+            return
+        if len(self.buffer) >= self.prefetcher.frames or self.bufferedBytes >= self.prefetcher.maxBytes:
+            return
+        self.queued = True
+        self.prefetcher.schedule(self)
+
+    def fill(self):
+        """Read frames into the buffer until the window is full. Runs on the prefetcher."""
+        with self.lock:
+            self.queued = False
+            generation = self.generation
+            first = self.fetched + 1
+            count = min(self.prefetcher.frames - len(self.buffer), self.stream.frameCount() - self.fetched)
+        if count <= 0:
+            return
+        with self.ioLock:
+            if self.closed:
+                return
+            # One hint for the whole window, so the kernel reads it sequentially
+            willNeed = getattr(self.stream, 'willNeed', None)
+            if willNeed:
+                willNeed(first, count)
+        for frameNbr in range(first, first + count):
+            with self.ioLock:
+                if self.closed:
+                    return
+                data = self.stream.getFrame(frameNbr)
+            with self.lock:
+                if generation != self.generation:
+                    return
+                self.buffer.append(data)
+                self.bufferedBytes += len(data)
+                self.fetched = frameNbr
+                if self.bufferedBytes >= self.prefetcher.maxBytes:
+                    return
+
+    def drop(self):
+        """Drop the buffer and any read in flight. Lock must be held."""
+        self.buffer.clear()
+        self.bufferedBytes = 0
+        self.fetched = self.frameNum
+        self.generation += 1
+
+    def nextFrame(self):
+        """Get next frame."""
+        with self.lock:
+            if self.frameNum >= self.stream.frameCount():
+                return None
+            self.frameNum += 1
+            frameNbr = self.frameNum
+            if self.buffer:
+                data = self.buffer.popleft()
+                self.bufferedBytes -= len(data)
+            else:
+                data = None
+                self.underruns += 1
+                Metrics.prefetchUnderruns.inc()
+                self.drop()
+            self.refill()
+        if data is None:
+            with self.ioLock:
+                data = self.stream.getFrame(frameNbr)
+        return data
+
+    def getFrame(self, frameNbr):
+        """Get frame by its (1-based) number."""
+        with self.ioLock:
+            return self.stream.getFrame(frameNbr)
+
+    def seek(self, frameNbr):
+        """Position the stream so the next frame returned is frameNbr + 1."""
+        if frameNbr < 0 or frameNbr > self.stream.frameCount():
+            raise IndexError(frameNbr)
+        with self.lock:
+            if frameNbr == self.frameNum:
+                return
+            # Skipping ahead within the buffer keeps the rest of it
+            while self.buffer and self.frameNum < frameNbr <= self.fetched:
+                self.bufferedBytes -= len(self.buffer.popleft())
+                self.frameNum += 1
+            if self.frameNum != frameNbr:
+                self.frameNum = frameNbr
+                self.drop()
+            self.refill()
+
+    def seekTime(self, seconds):
+        """Position the stream at a time offset (in seconds) from the start."""
+        self.seek(int(seconds * self.frameRate))
+
+    def frameNbr(self):
+        """Get frame number."""
+        return self.frameNum
+
+    def frameCount(self):
+        """Get total number of frames."""
+        return self.stream.frameCount()
+
+    def duration(self):
+        """Get media duration in seconds."""
+        return self.stream.duration()
+
+    def bitrate(self):
+        """Get the mean media bitrate in bits per second."""
+        return self.stream.bitrate()
+
+    def close(self):
+        """Drop the buffer and close the wrapped stream."""
+        with self.lock:
+            self.closed = True
+            self.drop()
+        with self.ioLock:
+            self.stream.close()
+
+
+def openPrefetched(stream):
+    """Wrap a stream in a PrefetchStream, unless read-ahead is turned off."""
+    return PrefetchStream(stream) if prefetcher.frames > 0 else stream
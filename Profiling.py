@@ -0,0 +1,94 @@
+import os, signal, tempfile, threading, logging, cProfile, pstats
+
+logger = logging.getLogger(__name__)
+
+PROFILE_ENV = 'RTSP_PROFILE'  # Directory to write session profiles to; set to profile from the start
+DEFAULT_DIRECTORY = os.path.join(tempfile.gettempdir(), 'rtsp-profiles')
+
+
+class SessionProfiler:
+    """Opt-in cProfile of the hot paths of every session, dumped per session.
+
+    Off, call() costs one attribute check. On, each session gets one
+    profile per path ('rtsp' for request handling, 'rtp' for frame
+    sending, each only ever run by one thread at a time), written as
+    session-ID-PATH-PID.prof when the session closes or profiling is
+    turned off; a later dump of the same session is added to the file.
+    Read the files with pstats or snakeviz.
+    """
+
+    def __init__(self):
+        self.active = False
+        self.directory = DEFAULT_DIRECTORY
+        self.profiles = {}  # (session, path) -> cProfile.Profile
+        self.lock = threading.Lock()
+
+    def configure(self, directory=None):
+        """Start profiling if directory (or the RTSP_PROFILE environment variable) is set."""
+        directory = directory or os.environ.get(PROFILE_ENV)
+        if directory:
+            self.directory = directory
+            self.start()
+
+    def start(self):
+        """Profile sessions from now on."""
+        os.makedirs(self.directory, exist_ok=True)
+        self.active = True
+        logger.warning("Profiling sessions into %s", self.directory)
+
+    def stop(self):
+        """Stop profiling and dump what was collected."""
+        self.active = False
+        with self.lock:
+            sessions = set(session for session, path in self.profiles)
+        for session in sessions:
+            self.dump(session)
+        logger.warning("Profiling stopped, profiles are in %s", self.directory)
+
+    def toggle(self, signum=None, frame=None):
+        """Turn profiling on or off; a signal handler, so the dumps run on a thread of their own."""
+        if self.active:
+            threading.Thread(target=self.stop, daemon=True).start()
+        else:
+            self.start()
+
+    def installSignal(self, signum=getattr(signal, 'SIGUSR1', None)):
+        """Toggle profiling when the process gets the signal. Call from the main thread."""
+        if signum is not None:
+            signal.signal(signum, self.toggle)
+
+    def call(self, session, path, func, *args):
+        """Run func(*args), profiled under the session and path when profiling is on."""
+        if not self.active:
+            return func(*args)
+        key = (session, path)
+        with self.lock:
+            profile = self.profiles.get(key)
+            if profile is None:
+                profile = self.profiles[key] = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # Another profiler is active on this thread
+            return func(*args)
+        try:
+            return func(*args)
+        finally:
+            profile.disable()
+
+    def dump(self, session):
+        """Write the profiles of a session, if any, and forget them."""
+        with self.lock:
+            keys = [key for key in self.profiles if key[0] is session]
+            profiles = [(key[1], self.profiles.pop(key)) for key in keys]
+        for path, profile in profiles:
+            name = os.path.join(self.directory, 'session-{}-{}-{}.prof'.format(session.clientInfo.get('session', 'none'), path, os.getpid()))
+            try:
+                stats = pstats.Stats(profile)
+                if os.path.exists(name):
+                    stats.add(name)
+                stats.dump_stats(name)
+            except (OSError, TypeError):  # TypeError: nothing was recorded
+                logger.warning("Could not write profile %s", name, exc_info=True)
+
+
+profiler = SessionProfiler()
@@ -0,0 +1,46 @@
+LOSS_THRESHOLD = 0.05  # Fraction lost above which a session backs off
+JITTER_THRESHOLD = 0.04  # seconds of interarrival jitter above which a session backs off
+RECOVER_LOSS = 0.01  # Loss must stay below this to speed up again
+RECOVER_REPORTS = 3  # ...for this many reports in a row
+MAX_THINNING = 8
+
+
+class RateController:
+    """Choose a session's rendition and frame thinning from its receiver reports.
+
+    The session sends one frame out of every `thinning`, at 1/thinning of
+    the frame rate, so media time still advances in real time. When loss
+    or jitter exceeds its threshold, the session first steps down to the
+    next lower rendition (if the media has several), then doubles the
+    thinning. After RECOVER_REPORTS clean reports it undoes one step, in
+    reverse order: thinning is halved, then the rendition stepped up.
+    """
+
+    def __init__(self, lossThreshold=LOSS_THRESHOLD, jitterThreshold=JITTER_THRESHOLD, maxThinning=MAX_THINNING, renditions=1):
+        self.lossThreshold = lossThreshold
+        self.jitterThreshold = jitterThreshold
+        self.maxThinning = maxThinning
+        self.renditions = renditions
+        self.rendition = 0  # Index of the rendition, best first
+        self.thinning = 1
+        self.cleanReports = 0
+
+    def update(self, lossRate, jitter):
+        """Process one report (loss as a fraction, jitter in seconds). Return the new thinning."""
+        if lossRate > self.lossThreshold or jitter > self.jitterThreshold:
+            if self.rendition < self.renditions - 1:
+                self.rendition += 1
+            else:
+                self.thinning = min(self.thinning * 2, self.maxThinning)
+            self.cleanReports = 0
+        elif lossRate < RECOVER_LOSS and jitter < self.jitterThreshold / 2:
+            self.cleanReports += 1
+            if self.cleanReports >= RECOVER_REPORTS:
+                if self.thinning > 1:
+                    self.thinning = max(1, self.thinning // 2)
+                elif self.rendition > 0:
+                    self.rendition -= 1
+                self.cleanReports = 0
+        else:
+            self.cleanReports = 0
+        return self.thinning
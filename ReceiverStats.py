@@ -0,0 +1,255 @@
+import csv, json, time, threading, logging
+from array import array
+
+from RtpPacket import CLOCK_RATE
+from Rtcp import ReceiverReport
+
+logger = logging.getLogger(__name__)
+
+# Sequence number validation (RFC 3550 A.1)
+RTP_SEQ_MOD = 1 << 16
+MAX_DROPOUT = 3000  # Forward jump still taken as packets lost
+MAX_MISORDER = 100  # Backward jump still taken as packets reordered
+MIN_SEQUENTIAL = 2  # Packets in sequence before a new source is believed
+
+BITRATE_WINDOW = 2.0  # seconds the bitrate is averaged over
+BITRATE_BUCKETS = 20
+EXPORT_INTERVAL = 1.0  # seconds between exported rows
+
+EXPORT_FIELDS = ('time', 'name', 'ssrc', 'received', 'expected', 'lost', 'lossRate', 'discarded',
+                 'highestSeq', 'jitterMs', 'bitrate', 'bytes')
+
+
+class ReceiverStats:
+    """Reception statistics of one RTP source, as RFC 3550 defines them.
+
+    Sequence numbers are validated and extended past their 16-bit wrap as
+    in appendix A.1: a new source is only believed after MIN_SEQUENTIAL
+    packets in sequence, a large jump is only believed once the packet
+    after it arrives, and duplicates or reordered packets count as
+    received without moving the highest sequence number. Expected and lost
+    counts follow A.3, interarrival jitter A.8. The bitrate is averaged
+    over a sliding window of BITRATE_WINDOW seconds of arrivals, so pauses
+    do not dilute it.
+
+    update() only does arithmetic on preallocated state; it creates no
+    containers per packet.
+    """
+
+    __slots__ = ('clockRate', 'ssrc', 'baseSeq', 'maxSeq', 'badSeq', 'probation', 'cycles',
+                 'received', 'expectedPrior', 'receivedPrior', 'discarded', 'transit', 'jitter',
+                 'bytes', 'bucketWidth', 'buckets', 'bucket')
+
+    def __init__(self, clockRate=CLOCK_RATE, window=BITRATE_WINDOW):
+        self.clockRate = clockRate
+        self.bucketWidth = window / BITRATE_BUCKETS
+        self.buckets = array('Q', bytes(8 * BITRATE_BUCKETS))  # Bytes received per slice of the window
+        self.reset()
+
+    def reset(self, ssrc=None):
+        """Forget everything about the source, e.g. when it changes."""
+        self.ssrc = ssrc
+        self.baseSeq = None
+        self.maxSeq = 0
+        self.badSeq = RTP_SEQ_MOD + 1  # Not a sequence number
+        self.probation = MIN_SEQUENTIAL
+        self.cycles = 0  # Wraps of the sequence number, times RTP_SEQ_MOD
+        self.received = 0
+        self.expectedPrior = 0
+        self.receivedPrior = 0
+        self.discarded = 0  # Packets not believed to belong to the stream
+        self.transit = None
+        self.jitter = 0.0  # RTP timestamp units
+        self.bytes = 0
+        for i in range(BITRATE_BUCKETS):
+            self.buckets[i] = 0
+        self.bucket = 0  # Absolute number of the slice the last arrival fell into
+
+    def initSeq(self, seq):
+        """Start counting from sequence number seq."""
+        self.baseSeq = seq
+        self.maxSeq = seq
+        self.badSeq = RTP_SEQ_MOD + 1
+        self.cycles = 0
+        self.received = 0
+        self.expectedPrior = 0
+        self.receivedPrior = 0
+
+    def updateSeq(self, seq):
+        """Validate a sequence number. Return True if the packet counts as received."""
+        udelta = (seq - self.maxSeq) & 0xFFFF
+        if self.probation:
+            # A new source: wait for packets in sequence
+            if seq == (self.maxSeq + 1) & 0xFFFF:
+                self.probation -= 1
+                self.maxSeq = seq
+                if self.probation == 0:
+                    self.initSeq(seq)
+                    self.received += 1
+                    return True
+            else:
+                self.probation = MIN_SEQUENTIAL - 1
+                self.maxSeq = seq
+            return False
+        if udelta < MAX_DROPOUT:
+            # In order, with a permissible gap
+            if seq < self.maxSeq:
+                self.cycles += RTP_SEQ_MOD
+            self.maxSeq = seq
+        elif udelta <= RTP_SEQ_MOD - MAX_MISORDER:
+            # A large jump: believe it once the next packet follows it, as after a sender restart
+            if seq != self.badSeq:
+                self.badSeq = (seq + 1) & 0xFFFF
+                return False
+            self.initSeq(seq)
+        # Otherwise a duplicate or reordered packet
+        self.received += 1
+        return True
+
+    def update(self, rtpPacket, arrival, size=0):
+        """Account for a packet of size bytes received at arrival seconds. Return False if it was not believed."""
+        ssrc = rtpPacket.ssrc()
+        if ssrc != self.ssrc:
+            self.reset(ssrc)
+        if self.baseSeq is None and self.probation == MIN_SEQUENTIAL:  # First packet: expect the next one
+            self.maxSeq = (rtpPacket.seqNum() - 1) & 0xFFFF
+        if not self.updateSeq(rtpPacket.seqNum()):
+            self.discarded += 1
+            return False
+
+        # Interarrival jitter
+        transit = int(arrival * self.clockRate) - rtpPacket.timestamp()
+        if self.transit is not None:
+            d = abs((transit - self.transit + 0x80000000) % 0x100000000 - 0x80000000)
+            self.jitter += (d - self.jitter) / 16
+        self.transit = transit
+
+        self.bytes += size
+        self.advance(arrival)
+        self.buckets[self.bucket % BITRATE_BUCKETS] += size
+        return True
+
+    def rebase(self):
+        """Start interarrival jitter over from the next packet, e.g. after a pause.
+
+        Otherwise the gap since the last packet counts as one huge transit difference.
+        """
+        self.transit = None
+
+    def advance(self, now):
+        """Move the bitrate window up to now, clearing the slices it leaves behind."""
+        bucket = int(now / self.bucketWidth)
+        if bucket <= self.bucket:
+            return
+        for i in range(self.bucket + 1, min(bucket, self.bucket + BITRATE_BUCKETS) + 1):
+            self.buckets[i % BITRATE_BUCKETS] = 0
+        self.bucket = bucket
+
+    def extendedMax(self):
+        """Return the extended highest sequence number received."""
+        return self.cycles + self.maxSeq
+
+    def expected(self):
+        """Return the number of packets expected from the source."""
+        if self.baseSeq is None:
+            return 0
+        return self.extendedMax() - self.baseSeq + 1
+
+    def lost(self):
+        """Return the cumulative number of packets lost; duplicates can make it negative."""
+        return self.expected() - self.received
+
+    def lossRate(self):
+        """Return the fraction of expected packets lost since the start."""
+        expected = self.expected()
+        return max(0, self.lost()) / expected if expected else 0.0
+
+    def jitterSeconds(self):
+        """Return the interarrival jitter in seconds."""
+        return self.jitter / self.clockRate
+
+    def bitrate(self, now):
+        """Return the receive bitrate over the window ending now, in bits per second."""
+        self.advance(now)
+        covered = (BITRATE_BUCKETS - 1) * self.bucketWidth + (now - self.bucket * self.bucketWidth)
+        return sum(self.buckets) * 8 / covered if covered > 0 else 0.0
+
+    def report(self, ssrc):
+        """Return a ReceiverReport of this source from receiver ssrc (A.3), or None before any packet."""
+        if self.baseSeq is None:
+            return None
+        expected = self.expected()
+        expectedInterval = expected - self.expectedPrior
+        lostInterval = expectedInterval - (self.received - self.receivedPrior)
+        self.expectedPrior = expected
+        self.receivedPrior = self.received
+        fraction = 0 if expectedInterval == 0 or lostInterval <= 0 else (lostInterval << 8) // expectedInterval
+        return ReceiverReport(ssrc, self.ssrc, min(fraction, 255), self.lost(), self.extendedMax(), self.jitter)
+
+    def snapshot(self, now):
+        """Return the statistics as a dict of plain values, for export."""
+        return {
+            'ssrc': self.ssrc,
+            'received': self.received,
+            'expected': self.expected(),
+            'lost': self.lost(),
+            'lossRate': round(self.lossRate(), 6),
+            'discarded': self.discarded,
+            'highestSeq': self.extendedMax() if self.baseSeq is not None else None,
+            'jitterMs': round(self.jitterSeconds() * 1000, 3),
+            'bitrate': round(self.bitrate(now)),
+            'bytes': self.bytes,
+        }
+
+
+class StatsExporter:
+    """Append the statistics of named ReceiverStats to a file every interval, for soak tests.
+
+    A file named *.csv gets one CSV row per source and interval; anything
+    else gets one JSON object per line. Rows are flushed as they are
+    written, so the file can be followed while the test runs.
+    """
+
+    def __init__(self, path, sources, interval=EXPORT_INTERVAL):
+        self.path = path
+        self.sources = sources  # name -> ReceiverStats, or a callable returning that mapping
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Start exporting from a thread of its own."""
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        with open(self.path, 'w', newline='') as f:
+            writer = None
+            if self.path.lower().endswith('.csv'):
+                writer = csv.DictWriter(f, EXPORT_FIELDS)
+                writer.writeheader()
+            while not self.stopped.wait(self.interval):
+                self.export(f, writer)
+            self.export(f, writer)
+
+    def export(self, f, writer):
+        """Write one row per source."""
+        sources = self.sources() if callable(self.sources) else self.sources
+        now = time.monotonic()
+        wallTime = round(time.time(), 3)
+        try:
+            for name, stats in list(sources.items()):
+                row = dict(stats.snapshot(now), time=wallTime, name=name)
+                if writer:
+                    writer.writerow(row)
+                else:
+                    f.write(json.dumps(row) + '\n')
+            f.flush()
+        except (OSError, ValueError):
+            logger.warning("Could not export receiver statistics to %s", self.path, exc_info=True)
+
+    def stop(self):
+        """Write a last row per source and close the file."""
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
@@ -0,0 +1,141 @@
+import os, threading, logging
+from array import array
+from collections import deque
+
+from RtpPacket import CLOCK_RATE
+from VideoStream import FRAME_HEADER_SIZE, DEFAULT_FRAME_RATE, saveIndex
+
+logger = logging.getLogger(__name__)
+
+RECORD_QUEUE_FRAMES = 64  # Frames waiting for the writer before new ones are dropped
+WRITE_BATCH = 64  # Frames gathered into one writev() call
+MAX_GAP_FRAMES = DEFAULT_FRAME_RATE  # Missing frames filled in by repeating the previous one
+MAX_FRAME_SIZE = 10 ** FRAME_HEADER_SIZE - 1  # What the ASCII length prefix can express
+
+HAVE_WRITEV = hasattr(os, 'writev')
+IOV_MAX = os.sysconf('SC_IOV_MAX') if HAVE_WRITEV and 'SC_IOV_MAX' in os.sysconf_names else 16  # Buffers per writev()
+
+
+def writeAll(fd, buffers):
+    """Write a list of buffers in order, in as few system calls as possible."""
+    if not HAVE_WRITEV:
+        data = memoryview(b''.join(buffers))
+        while data:
+            data = data[os.write(fd, data):]
+        return
+    buffers = [memoryview(buffer) for buffer in buffers]
+    first = 0
+    while first < len(buffers):
+        written = os.writev(fd, buffers[first:first + IOV_MAX])
+        # Resume a partial write where it stopped
+        while written and written >= len(buffers[first]):
+            written -= len(buffers[first])
+            first += 1
+        if written:
+            buffers[first] = buffers[first][written:]
+        while first < len(buffers) and not buffers[first]:
+            first += 1
+
+
+class Recorder:
+    """Record received frames to a length-prefixed MJPEG file, as the server reads them.
+
+    write() only queues the frame, so the receiving thread never waits on
+    the disk; a writer thread gathers queued frames into one writev() each
+    time. When the queue is full the frame is dropped and counted. Frames
+    lost in transit, and empty "repeat previous" frames, are filled in
+    with the previous frame so the recording keeps the frame rate.
+    close() writes the frame-offset index next to the file.
+    """
+
+    def __init__(self, filename, frameRate=DEFAULT_FRAME_RATE, maxQueue=RECORD_QUEUE_FRAMES):
+        self.filename = filename
+        self.fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+        self.frameTicks = CLOCK_RATE / frameRate
+        self.maxQueue = maxQueue
+        self.queue = deque()
+        self.ready = threading.Condition()
+        self.closed = False
+        self.failed = False
+        self.offsets = array('Q')
+        self.lengths = array('I')
+        self.position = 0
+        self.lastFrame = None
+        self.lastTimestamp = None
+
+        # Statistic variables
+        self.framesWritten = 0
+        self.framesDropped = 0
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, frame, timestamp=None):
+        """Queue a received frame with its RTP timestamp. Return False if it was dropped."""
+        if not frame:  # Repeat of the previous frame
+            frame = self.lastFrame
+            if frame is None:
+                return False
+        if len(frame) > MAX_FRAME_SIZE:
+            self.framesDropped += 1
+            return False
+
+        # Frames missing since the last one are repeats of it
+        gap = 0
+        if timestamp is not None and self.lastTimestamp is not None and self.lastFrame is not None:
+            gap = round(((timestamp - self.lastTimestamp) & 0xFFFFFFFF) / self.frameTicks) - 1
+            if not 0 < gap <= MAX_GAP_FRAMES:  # Nothing missing, or a seek
+                gap = 0
+        self.lastTimestamp = timestamp
+
+        with self.ready:
+            if self.closed or self.failed or len(self.queue) + gap + 1 > self.maxQueue:
+                self.framesDropped += 1
+                return False
+            self.queue.extend([self.lastFrame] * gap)
+            self.queue.append(frame)
+            self.ready.notify()
+        self.lastFrame = frame
+        return True
+
+    def run(self):
+        """Write queued frames until the recorder is closed and the queue is empty."""
+        while True:
+            with self.ready:
+                while not self.queue and not self.closed:
+                    self.ready.wait()
+                if not self.queue:
+                    return
+                batch = [self.queue.popleft() for _ in range(min(len(self.queue), WRITE_BATCH))]
+            buffers = []
+            for frame in batch:
+                buffers.append(b'%05d' % len(frame))
+                buffers.append(frame)
+            try:
+                writeAll(self.fd, buffers)
+            except OSError:
+                logger.exception("Recording to %s failed", self.filename)
+                with self.ready:
+                    self.failed = True
+                    self.framesDropped += len(batch) + len(self.queue)
+                    self.queue.clear()
+                return
+            for frame in batch:
+                self.offsets.append(self.position + FRAME_HEADER_SIZE)
+                self.lengths.append(len(frame))
+                self.position += FRAME_HEADER_SIZE + len(frame)
+            self.framesWritten += len(batch)
+
+    def close(self):
+        """Write out the queued frames, then close the file and write its index."""
+        with self.ready:
+            if self.closed:
+                return
+            self.closed = True
+            self.ready.notify()
+        self.thread.join()
+        os.close(self.fd)
+        try:
+            saveIndex(self.filename, self.position, self.offsets, self.lengths)
+        except OSError:  # The server rebuilds a missing index
+            logger.warning("Could not write the index of %s", self.filename, exc_info=True)
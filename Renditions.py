@@ -0,0 +1,121 @@
+import os, json
+
+from FrameCache import CachedStream
+from PrefetchStream import openPrefetched
+
+MANIFEST_EXT = '.renditions'
+
+
+def loadManifest(filename):
+    """Load the rendition manifest written by Packager next to a media file.
+
+    Return the list of renditions, best first, each a dict with at least
+    'name' and 'file' (made absolute); None if the file has no manifest.
+    """
+    try:
+        with open(filename + MANIFEST_EXT) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    directory = os.path.dirname(os.path.abspath(filename))
+    renditions = manifest.get('renditions') or None
+    for rendition in renditions or ():
+        rendition['file'] = os.path.join(directory, rendition['file'])
+    return renditions
+
+
+def saveManifest(filename, renditions, frameCount):
+    """Write the rendition manifest of a media file; rendition files are stored relative to it."""
+    directory = os.path.dirname(os.path.abspath(filename))
+    entries = [dict(rendition, file=os.path.relpath(rendition['file'], directory)) for rendition in renditions]
+    with open(filename + MANIFEST_EXT, 'w') as f:
+        json.dump({'source': os.path.basename(filename), 'frameCount': frameCount, 'renditions': entries}, f, indent=2)
+
+
+class AdaptiveStream:
+    """A media file served in one of several frame-aligned renditions.
+
+    Exposes the VideoStream interface. switch() may be called from any
+    thread; the change takes effect on the next nextFrame() call, which
+    continues at the same position in the new rendition.
+    """
+
+    def __init__(self, filename, renditions):
+        self.filename = filename
+        self.renditions = renditions
+        self.streams = [None] * len(renditions)  # Opened on first use
+        self.rendition = 0
+        self.pending = None  # Rendition to switch to at the next frame
+        self.stream = self.open(0)
+        self.frameRate = self.stream.frameRate
+
+    def open(self, index):
+        """Return the stream of a rendition, opening it if needed."""
+        if self.streams[index] is None:
+            self.streams[index] = openPrefetched(CachedStream(self.renditions[index]['file']))
+        return self.streams[index]
+
+    def find(self, name):
+        """Return the index of the rendition with the given name, or None."""
+        for index, rendition in enumerate(self.renditions):
+            if rendition['name'] == name:
+                return index
+        return None
+
+    def switch(self, index):
+        """Continue from the next frame on in the given rendition."""
+        self.pending = index
+
+    def applySwitch(self):
+        """Make the pending rendition current, at the current position."""
+        index, self.pending = self.pending, None
+        if index is None or index == self.rendition:
+            return
+        stream = self.open(index)
+        stream.seek(min(self.stream.frameNbr(), stream.frameCount()))
+        self.stream = stream
+        self.rendition = index
+
+    def renditionName(self):
+        return self.renditions[self.rendition]['name']
+
+    def nextFrame(self):
+        """Get next frame."""
+        if self.pending is not None:
+            self.applySwitch()
+        return self.stream.nextFrame()
+
+    def getFrame(self, frameNbr):
+        """Get frame by its (1-based) number."""
+        return self.stream.getFrame(frameNbr)
+
+    def seek(self, frameNbr):
+        """Position the stream so the next frame returned is frameNbr + 1."""
+        self.stream.seek(frameNbr)
+
+    def seekTime(self, seconds):
+        """Position the stream at a time offset (in seconds) from the start."""
+        self.stream.seekTime(seconds)
+
+    def frameNbr(self):
+        """Get frame number."""
+        return self.stream.frameNbr()
+
+    def frameCount(self):
+        """Get total number of frames."""
+        return self.stream.frameCount()
+
+    def duration(self):
+        """Get media duration in seconds."""
+        return self.stream.duration()
+
+    def bitrate(self):
+        """Get the mean bitrate of the best rendition, the most a session can need."""
+        return self.open(0).bitrate()
+
+    def close(self):
+        """Release every opened rendition."""
+        for stream in self.streams:
+            if stream is not None:
+                stream.close()
+        self.streams = [None] * len(self.renditions)
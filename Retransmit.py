@@ -0,0 +1,111 @@
+import struct
+
+RING_SIZE = 1024  # Packets kept for retransmission; a power of two
+
+REORDER_GRACE = 0.01  # seconds a gap may be reordering before it is NACKed
+RETRY_INTERVAL = 0.05  # seconds between NACKs of the same packet
+MAX_NACKS = 3  # NACKs per lost packet before giving up
+NACK_WINDOW = 0.2  # seconds a receiver without a jitter buffer waits for a lost packet
+
+SEQ = struct.Struct('!H')  # RTP sequence number, at offset 2 of the header
+
+
+class RetransmitBuffer:
+    """The most recently sent RTP packets of a stream, by sequence number.
+
+    A fixed ring of RING_SIZE slots, so memory is bounded by the packet
+    count; a slot holds the (header, payload) buffers as they were sent.
+    """
+
+    def __init__(self, size=RING_SIZE):
+        self.mask = size - 1
+        self.slots = [None] * size
+
+        # Statistic variables
+        self.requested = 0
+        self.retransmitted = 0
+
+    def store(self, packets):
+        """Remember a batch of sent (header, payload) packets."""
+        slots = self.slots
+        mask = self.mask
+        for packet in packets:
+            seq = SEQ.unpack_from(packet[0], 2)[0]
+            slots[seq & mask] = (seq, packet)
+
+    def lookup(self, seqs):
+        """Return the packets still held for the given sequence numbers, in order."""
+        packets = []
+        for seq in seqs:
+            self.requested += 1
+            slot = self.slots[seq & self.mask]
+            if slot is not None and slot[0] == seq:
+                packets.append(slot[1])
+        self.retransmitted += len(packets)
+        return packets
+
+
+class NackTracker:
+    """Find the packets missing from an RTP stream and decide when to NACK them.
+
+    A gap in the sequence numbers is NACKed once it is older than
+    REORDER_GRACE, then again every RETRY_INTERVAL, up to MAX_NACKS times,
+    for as long as the packet could still make its playout deadline.
+    """
+
+    def __init__(self):
+        self.highestSeq = None  # Extended
+        self.missing = {}  # extended seq -> [time first missed, time last NACKed, NACKs sent]
+
+        # Statistic variables
+        self.nacked = 0  # Packets NACKed at least once
+        self.nacksSent = 0
+        self.recovered = 0  # NACKed packets that arrived
+        self.expired = 0  # NACKed packets that did not arrive in time
+
+    def update(self, seq, arrival):
+        """Account for a received packet. Return True if it is a packet NACKed earlier."""
+        if self.highestSeq is None:
+            self.highestSeq = seq
+            return False
+        delta = (seq - self.highestSeq) & 0xFFFF
+        if delta > RING_SIZE and delta < 0x8000:  # Too far to recover, start over
+            self.highestSeq += delta
+            self.missing.clear()
+            return False
+        if delta < 0x8000:
+            for missed in range(self.highestSeq + 1, self.highestSeq + delta):
+                self.missing[missed] = [arrival, None, 0]
+            self.highestSeq += delta
+            return False
+        entry = self.missing.pop(self.highestSeq + delta - 0x10000, None)
+        if entry is not None and entry[2]:
+            self.recovered += 1
+            return True
+        return False
+
+    def due(self, now, maxAge):
+        """Return the 16-bit sequence numbers to NACK now; forget gaps older than maxAge seconds."""
+        seqs = []
+        for seq, entry in list(self.missing.items()):
+            missed, nacked, count = entry
+            if now - missed > maxAge or (count >= MAX_NACKS and now - nacked >= RETRY_INTERVAL):
+                del self.missing[seq]
+                if count:
+                    self.expired += 1
+                continue
+            if count >= MAX_NACKS or now - missed < REORDER_GRACE:
+                continue
+            if nacked is None or now - nacked >= RETRY_INTERVAL:
+                if not count:
+                    self.nacked += 1
+                entry[1] = now
+                entry[2] = count + 1
+                self.nacksSent += 1
+                seqs.append(seq & 0xFFFF)
+        return seqs
+
+    def reset(self):
+        """Forget the stream, e.g. after a seek or a new PLAY."""
+        self.highestSeq = None
+        self.missing.clear()
@@ -0,0 +1,183 @@
+import socket, struct, threading, logging
+
+from RtpPacket import CLOCK_RATE
+
+logger = logging.getLogger(__name__)
+
+# RTCP packet types (RFC 3550)
+SR = 200
+RR = 201
+RTPFB = 205  # Transport layer feedback (RFC 4585)
+NACK_FMT = 1  # Generic NACK
+
+# Common header: V/P/count, packet type, length in 32-bit words minus one; then the sender SSRC
+HEADER = struct.Struct('!BBHI')
+# Report block: source SSRC, fraction lost and cumulative loss, extended highest sequence number,
+# interarrival jitter, last SR timestamp, delay since last SR
+REPORT_BLOCK = struct.Struct('!IIIIII')
+# Feedback message: media source SSRC after the common header; a generic NACK
+# item is a lost packet id and a bitmask of the 16 packets after it
+FEEDBACK_SOURCE = struct.Struct('!I')
+NACK_ITEM = struct.Struct('!HH')
+
+RTCP_INTERVAL = 1.0  # seconds between receiver reports
+RECV_BUFFER_SIZE = 2048
+
+
+class ReceiverReport:
+    """One report block of an RTCP Receiver Report."""
+
+    __slots__ = ('ssrc', 'sourceSsrc', 'fractionLost', 'cumulativeLost', 'highestSeq', 'jitter', 'lsr', 'dlsr')
+
+    def __init__(self, ssrc=0, sourceSsrc=0, fractionLost=0, cumulativeLost=0, highestSeq=0, jitter=0, lsr=0, dlsr=0):
+        self.ssrc = ssrc  # Reporting receiver
+        self.sourceSsrc = sourceSsrc  # Reported media source
+        self.fractionLost = fractionLost  # Fixed point, 8 fractional bits
+        self.cumulativeLost = cumulativeLost
+        self.highestSeq = highestSeq
+        self.jitter = jitter  # RTP timestamp units
+        self.lsr = lsr
+        self.dlsr = dlsr
+
+    def encode(self):
+        """Return the report as a complete RTCP RR packet."""
+        packet = bytearray(HEADER.size + REPORT_BLOCK.size)
+        HEADER.pack_into(packet, 0, 0x81, RR, len(packet) // 4 - 1, self.ssrc)
+        lost = max(-0x800000, min(0x7FFFFF, self.cumulativeLost)) & 0xFFFFFF
+        REPORT_BLOCK.pack_into(packet, HEADER.size, self.sourceSsrc, self.fractionLost << 24 | lost,
+                               self.highestSeq & 0xFFFFFFFF, int(self.jitter), self.lsr, self.dlsr)
+        return bytes(packet)
+
+    def lossRate(self):
+        """Return the fraction of packets lost in the last interval, as a float."""
+        return self.fractionLost / 256.0
+
+    def jitterSeconds(self, clockRate=CLOCK_RATE):
+        """Return the interarrival jitter in seconds."""
+        return self.jitter / clockRate
+
+
+def parsePackets(data):
+    """Split a compound RTCP packet. Yield (packet type, count field, packet) for each part."""
+    view = memoryview(data)
+    offset = 0
+    while offset + 4 <= len(view):
+        first, packetType, length = struct.unpack_from('!BBH', view, offset)
+        size = (length + 1) * 4
+        if first >> 6 != 2 or offset + size > len(view):
+            return
+        yield packetType, first & 0x1F, view[offset:offset + size]
+        offset += size
+
+
+def parseReceiverReports(packet):
+    """Return the report blocks of an RR packet as ReceiverReport objects; none if it is too short."""
+    if len(packet) < HEADER.size:
+        return []
+    first, _, _, ssrc = HEADER.unpack_from(packet)
+    reports = []
+    for i in range(first & 0x1F):
+        offset = HEADER.size + i * REPORT_BLOCK.size
+        if offset + REPORT_BLOCK.size > len(packet):
+            break
+        source, loss, highest, jitter, lsr, dlsr = REPORT_BLOCK.unpack_from(packet, offset)
+        lost = loss & 0xFFFFFF
+        if lost & 0x800000:
+            lost -= 0x1000000
+        reports.append(ReceiverReport(ssrc, source, loss >> 24, lost, highest, jitter, lsr, dlsr))
+    return reports
+
+
+def encodeNack(ssrc, sourceSsrc, seqs):
+    """Return a generic NACK packet from receiver ssrc for the given lost sequence numbers."""
+    items = []
+    for seq in sorted(set(s & 0xFFFF for s in seqs)):
+        if items and 0 < (seq - items[-1][0]) & 0xFFFF <= 16:
+            items[-1][1] |= 1 << (((seq - items[-1][0]) & 0xFFFF) - 1)
+        else:
+            items.append([seq, 0])
+    packet = bytearray(HEADER.size + FEEDBACK_SOURCE.size + NACK_ITEM.size * len(items))
+    HEADER.pack_into(packet, 0, 0x80 | NACK_FMT, RTPFB, len(packet) // 4 - 1, ssrc)
+    FEEDBACK_SOURCE.pack_into(packet, HEADER.size, sourceSsrc)
+    for i, (seq, mask) in enumerate(items):
+        NACK_ITEM.pack_into(packet, HEADER.size + FEEDBACK_SOURCE.size + i * NACK_ITEM.size, seq, mask)
+    return bytes(packet)
+
+
+def parseNack(packet):
+    """Return (sender SSRC, media source SSRC, lost sequence numbers) of a generic NACK packet, or None if it is too short."""
+    if len(packet) < HEADER.size + FEEDBACK_SOURCE.size:
+        return None
+    _, _, _, ssrc = HEADER.unpack_from(packet)
+    sourceSsrc, = FEEDBACK_SOURCE.unpack_from(packet, HEADER.size)
+    seqs = []
+    for offset in range(HEADER.size + FEEDBACK_SOURCE.size, len(packet) - NACK_ITEM.size + 1, NACK_ITEM.size):
+        seq, mask = NACK_ITEM.unpack_from(packet, offset)
+        seqs.append(seq)
+        for bit in range(16):
+            if mask >> bit & 1:
+                seqs.append((seq + bit + 1) & 0xFFFF)
+    return ssrc, sourceSsrc, seqs
+
+
+class RtcpServer:
+    """Receive RTCP on one UDP port and hand the reports to the sessions they are about.
+
+    Sessions register under the SSRC of the RTP stream they send, and get
+    handleReceiverReport(report, address) called for each report block about it and
+    handleNack(seqs, address) for each generic NACK.
+    """
+
+    def __init__(self):
+        self.sessions = {}  # media SSRC -> session
+        self.socket = None
+
+    def register(self, ssrc, session):
+        self.sessions[ssrc] = session
+
+    def unregister(self, ssrc):
+        self.sessions.pop(ssrc, None)
+
+    def dispatch(self, data, address=None):
+        """Process one received RTCP datagram."""
+        for packetType, count, packet in parsePackets(data):
+            if packetType == RR:
+                for report in parseReceiverReports(packet):
+                    session = self.sessions.get(report.sourceSsrc)
+                    if session is None:
+                        continue
+                    try:
+                        session.handleReceiverReport(report, address)
+                    except Exception:
+                        logger.exception("Handling a receiver report failed")
+            elif packetType == RTPFB and count == NACK_FMT:
+                nack = parseNack(packet)
+                if nack is None:
+                    continue
+                _, sourceSsrc, seqs = nack
+                session = self.sessions.get(sourceSsrc)
+                if session is None:
+                    continue
+                try:
+                    session.handleNack(seqs, address)
+                except Exception:
+                    logger.exception("Handling a NACK failed")
+
+    def start(self, port, reusePort=False):
+        """Listen on the UDP port from a thread of its own."""
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if reusePort:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.socket.bind(('', port))
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while True:
+            data, address = self.socket.recvfrom(RECV_BUFFER_SIZE)
+            try:
+                self.dispatch(data, address)
+            except Exception:
+                logger.exception("Dropping a malformed RTCP packet from %s", address)
+
+
+rtcpServer = RtcpServer()
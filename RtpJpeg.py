@@ -0,0 +1,113 @@
+import struct
+from collections import OrderedDict, deque
+
+# RFC 2435 main JPEG header: type-specific, fragment offset (24 bits), type, Q, width/8, height/8
+JPEG_HEADER = struct.Struct('!I4B')
+JPEG_HEADER_SIZE = JPEG_HEADER.size
+
+DEFAULT_MTU = 1500
+IP_UDP_OVERHEAD = 28
+RTP_HEADER_SIZE = 12
+
+# Frames are sent as complete JFIF images (tables included), so the
+# header only carries fragmentation and geometry.
+JPEG_TYPE = 0
+JPEG_Q = 255
+
+SOF_MARKERS = (0xC0, 0xC1, 0xC2)
+
+MAX_PENDING_FRAMES = 4  # Incomplete frames kept waiting for late fragments
+
+
+def maxFragmentSize(mtu=DEFAULT_MTU):
+    """Return the number of JPEG bytes that fit in one RTP packet."""
+    return mtu - IP_UDP_OVERHEAD - RTP_HEADER_SIZE - JPEG_HEADER_SIZE
+
+
+def jpegSize(frame):
+    """Return (width, height) read from the SOF marker of a JPEG image, or (0, 0)."""
+    pos = 2  # Skip SOI
+    end = len(frame) - 9
+    while pos < end:
+        if frame[pos] != 0xFF:
+            break
+        marker = frame[pos + 1]
+        if marker in SOF_MARKERS:
+            height, width = struct.unpack_from('!HH', frame, pos + 5)
+            return width, height
+        if marker == 0xDA:  # Start of scan, no frame header before it
+            break
+        pos += 2 + struct.unpack_from('!H', frame, pos + 2)[0]
+    return 0, 0
+
+
+def fragmentFrame(frame, mtu=DEFAULT_MTU):
+    """Split a JPEG frame into MTU-sized fragments.
+
+    Return a list of (JPEG header, frame slice, last) tuples; slices share
+    the memory of the frame.
+    """
+    width, height = jpegSize(frame)
+    if width > 2040 or height > 2040:  # Does not fit the 8-bit header fields
+        width = height = 0
+    view = memoryview(frame)
+    size = maxFragmentSize(mtu)
+    total = len(view)
+    fragments = []
+    offset = 0
+    while True:
+        chunk = view[offset:offset + size]
+        header = JPEG_HEADER.pack(offset, JPEG_TYPE, JPEG_Q, width // 8, height // 8)
+        offset += len(chunk)
+        fragments.append((header, chunk, offset >= total))
+        if offset >= total:
+            return fragments
+
+
+class FrameReassembler:
+    """Rebuild JPEG frames from RTP fragments, discarding incomplete frames.
+
+    Fragments are placed by their JPEG fragment offset, grouped by RTP
+    timestamp, so fragments that arrive late or out of order (e.g.
+    retransmitted after a NACK) still complete their frame as long as it
+    is among the last MAX_PENDING_FRAMES frames.
+    """
+
+    def __init__(self, maxPending=MAX_PENDING_FRAMES):
+        self.maxPending = maxPending
+        self.pending = OrderedDict()  # timestamp -> [{offset: data}, bytes held, frame size or None]
+        self.done = deque(maxlen=maxPending)  # Timestamps of recently completed frames
+        self.complete = 0
+        self.discarded = 0
+
+    def push(self, timestamp, marker, payload):
+        """Add one RTP payload. Return the frame it completes, or None."""
+        if len(payload) < JPEG_HEADER_SIZE:
+            return None
+        offset = JPEG_HEADER.unpack_from(payload)[0] & 0xFFFFFF
+        data = payload[JPEG_HEADER_SIZE:]
+
+        entry = self.pending.get(timestamp)
+        if entry is None:
+            if timestamp in self.done:  # Duplicate of a fragment already used
+                return None
+            entry = self.pending[timestamp] = [{}, 0, None]
+            if len(self.pending) > self.maxPending:  # The oldest frame lost a fragment
+                self.pending.popitem(last=False)
+                self.discarded += 1
+        fragments = entry[0]
+        if offset in fragments:
+            return None
+        fragments[offset] = data
+        entry[1] += len(data)
+        if marker:
+            entry[2] = offset + len(data)
+
+        if entry[1] != entry[2]:
+            return None
+        del self.pending[timestamp]
+        self.done.append(timestamp)
+        self.complete += 1
+        if len(fragments) == 1:
+            return bytes(data)
+        return b''.join([fragments[key] for key in sorted(fragments)])
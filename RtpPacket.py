@@ -1,64 +1,141 @@
-import sys
+import struct
 from time import time
 
 HEADER_SIZE = 12
+CLOCK_RATE = 90000  # RTP clock of video payloads (RFC 3551)
+
+# V/P/X/CC, M/PT, sequence number, timestamp, SSRC
+HEADER = struct.Struct('!BBHII')
+CSRC = struct.Struct('!I')
+EXTENSION_HEADER = struct.Struct('!HH')  # Profile-defined id, length in 32-bit words
 
 
 class RtpPacket:
-    header = bytearray(HEADER_SIZE)
+    __slots__ = ('header', 'payload', 'first', 'second', 'seq', 'ts', 'SSRC', 'CSRC', 'ext')
 
     def __init__(self):
-        pass
+        self.header = b''
+        self.payload = b''
+        self.CSRC = ()
+        self.ext = None
+
+    def encode(self, V, P, X, CC, seqNum, M, PT, SSRC, payload, csrc=(), extension=None, timestamp=None):
+        """Encode the RTP packet with header fields and payload.
+
+        csrc is a list of contributing source ids, extension an optional
+        (profile id, data) pair; CC and X are derived from them when given.
+        timestamp defaults to the wall clock on the 90 kHz media clock.
+        """
+        if csrc:
+            CC = len(csrc)
+        if extension is not None:
+            X = 1
+        self.first = V << 6 | P << 5 | X << 4 | CC
+        self.second = M << 7 | PT
+        self.seq = seqNum & 0xFFFF
+        if timestamp is None:
+            timestamp = int(time() * CLOCK_RATE)
+        self.ts = timestamp & 0xFFFFFFFF
+        self.SSRC = SSRC
+        self.CSRC = tuple(csrc)
+        self.ext = extension
 
-    def encode(self, V, P, X, CC, seqNum, M, PT, SSRC, payload):
-        """Encode the RTP packet with header fields and payload."""
         # Build header
-        timestamp = int(time())
-        header = bytearray(HEADER_SIZE)
-        header[0] = header[0] | V << 6
-        header[0] = header[0] | P << 5
-        header[0] = header[0] | X << 4
-        header[0] = header[0] | CC
-        header[1] = header[1] | M << 7
-        header[1] = header[1] | PT
-        header[2] = (seqNum >> 8) & 0xFF
-        header[3] = seqNum & 0xFF
-        header[4] = (timestamp >> 24) & 0xFF
-        header[5] = (timestamp >> 16) & 0xFF
-        header[6] = (timestamp >> 8) & 0xFF
-        header[7] = timestamp & 0xFF
-        header[8] = (SSRC >> 24) & 0xFF
-        header[9] = (SSRC >> 16) & 0xFF
-        header[10] = (SSRC >> 8) & 0xFF
-        header[11] = SSRC & 0xFF
+        if csrc or extension is not None:
+            header = bytearray(self.headerSize())
+            self.packInto(header)
+        else:
+            header = HEADER.pack(self.first, self.second, self.seq, self.ts, SSRC)
 
         # Save header and payload
         self.header = header
         self.payload = payload
 
+    def headerSize(self):
+        """Return the size of the header, CSRC list and extension included."""
+        size = HEADER_SIZE + 4 * len(self.CSRC)
+        if self.ext is not None:
+            size += EXTENSION_HEADER.size + (len(self.ext[1]) + 3) // 4 * 4
+        return size
+
+    def packInto(self, buffer, offset=0):
+        """Write the encoded header into a reusable buffer. Return its size."""
+        HEADER.pack_into(buffer, offset, self.first, self.second, self.seq, self.ts, self.SSRC)
+        pos = offset + HEADER_SIZE
+        for csrc in self.CSRC:
+            CSRC.pack_into(buffer, pos, csrc)
+            pos += 4
+        if self.ext is not None:
+            profile, data = self.ext
+            words = (len(data) + 3) // 4
+            EXTENSION_HEADER.pack_into(buffer, pos, profile, words)
+            pos += EXTENSION_HEADER.size
+            buffer[pos:pos + len(data)] = data
+            buffer[pos + len(data):pos + 4 * words] = bytes(4 * words - len(data))
+            pos += 4 * words
+        return pos - offset
+
     def decode(self, byteStream):
-        """Decode the RTP packet."""
-        self.header = bytearray(byteStream[:HEADER_SIZE])
-        self.payload = byteStream[HEADER_SIZE:]
+        """Decode the RTP packet. The payload is a view of byteStream, not a copy."""
+        view = memoryview(byteStream)
+        first, self.second, self.seq, self.ts, self.SSRC = HEADER.unpack_from(view)
+        self.first = first
+        if not first & 0x3F:  # No padding, extension or CSRC list
+            self.CSRC = ()
+            self.ext = None
+            self.header = view[:HEADER_SIZE]
+            self.payload = view[HEADER_SIZE:]
+            return
+
+        pos = HEADER_SIZE
+        cc = first & 0x0F
+        self.CSRC = struct.unpack_from('!{}I'.format(cc), view, pos)
+        pos += 4 * cc
+        if first & 0x10:
+            profile, words = EXTENSION_HEADER.unpack_from(view, pos)
+            pos += EXTENSION_HEADER.size
+            self.ext = (profile, view[pos:pos + 4 * words])
+            pos += 4 * words
+        else:
+            self.ext = None
+
+        end = len(view)
+        if first & 0x20:  # Last byte counts the padding bytes
+            end -= view[end - 1]
+        self.header = view[:pos]
+        self.payload = view[pos:end]
 
     def version(self):
         """Return RTP version."""
-        return int(self.header[0] >> 6)
+        return self.first >> 6
 
     def seqNum(self):
         """Return sequence (frame) number."""
-        seqNum = (self.header[2] << 8) | self.header[3]
-        return int(seqNum)
+        return self.seq
 
     def timestamp(self):
         """Return timestamp."""
-        timestamp = (self.header[4] << 24) | (self.header[5] << 16) | (self.header[6] << 8) | self.header[7]
-        return int(timestamp)
+        return self.ts
+
+    def marker(self):
+        """Return marker bit."""
+        return self.second >> 7
 
     def payloadType(self):
         """Return payload type."""
-        pt = self.header[1] & 0x7F
-        return int(pt)
+        return self.second & 0x7F
+
+    def ssrc(self):
+        """Return synchronization source id."""
+        return self.SSRC
+
+    def csrc(self):
+        """Return list of contributing source ids."""
+        return self.CSRC
+
+    def extension(self):
+        """Return header extension as (profile id, data), or None."""
+        return self.ext
 
     def getPayload(self):
         """Return payload."""
@@ -66,4 +143,8 @@ class RtpPacket:
 
     def getPacket(self):
         """Return RTP packet."""
-        return self.header + self.payload
+        return bytes(self.header) + self.payload
+
+    def getBuffers(self):
+        """Return RTP packet as (header, payload) buffers, without concatenating them."""
+        return self.header, self.payload
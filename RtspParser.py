@@ -0,0 +1,122 @@
+import re
+
+MAX_HEADER_SIZE = 8192  # Bytes of start line and headers a message may have
+MAX_BODY_SIZE = 1024 * 1024
+
+HEADER_END = re.compile(rb'\r?\n\r?\n')
+LINE_END = re.compile(r'\r?\n')
+
+
+class RtspParseError(ValueError):
+    """The byte stream is not valid RTSP; the connection cannot be recovered."""
+
+
+class RtspMessage:
+    """One RTSP request or reply: start line, headers and body.
+
+    Requests have method, uri and version; replies have version, status
+    and reason. Header names are matched case-insensitively.
+    """
+
+    __slots__ = ('method', 'uri', 'version', 'status', 'reason', 'headers', 'body')
+
+    def __init__(self, startLine, headers, body=''):
+        self.method = self.uri = self.status = self.reason = None
+        parts = startLine.split(None, 2)
+        if parts and parts[0].startswith('RTSP/'):
+            if len(parts) < 2 or not parts[1].isdigit():
+                raise RtspParseError("bad status line: " + startLine)
+            self.version = parts[0]
+            self.status = int(parts[1])
+            self.reason = parts[2] if len(parts) > 2 else ''
+        else:
+            if len(parts) < 2:
+                raise RtspParseError("bad request line: " + startLine)
+            self.method = parts[0]
+            self.uri = parts[1]
+            self.version = parts[2] if len(parts) > 2 else None
+        self.headers = headers  # lower-case name -> value
+        self.body = body
+
+    def header(self, name, default=None):
+        """Return the value of a header, or default if absent."""
+        return self.headers.get(name.lower(), default)
+
+    def session(self):
+        """Return the session id of the Session header without its parameters, or None."""
+        value = self.headers.get('session')
+        return value.split(';')[0].strip() if value else None
+
+
+class RtspParser:
+    """Incremental RTSP parser for one TCP connection.
+
+    feed() takes bytes exactly as they arrive, whatever the segmentation,
+    and returns the messages they complete. Lines may end in CRLF or LF,
+    headers come in any order, bodies are framed by Content-Length, and
+    several pipelined messages may arrive in one buffer. Empty lines
+    between messages (CRLF keep-alives) are skipped.
+    """
+
+    def __init__(self, maxHeaderSize=MAX_HEADER_SIZE, maxBodySize=MAX_BODY_SIZE):
+        self.maxHeaderSize = maxHeaderSize
+        self.maxBodySize = maxBodySize
+        self.buffer = bytearray()
+        self.pending = None  # (start line, headers) waiting for the body
+        self.bodySize = 0
+
+    def feed(self, data):
+        """Add received bytes. Return the list of messages completed, oldest first."""
+        self.buffer += data
+        messages = []
+        while True:
+            if self.pending is None:
+                # Leading blank lines are keep-alives, or the tail of a previous message
+                start = 0
+                while self.buffer[start:start + 1] in (b'\r', b'\n'):
+                    start += 1
+                if start:
+                    del self.buffer[:start]
+                match = HEADER_END.search(self.buffer)
+                if match is None:
+                    if len(self.buffer) > self.maxHeaderSize:
+                        raise RtspParseError("headers exceed {} bytes".format(self.maxHeaderSize))
+                    return messages
+                head = self.buffer[:match.start()].decode('utf-8', 'replace')
+                del self.buffer[:match.end()]
+                self.pending = self.parseHead(head)
+            if len(self.buffer) < self.bodySize:
+                return messages
+            body = self.buffer[:self.bodySize].decode('utf-8', 'replace')
+            del self.buffer[:self.bodySize]
+            startLine, headers = self.pending
+            self.pending = None
+            messages.append(RtspMessage(startLine, headers, body))
+
+    def parseHead(self, head):
+        """Split a header block into its start line and headers; note the body size."""
+        lines = LINE_END.split(head)
+        headers = {}
+        for line in lines[1:]:
+            name, colon, value = line.partition(':')
+            if not colon:
+                raise RtspParseError("bad header line: " + line)
+            headers[name.strip().lower()] = value.strip()
+        length = headers.get('content-length', '0')
+        if not length.isdigit():
+            raise RtspParseError("bad Content-Length: " + length)
+        if int(length) > self.maxBodySize:
+            raise RtspParseError("body exceeds {} bytes".format(self.maxBodySize))
+        self.bodySize = int(length)
+        return lines[0], headers
+
+
+def formatMessage(startLine, headers, body=None):
+    """Return an RTSP message as bytes, with a Content-Length header if it has a body."""
+    message = startLine
+    for name, value in headers.items():
+        message += '\r\n{}: {}'.format(name, value)
+    if body:
+        body = body.encode() if isinstance(body, str) else body
+        message += '\r\nContent-Length: {}'.format(len(body))
+    return (message + '\r\n\r\n').encode() + (body or b'')
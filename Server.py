@@ -1,18 +1,95 @@
 #!/usr/bin/env python3
 
-import sys, socket
+import socket, argparse, logging, functools
 
 from ServerWorker import ServerWorker
+from AsyncServer import AsyncServer
+from FrameCache import frameCache
+from PacingScheduler import pacingScheduler
+from Channel import addChannel
+from Rtcp import rtcpServer
+from Supervisor import Supervisor
+from SessionManager import sessionManager, SESSION_TIMEOUT
+from PrefetchStream import prefetcher, PREFETCH_FRAMES, PREFETCH_BYTES
+from MediaCatalog import MediaCatalog
+from Profiling import profiler
+from UdpSender import batching, BATCH_MODES
+import FrameAnalysis
+import Metrics
 
 
 class Server:
     def main(self):
-        try:
-            SERVER_PORT = int(sys.argv[1])
-        except:
-            print("[Usage: Server.py Server_port]\n")
+        parser = argparse.ArgumentParser(description="RTSP/RTP Motion JPEG streaming server")
+        parser.add_argument('port', type=int, help="RTSP server port")
+        parser.add_argument('--library', help="serve only the media files under this directory, from a persistent metadata catalog")
+        parser.add_argument('--cache-mb', type=int, default=64, help="memory budget of the shared frame cache, in MiB")
+        parser.add_argument('--mtu', type=int, default=ServerWorker.mtu, help="path MTU used to fragment frames into RTP packets")
+        parser.add_argument('--udp-batch', choices=BATCH_MODES, default='sendmsg', help="send a frame's packets with one sendmsg each, in one sendmmsg (Linux), or whichever measures faster at start-up")
+        parser.add_argument('--prefetch-frames', type=int, default=PREFETCH_FRAMES, help="frames each stream reads ahead on a background I/O thread (0: off)")
+        parser.add_argument('--prefetch-kb', type=int, default=PREFETCH_BYTES // 1024, help="most memory a stream's read-ahead may hold, in KiB")
+        parser.add_argument('--static-threshold', type=float, default=0, help="skip frames whose mean luma difference from the last one sent is below this (0-255; 0: only files with a stored analysis; needs NumPy and Pillow)")
+        parser.add_argument('--engine', choices=['threaded', 'asyncio'], default='threaded', help="threaded: one thread per client, asyncio: every session on one event loop")
+        parser.add_argument('--workers', type=int, default=1, help="worker processes sharing the RTSP port with SO_REUSEPORT, restarted when they die")
+        parser.add_argument('--channel', action='append', default=[], metavar='NAME=FILE[,GROUP:PORT]', help="broadcast FILE as live channel NAME, to a multicast group if given (repeatable; single worker only)")
+        parser.add_argument('--session-timeout', type=int, default=SESSION_TIMEOUT, help="seconds without a request or RTCP packet before a session is expired")
+        parser.add_argument('--max-sessions', type=int, default=0, help="concurrent sessions admitted, per worker process (0: no limit)")
+        parser.add_argument('--max-bandwidth', type=float, default=0, help="total media bitrate admitted, in Mbit/s per worker process (0: no limit)")
+        parser.add_argument('--metrics-port', type=int, default=0, help="serve Prometheus metrics on this local HTTP port (0: off)")
+        parser.add_argument('--log-level', default='WARNING', help="logging level, e.g. INFO or DEBUG")
+        args = parser.parse_args()
+        logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+        SERVER_PORT = args.port
+        frameCache.setBudget(args.cache_mb * 1024 * 1024)
+        prefetcher.configure(args.prefetch_frames, args.prefetch_kb * 1024)
+        ServerWorker.mtu = args.mtu
+        batching.configure(args.udp_batch)  # Measured once, before any worker forks
+        if args.static_threshold and not FrameAnalysis.available():
+            parser.error("--static-threshold needs NumPy and Pillow")
+        ServerWorker.staticThreshold = args.static_threshold
+        # With several workers, RTCP about a session can reach any of them
+        sessionManager.configure(args.session_timeout, args.max_sessions, args.max_bandwidth * 1e6, reportsReachUs=args.workers <= 1)
+        if args.channel and args.workers > 1:
+            # Every worker would run its own copy, sending duplicate streams with the same SSRC
+            parser.error("--channel cannot be combined with --workers")
+        for spec in args.channel:
+            addChannel(spec, args.mtu, args.static_threshold)
+        if args.library:
+            # Scanned before forking workers, so every worker starts warm
+            ServerWorker.catalog = MediaCatalog(args.library, staticThreshold=args.static_threshold)
+            ServerWorker.catalog.load()
+            ServerWorker.catalog.scan()
+
+        if args.workers > 1:
+            if not hasattr(socket, 'SO_REUSEPORT'):
+                parser.error("--workers needs SO_REUSEPORT, which this platform lacks")
+            supervisor = Supervisor(args.workers, functools.partial(self.serve, args.engine, SERVER_PORT, True))
+            if args.metrics_port:
+                Metrics.startHttpServer(args.metrics_port, registry=supervisor)
+            supervisor.run()
+            return
+
+        if args.metrics_port:
+            Metrics.startHttpServer(args.metrics_port)
+        self.serve(args.engine, SERVER_PORT)
+
+    def serve(self, engine, port, reusePort=False):
+        """Accept RTSP connections on the port and serve them with the given engine."""
+        prefetcher.start()
+        profiler.installSignal()
+        profiler.configure()
+        if engine == 'asyncio':
+            AsyncServer(port, reusePort).run()
+            return
+
+        pacingScheduler.start()
+        rtcpServer.start(port + 1, reusePort)
+        sessionManager.start()
+
         rtspSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        rtspSocket.bind(('', SERVER_PORT))
+        if reusePort:
+            rtspSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        rtspSocket.bind(('', port))
         rtspSocket.listen(5)
 
         # Receive client info (address,port) through RTSP/TCP session
@@ -1,8 +1,29 @@
 from random import randint
-import sys, traceback, threading, socket
-
-from VideoStream import VideoStream
-from RtpPacket import RtpPacket
+from time import perf_counter
+import sys, traceback, threading, socket, logging, re, math
+
+from FrameCache import CachedStream
+from Renditions import AdaptiveStream, loadManifest
+from PrefetchStream import openPrefetched
+from MediaCatalog import probeCached, describeMedia
+from RtpPacket import RtpPacket, CLOCK_RATE
+from RtpJpeg import fragmentFrame, DEFAULT_MTU
+from PacingScheduler import pacingScheduler
+from UdpSender import sendPackets
+from Channel import channels, parseTransport
+from Rtcp import rtcpServer
+from RateControl import RateController
+from Retransmit import RetransmitBuffer
+from Fec import FecEncoder, MAX_GROUP
+from FrameAnalysis import openRepeatFilter
+from SessionManager import sessionManager
+from RtspParser import RtspParser, RtspParseError, formatMessage
+from Profiling import profiler
+import Metrics
+
+logger = logging.getLogger(__name__)
+
+RECV_BUFFER_SIZE = 4096
 
 
 class ServerWorker:
@@ -12,6 +33,10 @@ class ServerWorker:
     PAUSE = 'PAUSE'
     TEARDOWN = 'TEARDOWN'
     DESCRIBE = 'DESCRIBE'
+    GET_PARAMETER = 'GET_PARAMETER'
+    SET_PARAMETER = 'SET_PARAMETER'
+    OPTIONS = 'OPTIONS'
+    METHODS = (OPTIONS, DESCRIBE, SETUP, PLAY, PAUSE, TEARDOWN, GET_PARAMETER, SET_PARAMETER)
 
     INIT = 0
     READY = 1
@@ -20,148 +45,609 @@ class ServerWorker:
     OK_200 = 0
     FILE_NOT_FOUND_404 = 1
     CON_ERR_500 = 2
+    INVALID_RANGE_457 = 3
+    INVALID_PARAMETER_451 = 4
+    NOT_ENOUGH_BANDWIDTH_453 = 5
+    BAD_REQUEST_400 = 6
+    UNSUPPORTED_TRANSPORT_461 = 7
+    NOT_IMPLEMENTED_501 = 8
+    FORBIDDEN_403 = 9
+    SESSION_NOT_FOUND_454 = 10
+    METHOD_NOT_VALID_455 = 11
 
     state = INIT  # Initial state
 
     clientInfo = {}
 
+    mtu = DEFAULT_MTU  # Frames are split into RTP packets that fit this MTU
+    scheduler = pacingScheduler  # Sends the frames of every playing session
+    channels = channels  # Broadcast channels, by name
+    rtcp = rtcpServer  # Hands receiver reports to the sessions
+    sessionManager = sessionManager  # Expires idle sessions, admits new ones
+    catalog = None  # MediaCatalog that requests are confined to, if any
+    staticThreshold = 0  # Detect repeated frames on the fly below this difference score (0: stored analyses only)
+
     def __init__(self, clientInfo):
         self.clientInfo = clientInfo
+        self.parser = RtspParser()
+        self.sendLock = threading.Lock()  # Held while a frame is sent, so closeSession() cannot pull the socket from under it
 
     def run(self):
+        self.sessionManager.track(self)
         threading.Thread(target=self.recvRtspRequest).start()
 
     def recvRtspRequest(self):
-        """Receive RTSP request from the client."""
+        """Receive RTSP request from the client until it disconnects, then release the session."""
         connSocket = self.clientInfo['rtspSocket'][0]
-        while True:
-            data = connSocket.recv(256)
-            if data:
-                print("\nData received:\n" + data.decode("utf-8"))
-                self.processRtspRequest(data.decode("utf-8"))
-
-    def processRtspRequest(self, data):
+        try:
+            while True:
+                try:
+                    data = connSocket.recv(RECV_BUFFER_SIZE)
+                except OSError:
+                    break
+                if not data:  # Closed by the client, or expired
+                    break
+                if not self.receiveRtsp(data):
+                    break
+        finally:
+            self.closeSession()
+            self.sessionManager.untrack(self)
+            connSocket.close()
+
+    def isStreaming(self):
+        """Return True while the session is playing and frames are still being sent to it."""
+        if self.state != self.PLAYING:
+            return False
+        if 'channel' in self.clientInfo:
+            return True
+        stream = self.clientInfo.get('videoStream')
+        return 'pacing' in self.clientInfo and stream is not None and stream.frameNbr() < stream.frameCount()
+
+    def expire(self):
+        """Close the control connection of an idle session; the receiving thread then releases it."""
+        try:
+            self.clientInfo['rtspSocket'][0].shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def receiveRtsp(self, data):
+        """Handle every request completed by received bytes. Return False if the stream is not RTSP."""
+        try:
+            requests = self.parser.feed(data)
+        except RtspParseError as e:
+            logger.info("Bad RTSP from %s: %s", self.clientInfo['rtspSocket'][1], e)
+            self.replyRtsp(self.BAD_REQUEST_400, '0')
+            return False
+        for request in requests:
+            self.handleRtspRequest(request)
+        return True
+
+    def handleRtspRequest(self, request):
+        """Process a parsed RTSP request, recording how long it took."""
+        logger.debug("Request received: %s %s", request.method, request.headers)
+        self.sessionManager.touch(self)
+        start = perf_counter()
+        profiler.call(self, 'rtsp', self.processRtspRequest, request)
+        # Anything else is one label, so clients cannot grow the metric without bound
+        method = request.method if request.method in self.METHODS else 'other'
+        Metrics.rtspLatency.labels(method).observe(perf_counter() - start)
+
+    def processRtspRequest(self, request):
         """Process RTSP request sent from the client."""
-        # Get the request type
-        request = data.split('\n')
-        line1 = request[0].split(' ')
-        requestType = line1[0]
+        requestType = request.method
 
         # Get the media file name
-        filename = line1[1]
+        filename = request.uri
 
         # Get the RTSP sequence number
-        seq = request[1].split(' ')
+        seq = request.header('CSeq', '0')
 
         # Process SETUP request
         if requestType == self.SETUP:
             if self.state == self.INIT:
-                print("processing SETUP")
+                logger.debug("processing SETUP")
+
+                # Get the RTP/UDP port from the Transport header ("client_port= N" or "client_port: N")
+                match = re.search(r'client_port[=:]\s*(\d+)', request.header('Transport') or '')
+                if not match:
+                    self.replyRtsp(self.UNSUPPORTED_TRANSPORT_461, seq)
+                    return
+                self.clientInfo['rtpPort'] = match.group(1)
 
+                # A broadcast channel is joined, anything else is opened for this session
+                channel = self.channels.get(filename)
                 try:
-                    self.clientInfo['videoStream'] = VideoStream(filename)
-                    self.state = self.READY
+                    if not channel and self.catalog:
+                        filename = self.findMedia(filename)['path']
+                    if channel:
+                        self.clientInfo['channel'] = channel
+                    else:
+                        # Packaged media can switch between its renditions
+                        renditions = loadManifest(filename)
+                        if renditions:
+                            self.clientInfo['videoStream'] = AdaptiveStream(filename, renditions)
+                        else:
+                            self.clientInfo['videoStream'] = openPrefetched(CachedStream(filename))
+                        self.clientInfo['repeats'] = openRepeatFilter(filename, self.staticThreshold)
+                except ValueError:
+                    self.replyRtsp(self.FORBIDDEN_403, seq)
+                    return
                 except IOError:
-                    self.replyRtsp(self.FILE_NOT_FOUND_404, seq[1])
+                    self.replyRtsp(self.FILE_NOT_FOUND_404, seq)
+                    return
+
+                # Refuse the session rather than degrade the ones already playing
+                media = channel or self.clientInfo['videoStream']
+                if not self.sessionManager.admit(self, media.bitrate()):
+                    self.clientInfo.pop('channel', None)
+                    videoStream = self.clientInfo.pop('videoStream', None)
+                    if videoStream:
+                        videoStream.close()
+                    self.replyRtsp(self.NOT_ENOUGH_BANDWIDTH_453, seq)
+                    return
+                self.state = self.READY
+                self.clientInfo['active'] = True
+                Metrics.activeSessions.inc()
 
                 # Generate a randomized RTSP session ID
                 self.clientInfo['session'] = randint(100000, 999999)
 
-                # Send RTSP reply
-                self.replyRtsp(self.OK_200, seq[1])
+                # Random initial RTP timestamp, as RFC 3550 recommends
+                self.clientInfo['rtpTimestampBase'] = randint(0, 0xFFFFFFFF)
+
+                transport = channel.transport() if channel else None
+
+                # Receiver reports find the session by the SSRC of its RTP stream
+                if not channel:
+                    self.clientInfo['ssrc'] = randint(0, 0xFFFFFFFF)
+                    renditions = getattr(self.clientInfo.get('videoStream'), 'renditions', ())
+                    self.clientInfo['rateControl'] = RateController(renditions=max(1, len(renditions)))
+                    self.clientInfo['retransmit'] = RetransmitBuffer()
+                    self.rtcp.register(self.clientInfo['ssrc'], self)
+
+                    requested = parseTransport(request.header('Transport') or '')
+                    params = []
+
+                    # XOR parity over every K packets, if the client asks for it (Transport: ...;fec=K)
+                    fec = requested.get('fec', '')
+                    if fec.isdigit() and int(fec) > 0:
+                        k = min(int(fec), MAX_GROUP)
+                        self.clientInfo['fec'] = FecEncoder(k, self.clientInfo['ssrc'])
+                        params.append('fec={}'.format(k))
 
-                # Get the RTP/UDP port from the last line
-                self.clientInfo['rtpPort'] = request[2].split(' ')[3]
+                    # Clients that understand it get an empty frame for a repeated one, others nothing
+                    if 'x-repeat' in requested and self.clientInfo.get('repeats'):
+                        self.clientInfo['repeatSignal'] = True
+                        params.append('x-repeat')
+
+                    if params:
+                        transport = ';'.join(['RTP/UDP', 'unicast'] + params)
+
+                # Send RTSP reply
+                self.replyRtsp(self.OK_200, seq, headers={'Transport': transport} if transport else None)
+            else:
+                self.replyRtsp(self.METHOD_NOT_VALID_455, seq)
 
         # Process PLAY request
         elif requestType == self.PLAY:
             if self.state == self.READY:
-                print("processing PLAY")
+                logger.debug("processing PLAY")
+
+                # Channels are live: viewers join wherever the channel is
+                if 'channel' in self.clientInfo:
+                    self.state = self.PLAYING
+                    self.replyRtsp(self.OK_200, seq, headers={'Range': 'npt=now-'})
+                    self.startStreaming()
+                    return
+
+                # Start from the requested position, if any
+                playRange = request.header('Range')
+                if playRange:
+                    try:
+                        self.seekRange(playRange)
+                    except (ValueError, IndexError, OverflowError):
+                        self.replyRtsp(self.INVALID_RANGE_457, seq)
+                        return
                 self.state = self.PLAYING
 
-                # Create a new socket for RTP/UDP
-                self.clientInfo["rtpSocket"] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                self.replyRtsp(self.OK_200, seq[1])
-
-                # Create a new thread and start sending RTP packets
-                self.clientInfo['event'] = threading.Event()
-                self.clientInfo['worker'] = threading.Thread(target=self.sendRtp)
-                self.clientInfo['worker'].start()
+                stream = self.clientInfo['videoStream']
+                self.replyRtsp(self.OK_200, seq, headers={'Range': 'npt={:.3f}-'.format(stream.frameNbr() / stream.frameRate)})
+
+                # Start sending RTP packets
+                self.startStreaming()
+            elif self.state == self.PLAYING:
+                # Already playing: fine as it is, but seeking needs a PAUSE first
+                if 'channel' in self.clientInfo:
+                    self.replyRtsp(self.OK_200, seq, headers={'Range': 'npt=now-'})
+                elif request.header('Range'):
+                    self.replyRtsp(self.METHOD_NOT_VALID_455, seq)
+                else:
+                    stream = self.clientInfo['videoStream']
+                    self.replyRtsp(self.OK_200, seq, headers={'Range': 'npt={:.3f}-'.format(stream.frameNbr() / stream.frameRate)})
+            else:
+                self.replyRtsp(self.SESSION_NOT_FOUND_454, seq)
 
         # Process PAUSE request
         elif requestType == self.PAUSE:
             if self.state == self.PLAYING:
-                print("processing PAUSE")
+                logger.debug("processing PAUSE")
                 self.state = self.READY
-                self.clientInfo['event'].set()
-                self.replyRtsp(self.OK_200, seq[1])
+                self.stopStreaming()
+                self.replyRtsp(self.OK_200, seq)
+            elif self.state == self.READY:  # Already paused
+                self.replyRtsp(self.OK_200, seq)
+            else:
+                self.replyRtsp(self.SESSION_NOT_FOUND_454, seq)
 
         # Process TEARDOWN request
         elif requestType == self.TEARDOWN:
-            print("processing TEARDOWN")
-            self.clientInfo['event'].set()
-            self.replyRtsp(self.OK_200, seq[1])
+            if self.state == self.INIT:
+                self.replyRtsp(self.SESSION_NOT_FOUND_454, seq)
+                return
+            logger.debug("processing TEARDOWN")
+            self.stopStreaming()
+            self.replyRtsp(self.OK_200, seq)
 
-            # Close the RTP socket
-            self.clientInfo['rtpSocket'].close()
+            # Close the RTP socket and release the media file
+            self.closeSession()
+
+            # Back to INIT: the connection can only SETUP a new session
+            self.state = self.INIT
+            for key in [key for key in self.clientInfo if key != 'rtspSocket']:
+                del self.clientInfo[key]
 
         # Process DESCRIBE request
         elif requestType == self.DESCRIBE:
-            print("processing DESCRIBE")
-            description = "v=0\r\ns={}\r\na=Real Time Streaming Protocol (RTSP)\r\na=Motion JPEG (M-JPEG/MJPEG)".format(self.clientInfo['session'])
-            self.replyRtsp(self.OK_200, seq[1], description)
-
-    def sendRtp(self):
-        """Send RTP packets over UDP."""
-        while True:
-            self.clientInfo['event'].wait(0.05)
-
-            # Stop sending if request is PAUSE or TEARDOWN
-            if self.clientInfo['event'].isSet():
-                break
-
-            data = self.clientInfo['videoStream'].nextFrame()
-            if data:
-                frameNumber = self.clientInfo['videoStream'].frameNbr()
-                try:
-                    address = self.clientInfo['rtspSocket'][1][0]
-                    print("Sent frame", frameNumber)
-                    port = int(self.clientInfo['rtpPort'])
-                    self.clientInfo['rtpSocket'].sendto(self.makeRtp(data, frameNumber), (address, port))
-                except:
-                    print("Connection Error")
-
-    def makeRtp(self, payload, frameNbr):
+            logger.debug("processing DESCRIBE")
+            channel = self.channels.get(filename)
+            try:
+                info = channel.info if channel else self.findMedia(filename)
+            except ValueError:
+                self.replyRtsp(self.FORBIDDEN_403, seq)
+                return
+            except IOError:
+                self.replyRtsp(self.FILE_NOT_FOUND_404, seq)
+                return
+            description = describeMedia(info, filename, self.clientInfo.get('session', 0), live=bool(channel))
+            self.replyRtsp(self.OK_200, seq, description, headers={'Content-Type': 'application/sdp'})
+
+        # Process GET_PARAMETER request
+        elif requestType == self.GET_PARAMETER:
+            logger.debug("processing GET_PARAMETER")
+            parameters = self.getParameters()
+
+            # The body lists the wanted parameters, one per line; none means all
+            names = request.body.split()
+            if names:
+                parameters = {name: parameters[name] for name in names if name in parameters}
+            self.replyRtsp(self.OK_200, seq, ''.join('{}: {}\r\n'.format(name, value) for name, value in parameters.items()))
+
+        # Process SET_PARAMETER request
+        elif requestType == self.SET_PARAMETER:
+            logger.debug("processing SET_PARAMETER")
+            for line in request.body.splitlines():
+                name, _, value = line.partition(':')
+                if not name.strip():
+                    continue
+                if not self.setParameter(name.strip().lower(), value.strip()):
+                    self.replyRtsp(self.INVALID_PARAMETER_451, seq)
+                    return
+            self.replyRtsp(self.OK_200, seq)
+
+        # Process OPTIONS request, also used as a keep-alive
+        elif requestType == self.OPTIONS:
+            logger.debug("processing OPTIONS")
+            self.replyRtsp(self.OK_200, seq, headers={'Public': ', '.join(self.METHODS)})
+
+        else:
+            self.replyRtsp(self.NOT_IMPLEMENTED_501, seq)
+
+    def findMedia(self, filename):
+        """Return the metadata of a requested media file, from the catalog if there is one.
+
+        Raise ValueError for a file outside the library, IOError for a missing
+        one or one without any frame.
+        """
+        info = self.catalog.lookup(filename) if self.catalog else probeCached(filename)
+        if info is None or not info['frameCount']:
+            raise IOError(filename)
+        return info
+
+    def setParameter(self, name, value):
+        """Apply a SET_PARAMETER line. Return False if the parameter or value is not supported."""
+        if name == 'rendition':
+            stream = self.clientInfo.get('videoStream')
+            index = stream.find(value) if hasattr(stream, 'renditions') else None
+            if index is None:
+                return False
+            stream.switch(index)
+            rateControl = self.clientInfo.get('rateControl')
+            if rateControl:  # Adapt from the chosen rendition on
+                rateControl.rendition = index
+                rateControl.cleanReports = 0
+            return True
+        return False
+
+    def getParameters(self):
+        """Return the statistics of this session and of the whole server."""
+        parameters = {
+            'state': self.state,
+            'frames_sent': self.clientInfo.get('framesSent', 0),
+            'packets_sent': self.clientInfo.get('packetsSent', 0),
+            'bytes_sent': self.clientInfo.get('bytesSent', 0),
+            'loss_rate': self.clientInfo.get('lossRate', 0.0),
+            'jitter': self.clientInfo.get('jitter', 0.0),
+            'thinning': self.clientInfo.get('thinning', 1),
+        }
+        stream = self.clientInfo.get('videoStream')
+        if stream:
+            parameters['position'] = '{:.3f}'.format(stream.frameNbr() / stream.frameRate)
+            if hasattr(stream, 'renditions'):
+                parameters['rendition'] = stream.renditionName()
+            if hasattr(stream, 'underruns'):
+                parameters['prefetch_underruns'] = stream.underruns
+        parameters.update(Metrics.registry.snapshot())
+        return parameters
+
+    def seekRange(self, playRange):
+        """Seek the video stream to the start of an RTSP Range header value.
+
+        Supports normal play time ("npt=12.5-", "npt=now-") and, as an
+        extension, absolute frame numbers ("frames=240-").
+        """
+        unit, _, spec = playRange.partition('=')
+        start = spec.split('-')[0].strip()
+        stream = self.clientInfo['videoStream']
+        unit = unit.strip().lower()
+        if unit == 'npt':
+            if start in ('', 'now'):
+                return
+            # npt may be given as seconds or as h:m:s
+            seconds = 0.0
+            for part in start.split(':'):
+                seconds = seconds * 60 + float(part)
+            if not math.isfinite(seconds):  # "inf" and "nan" parse as floats
+                raise ValueError(playRange)
+            stream.seekTime(seconds)
+        elif unit == 'frames':
+            stream.seek(int(start))
+        else:
+            raise ValueError(playRange)
+
+    def startStreaming(self):
+        """Start sending RTP packets at the frame rate of the media."""
+        # Create a new socket for RTP/UDP
+        if 'rtpSocket' not in self.clientInfo:
+            self.clientInfo["rtpSocket"] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        self.schedule()
+
+    def schedule(self):
+        """Have the pacing scheduler, or the channel of the session, send the frames."""
+        # The first frame after a (re)start is sent in full
+        repeats = self.clientInfo.get('repeats')
+        if repeats:
+            repeats.reset()
+
+        channel = self.clientInfo.get('channel')
+        if channel:
+            channel.subscribe(self, self.scheduler)
+        else:
+            frameRate = self.clientInfo['videoStream'].frameRate / self.clientInfo.get('thinning', 1)
+            self.clientInfo['pacing'] = self.scheduler.add(self, frameRate)
+
+    def stopStreaming(self):
+        """Stop sending RTP packets."""
+        channel = self.clientInfo.get('channel')
+        if channel:
+            channel.unsubscribe(self)
+        pacing = self.clientInfo.pop('pacing', None)
+        if pacing:
+            self.scheduler.remove(pacing)
+
+    def closeSession(self):
+        """Release the RTP socket and the media file of the session."""
+        self.stopStreaming()
+        if self.clientInfo.pop('active', False):
+            Metrics.activeSessions.dec()
+        self.sessionManager.release(self)
+        if 'ssrc' in self.clientInfo:
+            self.rtcp.unregister(self.clientInfo['ssrc'])
+        with self.sendLock:  # Wait out a frame already being sent
+            rtpSocket = self.clientInfo.pop('rtpSocket', None)
+            videoStream = self.clientInfo.pop('videoStream', None)
+        if rtpSocket:
+            rtpSocket.close()
+        if videoStream:
+            videoStream.close()
+        profiler.dump(self)
+
+    def sendFrame(self):
+        """Send the next frame of the video stream to the client."""
+        profiler.call(self, 'rtp', self.sendNextFrame)
+
+    def sendNextFrame(self):
+        """Read, packetize and send the next frame, unless the session stopped streaming meanwhile."""
+        with self.sendLock:
+            if 'pacing' not in self.clientInfo:  # Paused or torn down after the scheduler picked the session
+                return
+            try:
+                stream = self.clientInfo['videoStream']
+
+                # Skip the frames thinned out by rate control
+                thinning = self.clientInfo.get('thinning', 1)
+                if thinning > 1:
+                    stream.seek(min(stream.frameNbr() + thinning - 1, stream.frameCount()))
+
+                data = stream.nextFrame()
+                if not data:
+                    return
+                frameNumber = stream.frameNbr()
+                repeats = self.clientInfo.get('repeats')
+                if repeats and repeats.isRepeat(frameNumber, data, perf_counter()):
+                    Metrics.framesRepeated.inc()
+                    if not self.clientInfo.get('repeatSignal'):
+                        return
+                    data = b''  # One header-only packet: "repeat the previous frame"
+
+                # Media clock position of the frame
+                timestamp = self.clientInfo.get('rtpTimestampBase', 0) + int((frameNumber - 1) * CLOCK_RATE / stream.frameRate)
+                packets = self.makeRtpFragments(data, timestamp)
+                self.clientInfo['retransmit'].store(packets)
+                start = perf_counter()
+                sent = self.sendPackets(packets, self.rtpAddress(), data)
+                Metrics.sendLatency.observe(perf_counter() - start)
+
+                fec = self.clientInfo.get('fec')
+                if fec:
+                    parity = fec.protect(packets)
+                    if parity:
+                        Metrics.fecPackets.inc(self.sendPackets(parity, self.rtpAddress()))
+            except:
+                Metrics.sendErrors.inc()
+                logger.warning("Connection Error", exc_info=True)
+                return
+            self.countSent(frameNumber, len(data) + len(packets) * len(packets[0][0]), sent)
+
+    def sendChannelPackets(self, channel, packets, frame=None, frameNumber=None, size=0):
+        """Send packets of a channel to the session, counting them as a frame if frameNumber is given.
+
+        Return the number sent, or None if the session left the channel
+        (and may be closed) since the channel listed its subscribers.
+        """
+        with self.sendLock:
+            if self not in channel.subscribers:
+                return None
+            sent = self.sendPackets(packets, self.rtpAddress(), frame)
+            if frameNumber is not None:
+                self.countSent(frameNumber, size, sent)
+            return sent
+
+    def handleReceiverReport(self, report, address=None):
+        """Adapt the send rate of the session to an RTCP receiver report about it."""
+        Metrics.receiverReports.inc()
+        self.sessionManager.touch(self)
+        self.clientInfo['lossRate'] = report.lossRate()
+        self.clientInfo['jitter'] = report.jitterSeconds()
+        rateControl = self.clientInfo['rateControl']
+        thinning = rateControl.update(report.lossRate(), report.jitterSeconds())
+        stream = self.clientInfo['videoStream']
+        if hasattr(stream, 'renditions') and rateControl.rendition != (stream.rendition if stream.pending is None else stream.pending):
+            logger.info("Session %s: loss %.3f, jitter %.3fs, switching to rendition %s", self.clientInfo['session'], report.lossRate(), report.jitterSeconds(), stream.renditions[rateControl.rendition]['name'])
+            stream.switch(rateControl.rendition)
+        if thinning == self.clientInfo.get('thinning', 1):
+            return
+        logger.info("Session %s: loss %.3f, jitter %.3fs, sending 1 frame in %d", self.clientInfo['session'], report.lossRate(), report.jitterSeconds(), thinning)
+        self.clientInfo['thinning'] = thinning
+        pacing = self.clientInfo.get('pacing')
+        if pacing:
+            self.scheduler.setFrameRate(pacing, self.clientInfo['videoStream'].frameRate / thinning)
+
+    def handleNack(self, seqs, address=None):
+        """Retransmit the packets a client reported lost, if still held."""
+        self.sessionManager.touch(self)
+        packets = self.clientInfo['retransmit'].lookup(seqs)
+        Metrics.nackedPackets.inc(len(seqs))
+        if packets:
+            Metrics.retransmits.inc(self.sendPackets(packets, self.rtpAddress()))
+
+    def rtpAddress(self):
+        """Return the (host, port) the client receives RTP on."""
+        return (self.clientInfo['rtspSocket'][1][0], int(self.clientInfo['rtpPort']))
+
+    def countSent(self, frameNumber, size, packets):
+        """Record a sent frame in the session and server statistics."""
+        logger.debug("Sent frame %d", frameNumber)
+        self.clientInfo['framesSent'] = self.clientInfo.get('framesSent', 0) + 1
+        self.clientInfo['packetsSent'] = self.clientInfo.get('packetsSent', 0) + packets
+        self.clientInfo['bytesSent'] = self.clientInfo.get('bytesSent', 0) + size
+        Metrics.framesSent.inc()
+        Metrics.packetsSent.inc(packets)
+        Metrics.bytesSent.inc(size)
+
+    def sendPackets(self, packets, address, frame=None):
+        """Send a batch of RTP packets to the client. Return the number sent."""
+        return sendPackets(self.clientInfo['rtpSocket'], packets, address, frame)
+
+    def makeRtpFragments(self, frame, timestamp=None):
+        """RTP-packetize a video frame into MTU-sized packets, marking the last one.
+
+        Each packet is a (header, payload) pair of buffers; payloads are
+        slices of the frame, not copies.
+        """
+        packets = []
+        for jpegHeader, chunk, last in fragmentFrame(frame, self.mtu):
+            seqnum = self.clientInfo['rtpSeq'] = (self.clientInfo.get('rtpSeq', 0) + 1) & 0xFFFF
+            header, payload = self.makeRtpPacket(chunk, seqnum, 1 if last else 0, timestamp).getBuffers()
+            packets.append((header + jpegHeader, payload))
+        return packets
+
+    def makeRtp(self, payload, frameNbr, marker=0, timestamp=None):
         """RTP-packetize the video data."""
+        return self.makeRtpPacket(payload, frameNbr, marker, timestamp).getPacket()
+
+    def makeRtpPacket(self, payload, frameNbr, marker=0, timestamp=None):
+        """Build the RTP packet of the video data."""
         version = 2
         padding = 0
         extension = 0
         cc = 0
-        marker = 0
         pt = 26  # MJPEG type
         seqnum = frameNbr
-        ssrc = 0
+        ssrc = self.clientInfo.get('ssrc', 0)
 
         rtpPacket = RtpPacket()
-        rtpPacket.encode(version, padding, extension, cc, seqnum, marker, pt, ssrc, payload)
-        return rtpPacket.getPacket()
+        rtpPacket.encode(version, padding, extension, cc, seqnum, marker, pt, ssrc, payload, timestamp=timestamp)
+        return rtpPacket
 
-    def replyRtsp(self, code, seq, data=None):
+    def replyRtsp(self, code, seq, data=None, headers=None):
         """Send RTSP reply to the client."""
         if code == self.OK_200:
-            # print("200 OK")
-            reply = 'RTSP/1.0 200 OK\nCSeq: ' + seq + '\nSession: ' + str(self.clientInfo['session'])
-            if data != None:  # Use for describe reply
-                reply += '\n\n' + data
-
-            connSocket = self.clientInfo['rtspSocket'][0]
-            connSocket.send(reply.encode())
+            replyHeaders = {'CSeq': seq}
+            if 'session' in self.clientInfo:
+                replyHeaders['Session'] = '{};timeout={}'.format(self.clientInfo['session'], self.sessionManager.timeout)
+            if headers:
+                replyHeaders.update(headers)
+            self.sendReply(formatMessage('RTSP/1.0 200 OK', replyHeaders, data))
+            return
 
         # Error messages
-        elif code == self.FILE_NOT_FOUND_404:
-            print("404 NOT FOUND")
-            reply = 'RTSP/1.0 404 NOT_FOUND\nCSeq: ' + seq
-            connSocket = self.clientInfo['rtspSocket'][0]
-            connSocket.send(reply.encode())
+        if code == self.FILE_NOT_FOUND_404:
+            logger.info("404 NOT FOUND")
+            status = '404 NOT_FOUND'
         elif code == self.CON_ERR_500:
-            print("500 CONNECTION ERROR")
+            logger.info("500 CONNECTION ERROR")
+            return
+        elif code == self.INVALID_RANGE_457:
+            logger.info("457 INVALID RANGE")
+            status = '457 Invalid Range'
+        elif code == self.INVALID_PARAMETER_451:
+            logger.info("451 PARAMETER NOT UNDERSTOOD")
+            status = '451 Parameter Not Understood'
+        elif code == self.NOT_ENOUGH_BANDWIDTH_453:
+            logger.info("453 NOT ENOUGH BANDWIDTH")
+            status = '453 Not Enough Bandwidth'
+        elif code == self.FORBIDDEN_403:
+            logger.info("403 FORBIDDEN")
+            status = '403 Forbidden'
+        elif code == self.BAD_REQUEST_400:
+            logger.info("400 BAD REQUEST")
+            status = '400 Bad Request'
+        elif code == self.UNSUPPORTED_TRANSPORT_461:
+            logger.info("461 UNSUPPORTED TRANSPORT")
+            status = '461 Unsupported Transport'
+        elif code == self.NOT_IMPLEMENTED_501:
+            logger.info("501 NOT IMPLEMENTED")
+            status = '501 Not Implemented'
+        elif code == self.SESSION_NOT_FOUND_454:
+            logger.info("454 SESSION NOT FOUND")
+            status = '454 Session Not Found'
+        elif code == self.METHOD_NOT_VALID_455:
+            logger.info("455 METHOD NOT VALID IN THIS STATE")
+            status = '455 Method Not Valid in This State'
+        self.sendReply(formatMessage('RTSP/1.0 ' + status, {'CSeq': seq}))
+
+    def sendReply(self, reply):
+        """Write an encoded RTSP reply to the control connection."""
+        connSocket = self.clientInfo['rtspSocket'][0]
+        connSocket.sendall(reply)
@@ -0,0 +1,123 @@
+import threading, logging
+from time import monotonic, sleep
+
+import Metrics
+
+logger = logging.getLogger(__name__)
+
+SESSION_TIMEOUT = 60  # seconds without a request or RTCP packet before a session expires
+REAP_INTERVAL = 1.0  # seconds between expiry checks
+
+
+class SessionManager:
+    """Track every RTSP connection, expire the idle ones and admit new sessions within limits.
+
+    A connection is tracked from accept until it closes; any RTSP request or
+    RTCP packet about its session counts as activity. A connection idle for
+    longer than the timeout is expired: its control connection is closed,
+    which makes the worker release the session. When receiver reports may
+    land in another process (workers sharing the RTCP port), a session
+    that is still being streamed to is not expired, as its reports are no
+    sign of life here. A SETUP is admitted only if the session count and
+    the summed media bitrate stay within the limits (0 means no limit);
+    sessions hold their share until torn down.
+    """
+
+    def __init__(self, timeout=SESSION_TIMEOUT, maxSessions=0, maxBandwidth=0, reportsReachUs=True):
+        self.timeout = timeout
+        self.maxSessions = maxSessions
+        self.maxBandwidth = maxBandwidth  # bits per second
+        self.reportsReachUs = reportsReachUs  # False when RTCP is spread over worker processes
+        self.lock = threading.Lock()
+        self.connections = {}  # worker -> monotonic time of its last activity
+        self.admitted = {}  # worker -> reserved bits per second
+        self.bandwidth = 0
+
+        # Statistic variables
+        self.rejected = 0
+        self.expired = 0
+
+    def configure(self, timeout=SESSION_TIMEOUT, maxSessions=0, maxBandwidth=0, reportsReachUs=True):
+        """Change the timeout and limits; sessions already admitted are kept."""
+        with self.lock:
+            self.timeout = timeout
+            self.maxSessions = maxSessions
+            self.maxBandwidth = maxBandwidth
+            self.reportsReachUs = reportsReachUs
+
+    def track(self, worker):
+        """Start tracking a new control connection."""
+        with self.lock:
+            self.connections[worker] = monotonic()
+
+    def touch(self, worker):
+        """Record activity of a connection."""
+        with self.lock:  # Or a connection untracked meanwhile would come back, and expire as a ghost
+            if worker in self.connections:
+                self.connections[worker] = monotonic()
+
+    def untrack(self, worker):
+        """Forget a closed connection, and release its session if any."""
+        with self.lock:
+            self.connections.pop(worker, None)
+        self.release(worker)
+
+    def admit(self, worker, bitrate):
+        """Reserve a session of the given bitrate. Return False if it would exceed a limit."""
+        with self.lock:
+            if worker in self.admitted:
+                return True
+            if (self.maxSessions and len(self.admitted) >= self.maxSessions) or \
+                    (self.maxBandwidth and self.bandwidth + bitrate > self.maxBandwidth):
+                self.rejected += 1
+                Metrics.sessionsRejected.inc()
+                return False
+            self.admitted[worker] = bitrate
+            self.bandwidth += bitrate
+            return True
+
+    def release(self, worker):
+        """Give back the reservation of a torn down session."""
+        with self.lock:
+            bitrate = self.admitted.pop(worker, None)
+            if bitrate is not None:
+                self.bandwidth -= bitrate
+
+    def reap(self, now=None):
+        """Expire every connection idle for longer than the timeout. Return how many."""
+        now = monotonic() if now is None else now
+        with self.lock:
+            idle = []
+            for worker, last in self.connections.items():
+                if now - last <= self.timeout:
+                    continue
+                if not self.reportsReachUs and worker.isStreaming():
+                    self.connections[worker] = now
+                    continue
+                idle.append(worker)
+            for worker in idle:
+                del self.connections[worker]
+        for worker in idle:
+            self.expired += 1
+            Metrics.sessionsExpired.inc()
+            logger.info("Session %s idle for over %ss, expiring it", worker.clientInfo.get('session', '-'), self.timeout)
+            try:
+                worker.expire()
+            except Exception:
+                logger.exception("Expiring a session failed")
+        return len(idle)
+
+    def start(self):
+        """Expire idle connections from a thread of its own."""
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while True:
+            sleep(REAP_INTERVAL)
+            self.reap()
+
+
+sessionManager = SessionManager()
+
+Metrics.registry.gaugeFunction('rtsp_connections', "Open RTSP control connections", lambda: len(sessionManager.connections))
+Metrics.registry.gaugeFunction('rtsp_reserved_bandwidth_bits', "Media bitrate reserved by admitted sessions", lambda: sessionManager.bandwidth)
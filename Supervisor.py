@@ -0,0 +1,113 @@
+import os, sys, signal, threading, logging, multiprocessing
+from multiprocessing.connection import wait
+from time import monotonic, sleep
+
+import Metrics
+
+logger = logging.getLogger(__name__)
+
+STATS_INTERVAL = 1.0  # seconds between metric snapshots sent by each worker
+RESTART_DELAY = 1.0  # seconds; a worker that keeps dying is restarted at most this often
+
+
+class Supervisor:
+    """Run the server in several processes sharing the RTSP port with SO_REUSEPORT.
+
+    The kernel spreads incoming RTSP connections over the workers, and a
+    session lives entirely in the process that accepted its connection.
+    Workers that die are restarted. Each worker sends a snapshot of its
+    metrics over a pipe every STATS_INTERVAL; the supervisor serves their
+    sum on its own metrics endpoint. SIGUSR1 is passed on to every worker.
+    """
+
+    def __init__(self, workers, serve):
+        self.workers = workers
+        self.serve = serve  # Called in each worker process to run the server
+        self.context = multiprocessing.get_context('fork')
+        self.processes = {}  # slot -> Process
+        self.pipes = {}  # slot -> receiving end of the stats pipe
+        self.started = {}  # slot -> start time, for restart throttling
+        self.stats = {}  # slot -> last collect() of the worker
+        self.restarts = 0
+
+    def start(self, slot):
+        """Start (or restart) the worker process of a slot."""
+        receiver, sender = self.context.Pipe(duplex=False)
+        process = self.context.Process(target=self.runWorker, args=(slot, sender), name='worker-{}'.format(slot), daemon=True)
+        process.start()
+        sender.close()
+        self.processes[slot] = process
+        self.pipes[slot] = receiver
+        self.started[slot] = monotonic()
+
+    def runWorker(self, slot, sender):
+        """Entry point of a worker process."""
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        if hasattr(signal, 'SIGUSR1'):  # Until the server installs its own handler
+            signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+        threading.Thread(target=self.reportStats, args=(sender,), daemon=True).start()
+        self.serve()
+
+    def reportStats(self, sender):
+        """Send the metrics of this worker to the supervisor until it goes away."""
+        while True:
+            try:
+                sender.send(Metrics.registry.collect())
+            except OSError:  # Supervisor is gone, do not outlive it
+                os._exit(1)
+            sleep(STATS_INTERVAL)
+
+    def collect(self):
+        """Return the metrics of every worker, summed."""
+        collection = Metrics.mergeCollections(list(self.stats.values()))
+        collection.append(('server_workers', 'gauge', "Worker processes running", [('server_workers', (), len(self.processes))]))
+        collection.append(('server_worker_restarts_total', 'counter', "Worker processes restarted after dying", [('server_worker_restarts_total', (), self.restarts)]))
+        return collection
+
+    def render(self):
+        """Return the summed metrics in Prometheus text exposition format."""
+        return Metrics.renderCollection(self.collect())
+
+    def run(self):
+        """Start the workers, then restart them as they die, forever."""
+        # Turn SIGTERM into SystemExit so the daemonic workers are terminated too
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, self.forwardSignal)
+        for slot in range(self.workers):
+            self.start(slot)
+
+        while True:
+            sentinels = {process.sentinel: slot for slot, process in self.processes.items()}
+            pipes = {pipe: slot for slot, pipe in self.pipes.items()}
+            for ready in wait(list(sentinels) + list(pipes)):
+                if ready in pipes:
+                    if self.pipes.get(pipes[ready]) is not ready:  # Worker already reaped
+                        continue
+                    try:
+                        self.stats[pipes[ready]] = ready.recv()
+                    except EOFError:  # Worker is exiting, its sentinel follows
+                        pass
+                elif ready in sentinels:
+                    self.reap(sentinels[ready])
+
+    def forwardSignal(self, signum, frame):
+        """Pass a signal on to every worker, e.g. SIGUSR1 to toggle profiling."""
+        for process in list(self.processes.values()):
+            try:
+                os.kill(process.pid, signum)
+            except OSError:
+                pass
+
+    def reap(self, slot):
+        """Restart the worker of a slot that died."""
+        process = self.processes[slot]
+        process.join()
+        self.pipes.pop(slot).close()
+        self.stats.pop(slot, None)
+        logger.warning("Worker %d (pid %d) exited with code %s, restarting", slot, process.pid, process.exitcode)
+        delay = self.started[slot] + RESTART_DELAY - monotonic()
+        if delay > 0:
+            sleep(delay)
+        self.restarts += 1
+        self.start(slot)
@@ -0,0 +1,272 @@
+import os, socket, ctypes, errno, struct, logging
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+# UDP send path. A packet is a (header, payload) pair of buffers that the
+# kernel gathers itself, so they are never concatenated in Python. Each
+# packet is one sendmsg() (or sendto() where that is missing). On Linux,
+# the fragments of a frame can instead go out in one sendmmsg() call
+# through ctypes, but that only pays off where the syscall saved outweighs
+# the ctypes setup, so it is off unless configured or measured faster.
+
+HAVE_SENDMSG = hasattr(socket.socket, 'sendmsg')
+MAX_BATCH = 1024  # UIO_MAXIOV, the kernel limit of messages per sendmmsg
+BATCH_MODES = ('sendmsg', 'sendmmsg', 'auto')
+BATCH_MARGIN = 1.1  # How much faster sendmmsg must measure for 'auto' to pick it
+MEASURE_FRAME_SIZE = 50000  # bytes of the frame 'auto' times both paths with
+MEASURE_PAYLOAD_SIZE = 1400
+MEASURE_SECONDS = 0.05  # per path and round
+MEASURE_ROUNDS = 3
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(iovec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int),
+    ]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', msghdr), ('msg_len', ctypes.c_uint)]
+
+
+class sockaddr_in(ctypes.Structure):
+    _fields_ = [
+        ('sin_family', ctypes.c_ushort),
+        ('sin_port', ctypes.c_ubyte * 2),  # Network byte order
+        ('sin_addr', ctypes.c_ubyte * 4),
+        ('sin_zero', ctypes.c_ubyte * 8),
+    ]
+
+
+class Py_buffer(ctypes.Structure):
+    _fields_ = [
+        ('buf', ctypes.c_void_p),
+        ('obj', ctypes.c_void_p),
+        ('len', ctypes.c_ssize_t),
+        ('itemsize', ctypes.c_ssize_t),
+        ('readonly', ctypes.c_int),
+        ('ndim', ctypes.c_int),
+        ('format', ctypes.c_char_p),
+        ('shape', ctypes.c_void_p),
+        ('strides', ctypes.c_void_p),
+        ('suboffsets', ctypes.c_void_p),
+        ('internal', ctypes.c_void_p),
+    ]
+
+
+def loadSendmmsg():
+    """Return libc's sendmmsg() as a ctypes function, or None if unavailable."""
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError, TypeError):
+        return None
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+
+_sendmmsg = loadSendmmsg()
+_getBuffer = ctypes.pythonapi.PyObject_GetBuffer
+_getBuffer.argtypes = [ctypes.py_object, ctypes.POINTER(Py_buffer), ctypes.c_int]
+_getBuffer.restype = ctypes.c_int
+_releaseBuffer = ctypes.pythonapi.PyBuffer_Release
+_releaseBuffer.argtypes = [ctypes.POINTER(Py_buffer)]
+_releaseBuffer.restype = None
+
+HAVE_SENDMMSG = _sendmmsg is not None
+
+# Packed layouts of two iovecs and of one mmsghdr, filled with pack_into
+# rather than field by field (ctypes attribute access is slow).
+IOVEC_PAIR = struct.Struct('@PNPN')
+MMSGHDR = struct.Struct('@PI{}xPNPNi{}xI{}x'.format(
+    msghdr.msg_iov.offset - msghdr.msg_namelen.offset - 4,
+    ctypes.sizeof(msghdr) - msghdr.msg_flags.offset - 4,
+    ctypes.sizeof(mmsghdr) - mmsghdr.msg_len.offset - 4))
+
+
+def makeSockaddr(address):
+    """Build a sockaddr_in for an (IPv4 host, port) address."""
+    addr = sockaddr_in()
+    addr.sin_family = socket.AF_INET
+    addr.sin_port[:] = address[1].to_bytes(2, 'big')
+    try:
+        addr.sin_addr[:] = socket.inet_aton(address[0])
+    except OSError:  # Not a dotted quad, resolve it
+        addr.sin_addr[:] = socket.inet_aton(socket.gethostbyname(address[0]))
+    return addr
+
+
+def bufferAddress(obj):
+    """Return the address of the memory of a contiguous buffer object.
+
+    Only valid while something else keeps the buffer exported or alive.
+    """
+    view = Py_buffer()
+    _getBuffer(obj, view, 0)  # BufferError if not contiguous
+    try:
+        return view.buf
+    finally:
+        _releaseBuffer(view)
+
+
+def isSlicedFrom(packets, frameStart, frameLen):
+    """Return True if the payloads are consecutive slices of the frame at frameStart, from its start."""
+    expected = frameStart
+    for header, payload in packets:
+        try:
+            if bufferAddress(payload) != expected:
+                return False
+        except BufferError:
+            return False
+        expected += len(payload)
+    return expected - frameStart <= frameLen
+
+
+def sendmmsg(sock, packets, address, frame):
+    """Send packets whose payloads are consecutive slices of frame with one sendmmsg() call.
+
+    Return the number of packets sent, or None if the payloads are not
+    such slices and nothing was sent.
+    """
+    count = len(packets)
+    view = Py_buffer()
+    _getBuffer(frame, view, 0)
+    try:
+        # The iovecs below point into the frame by offset: check that is where the payloads are
+        if not isSlicedFrom(packets, view.buf, view.len):
+            return None
+
+        headers = bytearray().join([packet[0] for packet in packets])
+        iovecs = ctypes.create_string_buffer(IOVEC_PAIR.size * count)
+        msgs = ctypes.create_string_buffer(MMSGHDR.size * count)
+        addr = makeSockaddr(address)
+        addrPtr = ctypes.addressof(addr)
+        addrLen = ctypes.sizeof(addr)
+        iovecsPtr = ctypes.addressof(iovecs)
+
+        headerPtr = ctypes.addressof((ctypes.c_char * len(headers)).from_buffer(headers))
+        payloadPtr = view.buf
+        for i, (header, payload) in enumerate(packets):
+            headerLen = len(header)
+            payloadLen = len(payload)
+            IOVEC_PAIR.pack_into(iovecs, i * IOVEC_PAIR.size, headerPtr, headerLen, payloadPtr, payloadLen)
+            MMSGHDR.pack_into(msgs, i * MMSGHDR.size, addrPtr, addrLen, iovecsPtr + i * IOVEC_PAIR.size, 2, 0, 0, 0, 0)
+            headerPtr += headerLen
+            payloadPtr += payloadLen
+
+        sent = 0
+        fd = sock.fileno()
+        msgsPtr = ctypes.addressof(msgs)
+        while sent < count:
+            batch = min(count - sent, MAX_BATCH)
+            result = _sendmmsg(fd, ctypes.cast(msgsPtr + sent * MMSGHDR.size, ctypes.POINTER(mmsghdr)), batch, 0)
+            if result < 0:
+                err = ctypes.get_errno()
+                if err in (errno.EAGAIN, errno.EWOULDBLOCK):  # Send buffer full, drop the rest
+                    break
+                if err == errno.EINTR:
+                    continue
+                raise OSError(err, "sendmmsg: " + errno.errorcode.get(err, str(err)))
+            sent += result
+        return sent
+    finally:
+        _releaseBuffer(view)
+
+
+def sendEach(sock, packets, address):
+    """Send packets one system call each. Return the number sent."""
+    sent = 0
+    try:
+        for packet in packets:
+            if HAVE_SENDMSG:
+                sock.sendmsg(packet, (), 0, address)
+            else:
+                sock.sendto(b''.join(packet), address)
+            sent += 1
+    except BlockingIOError:  # Send buffer full, drop the rest
+        pass
+    return sent
+
+
+class Batching:
+    """Whether sendPackets() sends the fragments of a frame in one sendmmsg() call.
+
+    Off by default: on loopback, sendmmsg through ctypes measured slower
+    than a sendmsg per packet, the kernel UDP path dominating either way.
+    """
+
+    def __init__(self):
+        self.enabled = False
+
+    def configure(self, mode='sendmsg'):
+        """Pick the send path: 'sendmsg', 'sendmmsg', or 'auto' to use sendmmsg only if it measures faster here."""
+        if mode not in BATCH_MODES:
+            raise ValueError(mode)
+        if mode == 'auto' and HAVE_SENDMMSG:
+            speedup = measureSpeedup()
+            self.enabled = speedup >= BATCH_MARGIN
+            logger.info("sendmmsg is %.2fx as fast as sendmsg here, sending with %s", speedup, 'sendmmsg' if self.enabled else 'sendmsg')
+        else:
+            self.enabled = mode == 'sendmmsg' and HAVE_SENDMMSG
+        return self.enabled
+
+
+def measureSpeedup():
+    """Time both send paths on loopback with a synthetic frame. Return sendmsg time over sendmmsg time."""
+    frame = os.urandom(MEASURE_FRAME_SIZE)
+    view = memoryview(frame)
+    packets = [(bytes(20), view[offset:offset + MEASURE_PAYLOAD_SIZE]) for offset in range(0, len(frame), MEASURE_PAYLOAD_SIZE)]
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        receiver.bind(('127.0.0.1', 0))  # Never read: the kernel drops what does not fit
+        address = receiver.getsockname()
+        sender.setblocking(False)
+        best = {}
+        for _ in range(MEASURE_ROUNDS):
+            for name, send in (('sendmsg', lambda: sendEach(sender, packets, address)),
+                               ('sendmmsg', lambda: sendmmsg(sender, packets, address, frame))):
+                calls = 0
+                start = perf_counter()
+                end = start + MEASURE_SECONDS
+                while perf_counter() < end:
+                    send()
+                    calls += 1
+                perCall = (perf_counter() - start) / calls
+                best[name] = min(best.get(name, perCall), perCall)
+        return best['sendmsg'] / best['sendmmsg']
+    except OSError:
+        logger.warning("Could not measure sendmmsg, leaving it off", exc_info=True)
+        return 0.0
+    finally:
+        sender.close()
+        receiver.close()
+
+
+batching = Batching()
+
+
+def sendPackets(sock, packets, address, frame=None):
+    """Send a batch of packets, each a (header, payload) pair of buffers, to one address.
+
+    With batching enabled, and every payload a consecutive slice of frame
+    (as made by RtpJpeg.fragmentFrame), the batch goes out with a single
+    sendmmsg(). Return the number of packets sent.
+    """
+    if batching.enabled and frame is not None and len(packets) > 1 and sock.family == socket.AF_INET:
+        sent = sendmmsg(sock, packets, address, frame)
+        if sent is not None:
+            return sent
+    return sendEach(sock, packets, address)
@@ -1,3 +1,65 @@
+import os, sys, mmap, struct
+from array import array
+
+FRAME_HEADER_SIZE = 5  # ASCII length prefix in front of every frame
+DEFAULT_FRAME_RATE = 20
+
+INDEX_EXT = '.idx'
+INDEX_MAGIC = b'MJIX'
+INDEX_HEADER = struct.Struct('<4sQI')  # magic, media file size, frame count
+
+
+def scanIndex(data):
+    """Scan a length-prefixed MJPEG buffer. Return (offsets, lengths) of every frame payload."""
+    offsets = array('Q')
+    lengths = array('I')
+    size = len(data)
+    pos = 0
+    while pos + FRAME_HEADER_SIZE <= size:
+        try:
+            framelength = int(bytes(data[pos:pos + FRAME_HEADER_SIZE]))
+        except ValueError:
+            break
+        start = pos + FRAME_HEADER_SIZE
+        if framelength < 0 or start + framelength > size:  # Truncated last frame
+            break
+        offsets.append(start)
+        lengths.append(framelength)
+        pos = start + framelength
+    return offsets, lengths
+
+
+def loadIndex(filename, filesize):
+    """Load the frame-offset index stored next to a media file. Return None if missing or stale."""
+    try:
+        with open(filename + INDEX_EXT, 'rb') as f:
+            magic, size, count = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+            if magic != INDEX_MAGIC or size != filesize:
+                return None
+            offsets = array('Q')
+            lengths = array('I')
+            offsets.fromfile(f, count)
+            lengths.fromfile(f, count)
+    except (OSError, EOFError, struct.error):
+        return None
+    if sys.byteorder != 'little':
+        offsets.byteswap()
+        lengths.byteswap()
+    return offsets, lengths
+
+
+def saveIndex(filename, filesize, offsets, lengths):
+    """Write the frame-offset index next to a media file."""
+    if sys.byteorder != 'little':
+        offsets, lengths = array('Q', offsets), array('I', lengths)
+        offsets.byteswap()
+        lengths.byteswap()
+    with open(filename + INDEX_EXT, 'wb') as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, filesize, len(offsets)))
+        offsets.tofile(f)
+        lengths.tofile(f)
+
+
 class VideoStream:
     def __init__(self, filename):
         """Attach to media file"""
@@ -6,19 +68,87 @@ class VideoStream:
             self.file = open(filename, 'rb')
         except:
             raise IOError
+        self.filesize = os.fstat(self.file.fileno()).st_size
+        if self.filesize:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.data = b''
+        self.view = memoryview(self.data)
+
+        # Frame-offset table, built once per open
+        index = loadIndex(filename, self.filesize)
+        if index is None:
+            index = scanIndex(self.view)
+        self.offsets, self.lengths = index
+        self.payloadBytes = sum(self.lengths)  # Once here, as bitrate() is asked on every SETUP
+
+        self.frameRate = DEFAULT_FRAME_RATE
         self.frameNum = 0
 
     def nextFrame(self):
         """Get next frame."""
-        try:
-            framelength = int(self.file.read(5))  # Get the framelength from the first 5 bits
-            data = self.file.read(framelength)  # Read next frame
-            self.frameNum += 1
-            return data
-        except:
-            self.file.close()
+        if self.frameNum >= len(self.offsets):
             return None
+        self.frameNum += 1
+        return self.getFrame(self.frameNum)
+
+    def getFrame(self, frameNbr):
+        """Get frame by its (1-based) number as a zero-copy slice of the media file."""
+        start = self.offsets[frameNbr - 1]
+        return self.view[start:start + self.lengths[frameNbr - 1]]
+
+    def seek(self, frameNbr):
+        """Position the stream so the next frame returned is frameNbr + 1."""
+        if frameNbr < 0 or frameNbr > len(self.offsets):
+            raise IndexError(frameNbr)
+        self.frameNum = frameNbr
+
+    def seekTime(self, seconds):
+        """Position the stream at a time offset (in seconds) from the start."""
+        self.seek(int(seconds * self.frameRate))
 
     def frameNbr(self):
         """Get frame number."""
         return self.frameNum
+
+    def frameCount(self):
+        """Get total number of frames."""
+        return len(self.offsets)
+
+    def duration(self):
+        """Get media duration in seconds."""
+        return len(self.offsets) / self.frameRate
+
+    def bitrate(self):
+        """Get the mean media bitrate in bits per second."""
+        duration = self.duration()
+        return self.payloadBytes * 8 / duration if duration else 0
+
+    def willNeed(self, frameNbr, count):
+        """Ask the kernel to read count frames from frameNbr on ahead, as one sequential read."""
+        if count <= 0 or not isinstance(self.data, mmap.mmap) or not hasattr(mmap, 'MADV_WILLNEED'):
+            return
+        last = min(frameNbr + count - 1, len(self.offsets))
+        start = self.offsets[frameNbr - 1]
+        start -= start % mmap.PAGESIZE
+        end = self.offsets[last - 1] + self.lengths[last - 1]
+        self.data.madvise(mmap.MADV_WILLNEED, start, end - start)
+
+    def close(self):
+        """Release the memory map and the file handle."""
+        self.view.release()
+        if isinstance(self.data, mmap.mmap):
+            try:
+                self.data.close()
+            except BufferError:  # Frames still referenced, the map goes with them
+                pass
+        self.file.close()
+
+
+if __name__ == "__main__":
+    # Build the frame-offset index for the given media files
+    for name in sys.argv[1:]:
+        stream = VideoStream(name)
+        saveIndex(name, stream.filesize, stream.offsets, stream.lengths)
+        print("{}: {} frames".format(name, stream.frameCount()))
+        stream.close()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Microbenchmark of RtpPacket encode/decode, in packets per second.
+
+Usage: bench_rtp.py [other/RtpPacket.py]
+
+Given the path of another RtpPacket implementation (for instance one
+extracted with `git show <rev>:RtpPacket.py`), both are measured side
+by side.
+"""
+
+import os, sys, timeit, importlib.util
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+PAYLOAD_SIZES = (1432, 65000)  # One MTU-sized JPEG fragment, one unfragmented frame
+NUMBER = 100000
+REPEAT = 7
+
+
+def loadRtpPacket(path):
+    """Import the RtpPacket class of the given file."""
+    spec = importlib.util.spec_from_file_location('RtpPacket_' + str(abs(hash(path))), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.RtpPacket
+
+
+def bench(name, stmt):
+    best = min(timeit.repeat(stmt, number=NUMBER, repeat=REPEAT))
+    print("{:<40} {:>12,.0f} packets/s".format(name, NUMBER / best))
+
+
+def run(label, RtpPacket):
+    def encode(payload):
+        rtpPacket = RtpPacket()
+        rtpPacket.encode(2, 0, 0, 0, 1234, 1, 26, 0, payload)
+        return rtpPacket
+
+    def decode(packet):
+        rtpPacket = RtpPacket()
+        rtpPacket.decode(packet)
+        return rtpPacket.seqNum(), rtpPacket.getPayload()
+
+    for size in PAYLOAD_SIZES:
+        payload = os.urandom(size)
+        packet = bytes(encode(payload).getPacket())
+        bench("{} encode + getPacket ({} B)".format(label, size), lambda: encode(payload).getPacket())
+        if hasattr(RtpPacket, 'getBuffers'):
+            bench("{} encode + getBuffers ({} B)".format(label, size), lambda: encode(payload).getBuffers())
+        bench("{} decode ({} B)".format(label, size), lambda: decode(packet))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        run("other", loadRtpPacket(sys.argv[1]))
+    run("this", loadRtpPacket(os.path.join(ROOT, 'RtpPacket.py')))
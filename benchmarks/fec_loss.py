@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""FEC loss harness: how much packet loss XOR parity recovers, over loopback.
+
+Starts a server, plays the same file once per loss model and group size K
+(K=0 is the unprotected baseline) to a headless viewer with NACKs off, and
+drops received datagrams before the viewer sees them: either independently
+("random", Bernoulli) or in bursts ("bursty", a two-state Gilbert-Elliott
+model with the same mean loss). Reports the media loss before FEC, the
+packets FEC rebuilt, the residual loss after FEC, the frames lost and the
+parity overhead.
+"""
+
+import os, sys, random, argparse, tempfile, subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from HeadlessClient import HeadlessClient
+from Fec import FEC_PT
+from fixtures import tempMedia
+from loadgen import freePort, waitForPort
+
+PAYLOAD_TYPE_OFFSET = 1
+
+
+class BernoulliLoss:
+    """Drop every packet independently with the given probability."""
+
+    def __init__(self, rate, rng):
+        self.rate = rate
+        self.rng = rng
+
+    def drop(self):
+        return self.rng.random() < self.rate
+
+
+class GilbertElliottLoss:
+    """Two-state loss: every packet is lost in the bad state, none in the good one.
+
+    The transition probabilities give the requested mean loss rate and a
+    mean burst length of `burst` packets.
+    """
+
+    def __init__(self, rate, burst, rng):
+        self.leaveBad = 1.0 / burst
+        self.enterBad = rate * self.leaveBad / (1 - rate)
+        self.bad = False
+        self.rng = rng
+
+    def drop(self):
+        if self.bad:
+            self.bad = self.rng.random() >= self.leaveBad
+        else:
+            self.bad = self.rng.random() < self.enterBad
+        return self.bad
+
+
+class LossyViewer(HeadlessClient):
+    """A headless viewer that loses received datagrams according to a loss model."""
+
+    def __init__(self, host, port, media, fec, loss):
+        HeadlessClient.__init__(self, host, port, media, nack=False, fec=fec)
+        self.loss = loss
+        self.mediaSent = 0
+        self.mediaDropped = 0
+        self.paritySent = 0
+
+    def handleRtp(self, data, arrival):
+        parity = data[PAYLOAD_TYPE_OFFSET] & 0x7F == FEC_PT
+        if parity:
+            self.paritySent += 1
+        else:
+            self.mediaSent += 1
+        if self.loss.drop():
+            if not parity:
+                self.mediaDropped += 1
+            return
+        HeadlessClient.handleRtp(self, data, arrival)
+
+
+def run(host, port, media, model, rate, burst, k, duration, seed):
+    """Play the media through one loss model with group size k. Return the results."""
+    rng = random.Random(seed)
+    loss = GilbertElliottLoss(rate, burst, rng) if model == 'bursty' else BernoulliLoss(rate, rng)
+    viewer = LossyViewer(host, port, media, k, loss)
+    try:
+        viewer.setup()
+        viewer.play()
+        viewer.receive(duration)
+        viewer.teardown()
+    finally:
+        viewer.close()
+
+    recovered = viewer.fec.recovered if viewer.fec else 0
+    residual = viewer.lostPackets()
+    return {
+        'model': model,
+        'k': k,
+        'media_loss_pct': viewer.mediaDropped / viewer.mediaSent * 100 if viewer.mediaSent else 0.0,
+        'recovered': recovered,
+        'recovered_pct': recovered / viewer.mediaDropped * 100 if viewer.mediaDropped else 0.0,
+        'residual_loss_pct': residual / viewer.mediaSent * 100 if viewer.mediaSent else 0.0,
+        'frames': viewer.statFrames,
+        'frames_lost': viewer.reassembler.discarded,
+        'overhead_pct': viewer.paritySent / viewer.mediaSent * 100 if viewer.mediaSent else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback FEC recovery under simulated loss")
+    parser.add_argument('--loss', type=float, default=0.05, help="mean packet loss rate")
+    parser.add_argument('--burst', type=float, default=3, help="mean burst length of the bursty model, in packets")
+    parser.add_argument('--k', type=int, action='append', help="FEC group size to try (repeatable, 0 = no FEC)")
+    parser.add_argument('--model', action='append', choices=('random', 'bursty'), help="loss model (repeatable)")
+    parser.add_argument('--duration', type=float, default=5, help="seconds of playback per run")
+    parser.add_argument('--frames', type=int, default=200, help="frames of the synthetic file")
+    parser.add_argument('--frame-size', type=int, default=20000, help="bytes per frame of the synthetic file")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='fec-loss-')
+    media = tempMedia(workdir, args.frames, args.frame_size)
+    host, port = '127.0.0.1', freePort()
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'Server.py'), str(port)],
+                              cwd=workdir, stdout=subprocess.DEVNULL)
+    columns = ('model', 'k', 'media_loss_pct', 'recovered', 'recovered_pct', 'residual_loss_pct', 'frames', 'frames_lost', 'overhead_pct')
+    try:
+        waitForPort(port)
+        print(" ".join("{:>17}".format(c) for c in columns))
+        for model in args.model or ['random', 'bursty']:
+            for k in args.k or [0, 4, 8, 16]:
+                results = run(host, port, media, model, args.loss, args.burst, k, args.duration, args.seed)
+                print(" ".join("{:>17}".format(round(results[c], 2) if isinstance(results[c], float) else results[c]) for c in columns))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
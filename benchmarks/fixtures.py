@@ -0,0 +1,58 @@
+"""Synthetic media fixtures for benchmarks."""
+
+import os, struct
+
+FRAME_HEADER_SIZE = 5  # Same length prefix as VideoStream
+
+
+def syntheticJpeg(size, width=384, height=288, seed=0):
+    """Return a JPEG-shaped frame of exactly size bytes.
+
+    It has a real SOI/SOF0/EOI structure, so the packetizer can read its
+    geometry, but the scan data is filler and does not decode.
+    """
+    sof = b'\xff\xc0' + struct.pack('!HBHHB', 11, 8, height, width, 1) + b'\x01\x11\x00'
+    head = b'\xff\xd8' + sof + b'\xff\xda\x00\x08\x01\x01\x00\x00\x3f\x00'
+    filler = size - len(head) - 2
+    if filler < 0:
+        raise ValueError("frame size too small: {}".format(size))
+    pattern = bytes((seed + i) % 251 for i in range(251))
+    body = (pattern * (filler // len(pattern) + 1))[:filler]
+    return head + body + b'\xff\xd9'
+
+
+def makeSyntheticMjpeg(path, frames=200, frameSize=20000, width=384, height=288):
+    """Write a length-prefixed MJPEG file of synthetic frames. Return its path."""
+    if frameSize >= 10 ** FRAME_HEADER_SIZE:
+        raise ValueError("frame size does not fit the {}-digit length prefix".format(FRAME_HEADER_SIZE))
+    with open(path, 'wb') as f:
+        for i in range(frames):
+            frame = syntheticJpeg(frameSize, width, height, seed=i)
+            f.write(b'%05d' % len(frame))
+            f.write(frame)
+    return path
+
+
+def makeDecodableMjpeg(path, frames=200, width=384, height=288, quality=80):
+    """Write a length-prefixed MJPEG file of real JPEG frames (needs Pillow). Return its path."""
+    import io
+    from PIL import Image, ImageDraw
+
+    with open(path, 'wb') as f:
+        for i in range(frames):
+            image = Image.new('RGB', (width, height), (i % 256, 64, 128))
+            ImageDraw.Draw(image).rectangle([i % width, 0, i % width + 40, height // 2], fill=(255, 255, 255))
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=quality)
+            frame = buffer.getvalue()
+            f.write(b'%05d' % len(frame))
+            f.write(frame)
+    return path
+
+
+def tempMedia(directory, frames=200, frameSize=20000):
+    """Create (or reuse) a synthetic media file in directory. Return its path."""
+    path = os.path.join(directory, 'synthetic-{}x{}.Mjpeg'.format(frames, frameSize))
+    if not os.path.exists(path):
+        makeSyntheticMjpeg(path, frames, frameSize)
+    return path
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""Load generator: N headless viewers against a local Server.py, over loopback.
+
+Starts a server (unless --connect is given), plays the same file to every
+viewer for --duration seconds and reports aggregate throughput, per-session
+frame-rate error, frame latency, packet loss and server CPU. Results can be
+written as JSON (--output) and compared with an earlier run (--compare).
+For soak tests, --stats-export appends every viewer's RFC 3550 receiver
+statistics to a CSV or JSON-lines file while the run goes on.
+
+Frame latency is measured per session against that session's fastest frame
+(arrival time minus RTP media time, minus the minimum of that), i.e. the
+queueing and pacing delay a frame saw on top of the best case.
+"""
+
+import os, sys, json, time, shutil, socket, argparse, selectors, subprocess, tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from HeadlessClient import HeadlessClient, RtspError, RECV_BUFFER_SIZE
+from Rtcp import RTCP_INTERVAL
+from ReceiverStats import StatsExporter, EXPORT_INTERVAL
+from fixtures import tempMedia
+
+SERVER_START_TIMEOUT = 10  # seconds
+
+
+def freePort():
+    """Return a TCP port that is free on loopback right now."""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def waitForPort(port, timeout=SERVER_START_TIMEOUT):
+    """Wait until something accepts connections on the port."""
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("server did not start listening on port {}".format(port))
+
+
+def procStat(pid):
+    """Return the fields of /proc/PID/stat after the command name, or None if unknown."""
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            return f.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+
+
+def cpuSeconds(pid):
+    """Return user + system CPU seconds used by a process and all its descendants, or None if unknown.
+
+    Covers the worker processes of a --workers server: live descendants are
+    found by their parent pid, exited ones are in the parent's child times.
+    """
+    fields = procStat(pid)
+    if fields is None:
+        return None
+    ticks = int(fields[11]) + int(fields[12]) + int(fields[13]) + int(fields[14])
+
+    children = {}  # ppid -> [(pid, utime + stime)]
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            stat = procStat(entry)
+            if stat:
+                children.setdefault(int(stat[1]), []).append((int(entry), int(stat[11]) + int(stat[12])))
+    parents = [pid]
+    while parents:
+        for child, childTicks in children.get(parents.pop(), ()):
+            ticks += childTicks
+            parents.append(child)
+    return ticks / os.sysconf('SC_CLK_TCK')
+
+
+def percentile(values, p):
+    """Return the p-th percentile of a list of numbers (nearest rank)."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def gitCommit():
+    """Return the commit the tree is at, if it is a git checkout."""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Receiver:
+    """Receive RTP for every viewer on one selector, sending their receiver reports."""
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.viewers = []
+        self.nextReport = time.monotonic() + RTCP_INTERVAL
+
+    def add(self, viewer):
+        viewer.rtpSocket.setblocking(False)
+        self.selector.register(viewer.rtpSocket, selectors.EVENT_READ, viewer)
+        self.viewers.append(viewer)
+
+    def run(self, duration):
+        """Receive until duration elapses."""
+        end = time.monotonic() + duration
+        while True:
+            now = time.monotonic()
+            remaining = end - now
+            if remaining <= 0:
+                break
+            if now >= self.nextReport:
+                for viewer in self.viewers:
+                    viewer.sendReport()
+                self.nextReport = now + RTCP_INTERVAL
+            for key, _ in self.selector.select(min(remaining, self.nextReport - now)):
+                viewer = key.data
+                while True:
+                    try:
+                        data = viewer.rtpSocket.recv(RECV_BUFFER_SIZE)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    viewer.handleRtp(data, time.monotonic())
+
+    def close(self):
+        self.selector.close()
+
+
+def summarize(viewers, wall, fps, cpu):
+    """Compute the aggregate results of a run."""
+    totalBytes = sum(v.statBytes for v in viewers)
+    totalFrames = sum(v.statFrames for v in viewers)
+    received = sum(v.statPackets for v in viewers)
+    lost = sum(v.lostPackets() for v in viewers)
+
+    fpsErrors = []
+    latencies = []
+    for v in viewers:
+        if v.statFrames > 1 and v.statLastArrival > v.statFirstArrival:
+            measured = (v.statFrames - 1) / (v.statLastArrival - v.statFirstArrival)
+            fpsErrors.append(abs(measured - fps) / fps * 100)
+        if v.statTransits:
+            best = min(v.statTransits)
+            latencies.extend((t - best) * 1000 for t in v.statTransits)
+
+    return {
+        'viewers': len(viewers),
+        'viewers_receiving': sum(1 for v in viewers if v.statFrames),
+        'throughput_mbps': totalBytes * 8 / wall / 1e6,
+        'frames_per_sec': totalFrames / wall,
+        'packets_per_sec': received / wall,
+        'fps_error_pct_mean': sum(fpsErrors) / len(fpsErrors) if fpsErrors else None,
+        'fps_error_pct_p95': percentile(fpsErrors, 95),
+        'latency_ms_p50': percentile(latencies, 50),
+        'latency_ms_p95': percentile(latencies, 95),
+        'latency_ms_p99': percentile(latencies, 99),
+        'latency_ms_max': max(latencies) if latencies else None,
+        'loss_pct': lost / (received + lost) * 100 if received + lost else 0.0,
+        'frames_discarded': sum(v.reassembler.discarded for v in viewers),
+        'packets_nacked': sum(v.nack.nacked for v in viewers if v.nack),
+        'packets_recovered': sum(v.nack.recovered for v in viewers if v.nack),
+        'server_cpu_pct': cpu / wall * 100 if cpu is not None else None,
+    }
+
+
+def compare(results, baselinePath):
+    """Print the change of every numeric result against a baseline JSON file."""
+    with open(baselinePath) as f:
+        baseline = json.load(f)['results']
+    print("\n{:<22} {:>12} {:>12} {:>9}".format("metric", "baseline", "current", "change"))
+    for name, value in results.items():
+        old = baseline.get(name)
+        if not isinstance(value, (int, float)) or not isinstance(old, (int, float)):
+            continue
+        change = "{:+.1f}%".format((value - old) / old * 100) if old else "-"
+        print("{:<22} {:>12.3f} {:>12.3f} {:>9}".format(name, old, value, change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback load generator for Server.py")
+    parser.add_argument('--viewers', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=10, help="seconds of playback to measure")
+    parser.add_argument('--engine', default='threaded', help="server engine to start")
+    parser.add_argument('--server-arg', action='append', default=[], help="extra argument for Server.py (repeatable)")
+    parser.add_argument('--connect', help="HOST:PORT of an already running server instead of starting one")
+    parser.add_argument('--server-pid', type=int, help="pid of the --connect server, for CPU accounting")
+    parser.add_argument('--media', help="media file to play (default: a synthetic file)")
+    parser.add_argument('--frames', type=int, default=400, help="frames of the synthetic file")
+    parser.add_argument('--frame-size', type=int, default=20000, help="bytes per frame of the synthetic file")
+    parser.add_argument('--fps', type=float, default=20, help="nominal frame rate of the media")
+    parser.add_argument('--ramp', type=float, default=0.002, help="seconds between viewer start-ups")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--compare', help="JSON results of an earlier run to compare with")
+    parser.add_argument('--stats-export', help="append per-viewer receiver statistics to this file (.csv, else JSON lines)")
+    parser.add_argument('--stats-interval', type=float, default=EXPORT_INTERVAL, help="seconds between exported statistics")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='loadgen-')
+    server = None
+    viewers = []
+    receiver = Receiver()
+    try:
+        media = os.path.abspath(args.media) if args.media else tempMedia(workdir, args.frames, args.frame_size)
+        if args.connect:
+            host, port = args.connect.rsplit(':', 1)
+            port = int(port)
+            serverPid = args.server_pid
+        else:
+            host, port = '127.0.0.1', freePort()
+            command = [sys.executable, os.path.join(ROOT, 'Server.py'), str(port), '--engine', args.engine] + args.server_arg
+            server = subprocess.Popen(command, cwd=os.path.dirname(media), stdout=subprocess.DEVNULL)
+            serverPid = server.pid
+            waitForPort(port)
+
+        # Viewers already playing are received from during the ramp, so no backlog builds up
+        for _ in range(args.viewers):
+            viewer = HeadlessClient(host, port, media)
+            viewer.setup()
+            viewer.play()
+            viewers.append(viewer)
+            receiver.add(viewer)
+            receiver.run(args.ramp)
+
+        # Only the measurement window counts
+        for viewer in viewers:
+            viewer.resetStats()
+
+        exporter = None
+        if args.stats_export:
+            exporter = StatsExporter(args.stats_export, {'viewer{}'.format(i): v.reception for i, v in enumerate(viewers)}, args.stats_interval)
+            exporter.start()
+        cpuStart = cpuSeconds(serverPid) if serverPid else None
+        start = time.monotonic()
+        receiver.run(args.duration)
+        wall = time.monotonic() - start
+        cpuEnd = cpuSeconds(serverPid) if serverPid else None
+        if exporter:
+            exporter.stop()
+
+        for viewer in viewers:
+            try:
+                viewer.teardown()
+            except (OSError, RtspError):  # Keep tearing down the others
+                pass
+    finally:
+        receiver.close()
+        for viewer in viewers:
+            viewer.close()
+        if server:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    cpu = cpuEnd - cpuStart if cpuStart is not None and cpuEnd is not None else None
+    results = summarize(viewers, wall, args.fps, cpu)
+    for name, value in results.items():
+        print("{:<22} {}".format(name, "-" if value is None else round(value, 3)))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'commit': gitCommit(), 'config': vars(args), 'results': results}, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
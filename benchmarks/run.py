@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""Microbenchmark suite of the packet and frame hot paths, in one command.
+
+Runs every benchmark (or those matching --filter) on synthetic MJPEG
+fixtures of --frames frames of --frame-size bytes, and reports:
+
+  ops/s          best of REPEAT timing runs of at least 0.2 s each
+  alloc B/op     peak memory traced by tracemalloc during one operation
+  retained/op    memory blocks still allocated after an operation (leaks)
+
+--output saves the results as a baseline; --compare prints the change
+against one and exits non-zero if any benchmark got more than
+--tolerance percent slower. The frame decode benchmark needs Pillow.
+"""
+
+import os, sys, gc, json, timeit, argparse, tempfile, tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from RtpPacket import RtpPacket
+from RtpJpeg import fragmentFrame, FrameReassembler, maxFragmentSize
+from VideoStream import VideoStream
+from ServerWorker import ServerWorker
+from ReceiverStats import ReceiverStats
+from fixtures import makeSyntheticMjpeg, makeDecodableMjpeg
+from loadgen import gitCommit
+
+REPEAT = 5
+ALLOC_OPS = 200  # Operations traced for the allocation figures
+TOLERANCE = 10  # percent slower than the baseline before --compare fails
+
+BENCHMARKS = []  # (name, setup); setup(fixture) returns the operation to time, or None to skip
+
+
+def benchmark(name):
+    """Register a benchmark setup function under a name."""
+    def register(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return register
+
+
+class Fixture:
+    """Synthetic media shared by the benchmarks, made on first use."""
+
+    def __init__(self, directory, frames, frameSize):
+        self.directory = directory
+        self.frames = frames
+        self.frameSize = frameSize
+        self.mediaPath = None
+        self.decodablePath = None
+
+    def media(self):
+        if self.mediaPath is None:
+            self.mediaPath = makeSyntheticMjpeg(os.path.join(self.directory, 'synthetic.Mjpeg'), self.frames, self.frameSize)
+        return self.mediaPath
+
+    def decodable(self):
+        if self.decodablePath is None:
+            self.decodablePath = makeDecodableMjpeg(os.path.join(self.directory, 'decodable.Mjpeg'), min(self.frames, 50))
+        return self.decodablePath
+
+    def frame(self):
+        """Return the first synthetic frame as bytes."""
+        stream = VideoStream(self.media())
+        try:
+            return bytes(stream.getFrame(1))
+        finally:
+            stream.close()
+
+
+class SequencedPacket:
+    """Just the RtpPacket accessors ReceiverStats reads, with settable values."""
+
+    __slots__ = ('seq', 'ts', 'source')
+
+    def __init__(self):
+        self.seq = self.ts = 0
+        self.source = 1
+
+    def seqNum(self):
+        return self.seq
+
+    def timestamp(self):
+        return self.ts
+
+    def ssrc(self):
+        return self.source
+
+
+@benchmark('rtp_encode')
+def rtpEncode(fixture):
+    payload = fixture.frame()[:maxFragmentSize()]
+
+    def op():
+        rtpPacket = RtpPacket()
+        rtpPacket.encode(2, 0, 0, 0, 1234, 1, 26, 0, payload, timestamp=0)
+        return rtpPacket.getBuffers()
+    return op
+
+
+@benchmark('rtp_decode')
+def rtpDecode(fixture):
+    rtpPacket = RtpPacket()
+    rtpPacket.encode(2, 0, 0, 0, 1234, 1, 26, 0, fixture.frame()[:maxFragmentSize()], timestamp=0)
+    packet = bytes(rtpPacket.getPacket())
+
+    def op():
+        rtpPacket = RtpPacket()
+        rtpPacket.decode(packet)
+        return rtpPacket.seqNum(), rtpPacket.getPayload()
+    return op
+
+
+@benchmark('server_make_rtp')
+def serverMakeRtp(fixture):
+    worker = ServerWorker({'ssrc': 1})
+    payload = fixture.frame()[:maxFragmentSize()]
+    return lambda: worker.makeRtp(payload, 1234, 1, 0)
+
+
+@benchmark('server_packetize_frame')
+def serverPacketizeFrame(fixture):
+    worker = ServerWorker({'ssrc': 1})
+    frame = fixture.frame()
+    return lambda: worker.makeRtpFragments(frame, 0)
+
+
+@benchmark('videostream_next_frame')
+def videoStreamNextFrame(fixture):
+    stream = VideoStream(fixture.media())
+
+    def op():
+        frame = stream.nextFrame()
+        if frame is None:
+            stream.seek(0)
+            frame = stream.nextFrame()
+        return frame
+    return op
+
+
+@benchmark('client_reassemble_frame')
+def clientReassembleFrame(fixture):
+    payloads = [header + bytes(chunk) for header, chunk, last in fragmentFrame(fixture.frame())]
+    reassembler = FrameReassembler()
+    clock = [0]
+
+    def op():
+        clock[0] += 4500
+        last = len(payloads) - 1
+        for i, payload in enumerate(payloads):
+            frame = reassembler.push(clock[0], i == last, payload)
+        return frame
+    return op
+
+
+@benchmark('client_decode_frame')
+def clientDecodeFrame(fixture):
+    try:
+        from FramePipeline import decodeFrame
+    except ImportError:  # No Pillow
+        return None
+    stream = VideoStream(fixture.decodable())
+    frame = bytes(stream.getFrame(1))
+    stream.close()
+    return lambda: decodeFrame(frame)
+
+
+@benchmark('client_receiver_stats')
+def clientReceiverStats(fixture):
+    stats = ReceiverStats()
+    packet = SequencedPacket()
+    clock = [0.0]
+
+    def op():
+        packet.seq = (packet.seq + 1) & 0xFFFF
+        packet.ts += 300
+        clock[0] += 1 / 300
+        return stats.update(packet, clock[0], 1400)
+    return op
+
+
+def measure(op):
+    """Return the best rate of op over REPEAT timing runs, in operations per second."""
+    timer = timeit.Timer(op)
+    number, _ = timer.autorange()
+    return number / min(timer.repeat(REPEAT, number))
+
+
+def allocations(op, ops=ALLOC_OPS):
+    """Return (peak bytes traced during one op, blocks retained per op), averaged over ops runs."""
+    op()  # Warm up caches
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    peak = 0
+    for _ in range(ops):
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        op()
+        peak += tracemalloc.get_traced_memory()[1] - current
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    retained = sum(stat.count_diff for stat in after.filter_traces(ignore).compare_to(before.filter_traces(ignore), 'filename'))
+    return peak / ops, retained / ops
+
+
+def compare(results, baselinePath, tolerance):
+    """Print the change of every benchmark against a baseline file. Return the names that regressed."""
+    with open(baselinePath) as f:
+        baseline = json.load(f)['results']
+    print("\n{:<26} {:>14} {:>14} {:>9}".format("benchmark", "baseline ops/s", "current ops/s", "change"))
+    regressed = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if not old:
+            continue
+        change = (result['ops_per_sec'] - old['ops_per_sec']) / old['ops_per_sec'] * 100
+        flag = ''
+        if change < -tolerance:
+            regressed.append(name)
+            flag = '  SLOWER'
+        print("{:<26} {:>14,.0f} {:>14,.0f} {:>+8.1f}%{}".format(name, old['ops_per_sec'], result['ops_per_sec'], change, flag))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the packet and frame hot paths")
+    parser.add_argument('--frames', type=int, default=200, help="frames of the synthetic media")
+    parser.add_argument('--frame-size', type=int, default=20000, help="bytes per synthetic frame")
+    parser.add_argument('--filter', default='', help="run only the benchmarks whose name contains this")
+    parser.add_argument('--list', action='store_true', help="list the benchmarks and exit")
+    parser.add_argument('--output', help="save the results as a baseline JSON file")
+    parser.add_argument('--compare', help="baseline JSON file to compare with")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help="percent slowdown --compare accepts")
+    args = parser.parse_args()
+
+    if args.list:
+        for name, _ in BENCHMARKS:
+            print(name)
+        return 0
+
+    fixture = Fixture(tempfile.mkdtemp(prefix='bench-'), args.frames, args.frame_size)
+    results = {}
+    print("{:<26} {:>14} {:>12} {:>12}".format("benchmark", "ops/s", "alloc B/op", "retained/op"))
+    for name, setup in BENCHMARKS:
+        if args.filter not in name:
+            continue
+        op = setup(fixture)
+        if op is None:
+            print("{:<26} {:>14}".format(name, "skipped"))
+            continue
+        rate = measure(op)
+        allocBytes, retained = allocations(op)
+        results[name] = {'ops_per_sec': rate, 'alloc_bytes_per_op': allocBytes, 'retained_blocks_per_op': retained}
+        print("{:<26} {:>14,.0f} {:>12,.0f} {:>12.2f}".format(name, rate, allocBytes, retained))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'commit': gitCommit(), 'config': vars(args), 'results': results}, f, indent=2)
+    if args.compare and compare(results, args.compare, args.tolerance):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())